@@ -23,11 +23,16 @@ setuptools.setup(
         'Topic :: Office/Business',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3 :: Only',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         ],
     keywords='society group membership',
-    py_modules=['socman'],
+    python_requires='>=3.7',
+    py_modules=['socman', 'socman_cli', 'socman_loadtest', 'socman_server'],
+    entry_points={
+        'console_scripts': ['socman = socman_cli:main'],
+        },
     )
@@ -30,9 +30,28 @@ SOFTWARE.
 """
 
 import collections
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import functools
+import hashlib
+import inspect
+import json
+import logging
 from datetime import date, datetime
+import math
+import mmap
+import os
+import re
 import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import unicodedata
+import warnings
+import zlib
 
 
 class Error(Exception):
@@ -88,6 +107,22 @@ class MemberNotFoundError(Error):
         self.member = member
 
 
+class AmbiguousBarcodeError(Error):
+
+    """Raised when a truncated barcode matches more than one member.
+
+    Attributes:
+        member: the member object searched for
+        barcodes: a list of (some of) the barcodes matched
+    """
+
+    def __init__(self, member, barcodes, *args):
+        """Create an AmbiguousBarcodeError for `member` and its matches."""
+        Error.__init__(self, *args)
+        self.member = member
+        self.barcodes = barcodes
+
+
 class Name:
 
     """A person's name.
@@ -141,9 +176,11 @@ class Name:
     def __makestr(self, names):
         """Return arguments concatenated together separated by `self.sep`.
 
-        Arguments that equal `None` or are entirely whitespace are omitted.
+        Arguments that equal `None` or are entirely whitespace are omitted,
+        and whitespace surrounding the others is stripped.
         """
-        return self.sep.join([name for name in names if name and name.strip()])
+        return self.sep.join([name.strip() for name in names
+                              if name and name.strip()])
 
     def first(self):
         """Return first name as a string."""
@@ -175,6 +212,484 @@ Member.__doc__ = """
                  given explicitly.
                  """
 
+MergeReport = collections.namedtuple('MergeReport',
+                                     'inserted updated unchanged')
+MergeReport.__doc__ = """
+                      Counts of the records handled by a merge.
+
+                      `inserted` records were new, `updated` records changed
+                      an existing row and `unchanged` records were already
+                      present and no newer than the existing row.
+                      """
+
+ReconcileReport = collections.namedtuple('ReconcileReport',
+                                         'matched new changed missing')
+ReconcileReport.__doc__ = """
+                          The differences found by a roster reconciliation.
+
+                          `matched` counts roster members already present
+                          unchanged; `new` and `changed` list the roster's
+                          Members absent from or differing from the database
+                          and `missing` lists the database's Members absent
+                          from the roster.
+                          """
+
+ChangelogEntry = collections.namedtuple(
+    'ChangelogEntry', 'seq operation member_id barcode changed_at')
+ChangelogEntry.__doc__ = """
+                         A change to the `users` table.
+
+                         `operation` is 'insert', 'update' or 'delete',
+                         `member_id` and `barcode` identify the row and `seq`
+                         increases monotonically with each change.
+                         """
+
+MemberRecord = collections.namedtuple(
+    'MemberRecord',
+    'id firstName lastName barcode datejoined created_at updated_at '
+    'college last_attended unpaid')
+MemberRecord.__new__.__defaults__ = (None, ) * len(MemberRecord._fields)
+MemberRecord.__doc__ = """
+                       A complete row of the `users` table.
+
+                       Fields are named after the table's columns and appear
+                       in the same order as in CSV exports.
+                       """
+
+MemoryReport = collections.namedtuple('MemoryReport',
+                                      'operation peak retained seconds')
+MemoryReport.__doc__ = """
+                       The memory used by one operation, in bytes.
+
+                       `peak` is the most memory the operation had allocated
+                       at once and `retained` the memory still allocated when
+                       it finished, both counted from its start. `seconds`
+                       is its duration, slowed by tracing.
+                       """
+
+
+MaintenanceReport = collections.namedtuple(
+    'MaintenanceReport', 'size_before size_after timings interrupted '
+    'integrity')
+MaintenanceReport.__doc__ = """
+                            The outcome of `MemberDatabase.maintain`.
+
+                            Sizes are of the database file in bytes and
+                            `timings` maps each step run to its duration in
+                            seconds. `interrupted` names the step cut short
+                            by the time budget, if any. `integrity` is 'ok',
+                            a list of the problems found, or None if the
+                            check did not complete.
+                            """
+
+
+def _synchronized(method):
+    """Decorate a method to hold its object's lock (`self._lock`)."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _profiled(method):
+    """Decorate a bulk MemberDatabase method to be measured by its profiler.
+
+    Generator methods are measured from their first item to their last.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profiler = self.memory_profiler
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        if inspect.isgeneratorfunction(method):
+            return profiler.iterate(method.__name__,
+                                    method(self, *args, **kwargs))
+        with profiler.measure(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# create_function options for pure functions, where supported
+_DETERMINISTIC = ({'deterministic': True} if sys.version_info >= (3, 8) and
+                  sqlite3.sqlite_version_info >= (3, 8, 3) else {})
+
+_INTEGER_BARCODE = re.compile(r'\s*[+-]?[0-9]+\s*$')
+
+
+def _barcode_key(barcode):
+    """Return the canonical form of `barcode`, under which it is indexed.
+
+    The `users.barcode` column has INTEGER affinity, so SQLite stores a
+    barcode of digits as a number, dropping surrounding whitespace and
+    leading zeros. The canonical form matches: the decimal integer for such
+    barcodes and the stripped text of any other. See `BARCODE_KEY_SQL`.
+
+    Barcodes of digits too long for a 64-bit integer are stored as inexact
+    REALs, from which the key cannot be recovered, so MemberDatabase writes
+    the key alongside every barcode it stores.
+    """
+    if isinstance(barcode, int):
+        return str(barcode)
+    barcode = str(barcode)
+    if _INTEGER_BARCODE.match(barcode):
+        return str(int(barcode))
+    return barcode.strip()
+
+
+def _name_key(name):
+    """Return the normalized form of a name, under which it is indexed.
+
+    The key is case folded, stripped of accents and has runs of whitespace
+    collapsed to single spaces, so 'ted  bobson' matches 'Ted Bobson' and
+    'Zoe' matches 'Zo\u00eb'. Empty names have no key (None).
+    """
+    if not name:
+        return None
+    decomposed = unicodedata.normalize('NFKD', name)
+    folded = ''.join(char for char in decomposed
+                     if not unicodedata.combining(char)).casefold()
+    return ' '.join(folded.split()) or None
+
+
+class BarcodeSnapshot:
+
+    """A read-only, memory-mapped snapshot of barcode to member details.
+
+    Snapshot files are written by `MemberDatabase.write_snapshot` and map each
+    barcode to a (first name, last name, college) tuple. The file is laid out
+    as a fixed size header, a sorted table of fixed width (NUL padded)
+    barcode keys, a table of record offsets and finally the records
+    themselves, each a sequence of length prefixed UTF-8 strings.
+
+    Lookups binary search the key table directly in the mapped file, so
+    opening a snapshot costs nothing beyond mapping it and lookups do not
+    touch a database at all.
+
+    Attributes:
+        filename:   path of the snapshot file
+    """
+
+    MAGIC = b'SOCSNAP1'
+    HEADER = struct.Struct('<8sII')
+    OFFSET = struct.Struct('<I')
+    LENGTH = struct.Struct('<H')
+
+    class BadSnapshotError(Error):
+
+        """Raised when a file is not a valid barcode snapshot.
+
+        Attributes:
+            filename: the name of the bad file
+        """
+
+        def __init__(self, filename, *args):
+            """Create a BadSnapshotError for snapshot file `filename`."""
+            Error.__init__(self, *args)
+            self.filename = filename
+
+    def __init__(self, filename):
+        """Open and map the snapshot file `filename` for reading."""
+        self.filename = filename
+        with open(filename, 'rb') as snapshot_file:
+            self.__map = mmap.mmap(snapshot_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        if len(self.__map) < self.HEADER.size:
+            self.close()
+            raise BarcodeSnapshot.BadSnapshotError(filename)
+        magic, self.__count, self.__width = self.HEADER.unpack_from(
+            self.__map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise BarcodeSnapshot.BadSnapshotError(filename)
+        self.__keys = self.HEADER.size
+        self.__offsets = self.__keys + self.__count * self.__width
+
+    def __len__(self):
+        return self.__count
+
+    def __contains__(self, barcode):
+        return self.__find(barcode) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the snapshot file."""
+        self.__map.close()
+
+    def __find(self, barcode):
+        """Return the index of `barcode` in the key table, or None."""
+        key = _barcode_key(barcode).encode('utf-8')
+        if not key or len(key) > self.__width:
+            return None
+        key = key.ljust(self.__width, b'\0')
+
+        width = self.__width
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.__keys + middle * width
+            probe = self.__map[start:start + width]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def __read_string(self, offset):
+        length, = self.LENGTH.unpack_from(self.__map, offset)
+        offset += self.LENGTH.size
+        return (self.__map[offset:offset + length].decode('utf-8'),
+                offset + length)
+
+    def lookup(self, barcode):
+        """Return (first name, last name, college) for `barcode`.
+
+        Returns None if the barcode is not in the snapshot.
+        """
+        index = self.__find(barcode)
+        if index is None:
+            return None
+        offset, = self.OFFSET.unpack_from(
+            self.__map, self.__offsets + index * self.OFFSET.size)
+        first_name, offset = self.__read_string(offset)
+        last_name, offset = self.__read_string(offset)
+        college, offset = self.__read_string(offset)
+        return first_name, last_name, college
+
+    @classmethod
+    def write(cls, filename, records):
+        """Write a snapshot file from an iterable of records.
+
+        Arguments:
+            filename:   path of the snapshot file to write; it is replaced
+                        atomically so readers never see a partial file
+            records:    iterable of (barcode, first, last, college) tuples;
+                        records with an empty barcode are skipped and only
+                        the first record for a repeated barcode is kept
+
+        Returns:
+            The number of records written.
+        """
+        entries = {}
+        for barcode, first_name, last_name, college in records:
+            if barcode is None:
+                continue
+            key = _barcode_key(barcode).encode('utf-8')
+            if key and key not in entries:
+                entries[key] = b''.join(
+                    cls.LENGTH.pack(len(value)) + value
+                    for value in (str(field or '').encode('utf-8')
+                                  for field in (first_name, last_name,
+                                                college)))
+
+        keys = sorted(entries)
+        width = max((len(key) for key in keys), default=0)
+        data_start = (cls.HEADER.size + len(keys) * width +
+                      len(keys) * cls.OFFSET.size)
+
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as snapshot_file:
+            snapshot_file.write(cls.HEADER.pack(cls.MAGIC, len(keys), width))
+            for key in keys:
+                snapshot_file.write(key.ljust(width, b'\0'))
+            offset = data_start
+            for key in keys:
+                snapshot_file.write(cls.OFFSET.pack(offset))
+                offset += len(entries[key])
+            for key in keys:
+                snapshot_file.write(entries[key])
+        os.replace(temp_filename, filename)
+        return len(keys)
+
+
+class BarcodeFilter:
+
+    """A Bloom filter over member barcodes.
+
+    A Bloom filter answers membership queries with no false negatives but
+    some false positives: if a barcode is not in the filter it is definitely
+    not in the database, while a barcode in the filter is only probably in
+    the database. This lets `MemberDatabase.get_member` reject unknown
+    barcodes without querying the database.
+
+    Attributes:
+        capacity:   the number of barcodes the filter is sized for
+        error_rate: the target false positive rate at `capacity` barcodes
+        count:      the number of barcodes added so far
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """Create an empty filter sized for `capacity` barcodes.
+
+        Arguments:
+            capacity:   expected number of barcodes; the false positive rate
+                        rises above `error_rate` if more are added
+            error_rate: target false positive rate, between 0 and 1
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.count = 0
+        self.__bits = max(int(math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.__hashes = max(int(round(
+            self.__bits / self.capacity * math.log(2))), 1)
+        self.__array = bytearray((self.__bits + 7) // 8)
+
+    def __positions(self, barcode):
+        # double hashing: derive every bit position from two 64 bit hashes
+        digest = hashlib.blake2b(_barcode_key(barcode).encode('utf-8'),
+                                 digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.__bits
+                for i in range(self.__hashes))
+
+    def add(self, barcode):
+        """Add `barcode` to the filter."""
+        for position in self.__positions(barcode):
+            self.__array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, barcode):
+        return all(self.__array[position >> 3] & (1 << (position & 7))
+                   for position in self.__positions(barcode))
+
+    def __len__(self):
+        return self.count
+
+    def false_positive_rate(self):
+        """Return the estimated false positive rate at the current count."""
+        return (1 - math.exp(-self.__hashes * self.count / self.__bits)
+                ) ** self.__hashes
+
+
+class MemoryProfiler:
+
+    """Measure the memory allocated by operations, using tracemalloc.
+
+    Pass one to MemberDatabase as `memory_profiler` and every bulk operation
+    (exports, imports, counts, batch lookups, migrations...) appends a
+    MemoryReport to `reports`:
+
+        >>> profiler = MemoryProfiler()
+        >>> db = MemberDatabase('members.db', memory_profiler=profiler)
+        >>> db.write_csv('members.csv')
+        >>> profiler.reports[-1].peak
+
+    Only memory allocated by Python is traced, not SQLite's own page cache.
+    Operations returning iterators are measured until exhausted or closed,
+    so include whatever the caller allocates meanwhile. Only the outermost
+    of nested operations is measured. Tracing slows allocation several
+    times, so profile only when investigating. If something else is already
+    tracing, before Python 3.9 the peak cannot be reset, so it may include
+    allocations from before the operation.
+
+    Attributes:
+        reports:    a MemoryReport for each operation measured, oldest first
+    """
+
+    def __init__(self):
+        """Create a MemoryProfiler with no reports."""
+        self.reports = []
+        self.__measuring = False
+
+    @contextlib.contextmanager
+    def measure(self, operation):
+        """Measure the body of a with block as `operation`."""
+        if self.__measuring:
+            yield
+            return
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        self.__measuring = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            self.__measuring = False
+            self.reports.append(MemoryReport(operation, peak - before,
+                                             current - before, seconds))
+
+    def iterate(self, operation, iterable):
+        """Yield the items of `iterable`, measuring the iteration."""
+        with self.measure(operation):
+            yield from iterable
+
+    def peak(self, operation):
+        """Return the greatest peak of the reports for `operation`."""
+        return max(report.peak for report in self.reports
+                   if report.operation == operation)
+
+
+class MaintenanceScheduler:
+
+    """Run database maintenance in the idle moments of a long-running process.
+
+    Call `activity` whenever the database is used and `poll` whenever the
+    process has nothing else to do, e.g. from a timer. `poll` runs
+    `MemberDatabase.maintain` once the database has been idle for `idle`
+    seconds, and then at most once every `interval` seconds.
+
+    Attributes:
+        db:         the MemberDatabase maintained
+        interval:   the least number of seconds between maintenance runs
+        idle:       the seconds without activity before maintenance runs
+        budget:     the time budget of each run, in seconds
+        log:        passed to `MemberDatabase.maintain`
+        last_report:    the MaintenanceReport of the last run, or None
+    """
+
+    def __init__(self, db, interval=3600.0, idle=60.0, budget=5.0, log=None):
+        """Create a scheduler for MemberDatabase `db`."""
+        self.db = db
+        self.interval = interval
+        self.idle = idle
+        self.budget = budget
+        self.log = log
+        self.last_report = None
+        self.__last_activity = time.monotonic()
+        self.__last_run = None
+
+    def activity(self):
+        """Record that the database is in use, postponing maintenance."""
+        self.__last_activity = time.monotonic()
+
+    def next_due(self):
+        """Return the seconds until maintenance is due if activity stops."""
+        due = self.__last_activity + self.idle
+        if self.__last_run is not None:
+            due = max(due, self.__last_run + self.interval)
+        return max(due - time.monotonic(), 0.0)
+
+    def poll(self):
+        """Run maintenance if it is due.
+
+        Returns:
+            The run's MaintenanceReport, or None if it was not due.
+        """
+        if self.next_due() > 0:
+            return None
+        self.last_report = self.db.maintain(self.budget, log=self.log)
+        self.__last_run = time.monotonic()
+        return self.last_report
+
 
 class MemberDatabase:
 
@@ -199,7 +714,41 @@ class MemberDatabase:
             Error.__init__(self, *args)
             self.authority_string = authority_string
 
-    def __init__(self, db_file='members.db', safe=True):
+    SCHEMA = ("""CREATE TABLE IF NOT EXISTS users ("""
+              """id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, """
+              """firstName VARCHAR(255), """
+              """lastName VARCHAR(255), """
+              """barcode INTEGER, """
+              """datejoined DATE, """
+              """created_at DATETIME, """
+              """updated_at DATETIME, """
+              """college VARCHAR(255), """
+              """last_attended DATE, """
+              """unpaid BOOLEAN, """
+              """barcode_key TEXT, """
+              """firstName_key VARCHAR(255), """
+              """lastName_key VARCHAR(255), """
+              """college_id INTEGER REFERENCES colleges (id))""")
+
+    # colleges, stored once each and referred to from `users.college_id`,
+    # and the spellings of college names mapped to them
+    COLLEGES_SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS colleges ('
+        'id INTEGER PRIMARY KEY NOT NULL, '
+        'name VARCHAR(255) NOT NULL UNIQUE COLLATE NOCASE)',
+        'CREATE TABLE IF NOT EXISTS college_aliases ('
+        'alias VARCHAR(255) PRIMARY KEY NOT NULL COLLATE NOCASE, '
+        'college_id INTEGER NOT NULL REFERENCES colleges (id))')
+
+    # SQL for the canonical form of a barcode, as `_barcode_key` computes
+    # (except for barcodes stored as inexact REALs)
+    BARCODE_KEY_SQL = ("CASE typeof({0}) WHEN 'integer' THEN CAST({0} AS TEXT)"
+                       " ELSE NULLIF(TRIM({0}), '') END")
+
+    def __init__(self, db_file='members.db', safe=True, snapshot=None,
+                 check_same_thread=True, commit_every=None,
+                 commit_interval=None, barcode_prefix_length=None,
+                 memory_profiler=None, replica=False):
         """Create a MemberDatabase.
 
         Arguments:
@@ -209,13 +758,672 @@ class MemberDatabase:
                         operations are committed immediately or not
                         Note that important operations like adding a member
                         are always committed regardless of this setting.
+            snapshot:   An optional BarcodeSnapshot used as a read-through
+                        tier for barcode lookups in `get_member`. Barcodes
+                        missing from the snapshot, or written through this
+                        MemberDatabase since it was opened, are looked up in
+                        the database as usual.
+            check_same_thread:  Passed to sqlite3.connect() if False, to allow
+                                the database to be used from several threads
+                                (one at a time).
+            commit_every:       Group commit: if given, non essential
+                                operations are committed once this many are
+                                pending, instead of as `safe` determines.
+            commit_interval:    Group commit: if given, pending non essential
+                                operations are committed at most this many
+                                seconds after the first of them, by a timer
+                                thread if the database is idle.
+            barcode_prefix_length:  If given, barcodes of exactly this many
+                                    characters are taken to be truncated by
+                                    the scanner, and looked up as a prefix
+                                    of the stored barcodes (see
+                                    `match_barcode_prefix`).
+            memory_profiler:    An optional MemoryProfiler to measure the
+                                memory used by bulk operations. It may also
+                                be set or cleared later as the
+                                `memory_profiler` attribute.
+            replica:    If True, copy the database file into memory and
+                        serve every read from the copy, writing changes
+                        through to the file when they are committed.
+
+        Group commit picks a point between `safe=True`, which commits (and so
+        fsyncs) after every scan, and `safe=False`, which may lose a whole
+        session in a crash: at most `commit_every` operations or
+        `commit_interval` seconds of operations are lost.
+
+        A replica suits a short event whose member table fits in memory:
+        lookups take microseconds instead of reading the file. The file
+        stays the durable copy. Each commit writes the rows changed since
+        the last one to it in a single transaction, so group commit batches
+        the file's writes while `add_member` still reaches the file at once.
+        Schema changes are copied to the file too. Other connections must
+        not write the file meanwhile: the replica would not see their
+        changes. The file's own triggers, like those of `enable_changelog`,
+        see each flushed row once, as an insert, update or delete. Replicas
+        need SQLite 3.24 or later.
         """
-        self.__connection = sqlite3.connect(db_file)
+        self.__closed = True  # until connected, in case connect() fails
+        connect_args = {}
+        if not check_same_thread or commit_interval is not None:
+            connect_args['check_same_thread'] = False
+        if replica:
+            self.__connection = self.__open_replica(db_file, connect_args)
+        else:
+            self.__connection = sqlite3.connect(db_file, **connect_args)
+        self.__db_file = db_file
+        self.__replica = replica
+        self.__replica_tables = set()
+        self.__schema_version = None
         self.__safe = safe
+        self.__snapshot = snapshot
+        # barcode keys whose snapshot entries our own writes made stale
+        self.__snapshot_stale = set()
+        self.__barcode_filter = None
+        self.__barcode_cache = None
+        self.__attended = {}
+        self.__archive = None
+        self.__history = []
+        self.__indexes = set()
+        self.__keyed = None
+        self.__prefix_length = barcode_prefix_length
+        self.__name_keyed = False
+        self.__colleges = False
+        self.memory_profiler = memory_profiler
+        self.__connection.create_function('socman_name_key', 1, _name_key,
+                                          **_DETERMINISTIC)
+        indexes = [row[1] for row in
+                   self.__connection.execute('PRAGMA index_list(users)')]
+        if 'users_name_key' in indexes:
+            self.__create_name_key_triggers()
+            self.__name_keyed = True
+        self.__colleges = 'users_college_id' in indexes
+        if replica:
+            self.__replicate_schema()
+        self.__transaction_depth = 0
+        self.__commit_every = commit_every
+        self.__commit_interval = commit_interval
+        self.__pending = 0
+        self.__commit_timer = None
+        self._lock = threading.RLock()
+        self.__closed = False
+        if self.__name_keyed:
+            self.__backfill_name_keys()
+            self.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.__connection.rollback()
+        self.close()
 
     def __del__(self):
-        self.__connection.commit()  # here, commit regardless of safe
+        # a safety net only: use close() or a with block to shut down
+        if not self.__closed:
+            warnings.warn('MemberDatabase was not closed', ResourceWarning)
+            self.close()
+
+    @_synchronized
+    def close(self):
+        """Commit pending changes and close the database connection.
+
+        Any open transaction is committed. The database cannot be used once
+        closed; closing it again does nothing.
+        """
+        if self.__closed:
+            return
+        self.__transaction_depth = 0
+        self.__commit_now()  # here, commit regardless of safe
         self.__connection.close()
+        self.__closed = True
+
+    def __commit_now(self):
+        """Commit, resetting the group commit state."""
+        self.__pending = 0
+        if self.__commit_timer is not None:
+            self.__commit_timer.cancel()
+            self.__commit_timer = None
+        if self.__attended:
+            self.__write_attendance()
+        if self.__replica:
+            self.__flush_replica()
+        self.__connection.commit()
+
+    # tables filled by triggers on `users`, which the file's own copies of
+    # the triggers fill as changes to `users` are written through
+    REPLICA_DERIVED_TABLES = ('changelog', )
+
+    @staticmethod
+    def __open_replica(db_file, connect_args):
+        """Return a `:memory:` connection holding a copy of `db_file`.
+
+        The file is attached to it as `socman_disk`, and a temporary table
+        records the rows to write through to it.
+
+        Raises:
+            Error: SQLite is too old for the upserts writing to the file
+        """
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            raise Error('replica mode needs SQLite 3.24 or later, not '
+                        '{}'.format(sqlite3.sqlite_version))
+        connection = sqlite3.connect(':memory:', **connect_args)
+        disk = sqlite3.connect(db_file)
+        try:
+            disk.backup(connection)
+        finally:
+            disk.close()
+        connection.execute('ATTACH DATABASE ? AS socman_disk', (db_file, ))
+        connection.execute('CREATE TEMP TABLE socman_dirty ('
+                           'tbl TEXT NOT NULL, row INTEGER NOT NULL, '
+                           'PRIMARY KEY (tbl, row)) WITHOUT ROWID')
+        return connection
+
+    def __replicate_schema(self):
+        """Bring the file's schema up to date with the replica's.
+
+        Tables, indexes, triggers and views missing from the file are
+        created there, and those since dropped are dropped; tables gain the
+        columns added since. Changes to new tables are tracked from now
+        on, and the rows already in them are written through at the next
+        flush.
+        """
+        select = ("SELECT type, name, sql FROM {}.sqlite_master "
+                  "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+                  "ORDER BY type='trigger', type='view', type='index'")
+        replica = {(kind, name): sql for kind, name, sql in
+                   self.__connection.execute(select.format('main'))}
+        disk = {(kind, name): sql for kind, name, sql in
+                self.__connection.execute(select.format('socman_disk'))}
+        for (kind, name), sql in disk.items():
+            if kind != 'table' and replica.get((kind, name)) != sql:
+                self.__connection.execute('DROP {} socman_disk."{}"'.format(
+                    kind.upper(), name))
+            elif kind == 'table' and (kind, name) not in replica:
+                self.__connection.execute(
+                    'DROP TABLE socman_disk."{}"'.format(name))
+        for (kind, name), sql in replica.items():
+            if kind == 'table' and (kind, name) in disk:
+                columns = self.__table_columns('socman_disk.' + name)
+                for row in self.__connection.execute(
+                        'PRAGMA main.table_info("{}")'.format(name)):
+                    if row[1] not in columns:
+                        self.__connection.execute(
+                            'ALTER TABLE socman_disk."{}" ADD COLUMN '
+                            '"{}" {}'.format(name, row[1], row[2]))
+            elif disk.get((kind, name)) != sql:
+                self.__connection.execute(re.sub(
+                    r'^(CREATE (?:UNIQUE )?\w+ )', r'\1socman_disk.', sql))
+                if kind == 'table':
+                    self.__connection.execute(
+                        'INSERT OR IGNORE INTO temp.socman_dirty '
+                        'SELECT ?, rowid FROM main."{}"'.format(name),
+                        (name, ))
+            if (kind == 'table' and name not in self.__replica_tables
+                    and name not in self.REPLICA_DERIVED_TABLES):
+                self.__track_replica_table(name)
+        self.__schema_version = self.__connection.execute(
+            'PRAGMA main.schema_version').fetchone()[0]
+
+    def __track_replica_table(self, table):
+        """Record the rows of `table` changed in the replica."""
+        for event, rows in (('INSERT', ('NEW', )), ('DELETE', ('OLD', )),
+                            ('UPDATE', ('OLD', 'NEW'))):
+            self.__connection.execute(
+                'CREATE TEMP TRIGGER IF NOT EXISTS "socman_dirty_{0}_{1}" '
+                'AFTER {1} ON main."{0}" BEGIN {2} END'.format(
+                    table, event, ' '.join(
+                        "INSERT OR IGNORE INTO socman_dirty "
+                        "VALUES ('{}', {}.rowid);".format(table, row)
+                        for row in rows)))
+        self.__replica_tables.add(table)
+
+    def __flush_replica(self):
+        """Write the rows changed in the replica through to the file.
+
+        This runs in the replica's transaction, so the file is written when
+        it commits.
+        """
+        if self.__connection.execute('PRAGMA main.schema_version').fetchone(
+                )[0] != self.__schema_version:
+            self.__replicate_schema()
+        tables = [row[0] for row in self.__connection.execute(
+            'SELECT DISTINCT tbl FROM temp.socman_dirty')]
+        for table in tables:
+            columns = ','.join('"{}"'.format(column) for column in
+                               self.__table_columns('main.' + table))
+            dirty = 'rowid IN (SELECT row FROM temp.socman_dirty WHERE tbl=?)'
+            self.__connection.execute(
+                'DELETE FROM socman_disk."{0}" WHERE {1} AND rowid NOT IN '
+                '(SELECT rowid FROM main."{0}")'.format(table, dirty),
+                (table, ))
+            self.__connection.execute(
+                'INSERT INTO socman_disk."{0}" (rowid,{1}) '
+                'SELECT rowid,{1} FROM main."{0}" WHERE {2} '
+                'ON CONFLICT (rowid) DO UPDATE SET ({1})=({3}) '
+                'WHERE ({1}) IS NOT ({3})'.format(
+                    table, columns, dirty, ','.join(
+                        'excluded.' + column
+                        for column in columns.split(','))),
+                (table, ))
+        if tables:
+            self.__connection.execute('DELETE FROM temp.socman_dirty')
+
+    @_synchronized
+    def commit(self):
+        """Commit any pending changes to the database.
+
+        Inside a `transaction` block this does nothing: the changes are
+        committed when the outermost block ends.
+        """
+        if not self.__transaction_depth:
+            self.__commit_now()
+
+    @_synchronized
+    def __timed_commit(self):
+        """Commit pending operations when the group commit timer fires."""
+        self.__commit_timer = None
+        if self.__pending and not self.__closed:
+            self.commit()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Return a context manager grouping operations into one transaction.
+
+        Every operation inside the block, including those that would
+        otherwise commit immediately like `add_member`, shares a single
+        commit made when the block ends. If the block raises an exception,
+        all of its changes are rolled back. Blocks can be nested: an inner
+        block uses a savepoint, so an exception rolls back only the inner
+        block's changes (unless it propagates to the outer block too).
+
+            >>> with db.transaction():
+            ...     for member in members:
+            ...         db.add_member(member)
+        """
+        depth = self.__transaction_depth
+        savepoint = 'socman_{:d}'.format(depth)
+        if depth:
+            self.__connection.execute('SAVEPOINT ' + savepoint)
+        self.__transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.__transaction_depth = depth
+            if depth:
+                self.__connection.execute('ROLLBACK TO ' + savepoint)
+                self.__connection.execute('RELEASE ' + savepoint)
+            else:
+                self.__connection.rollback()
+                self.__attended = {}
+            if self.__barcode_cache is not None:
+                # the triggers' changes to the cache are not rolled back
+                self.__load_barcode_cache()
+            raise
+        self.__transaction_depth = depth
+        if depth:
+            self.__connection.execute('RELEASE ' + savepoint)
+        else:
+            self.__commit_now()
+
+    def create_schema(self):
+        """Create the `users` table if the database does not have one.
+
+        A new table gets an indexed `barcode_key` column; an existing table
+        without one can be given it with `migrate_barcode_keys`.
+        """
+        self.__connection.execute(self.SCHEMA)
+        columns = self.__columns()
+        if 'barcode_key' in columns:
+            self.__create_barcode_key_triggers()
+            self.__create_barcode_key_index()
+        if 'lastName_key' in columns:
+            self.__create_name_key_triggers()
+            self.__create_name_key_index()
+        if 'college_id' in columns:
+            self.__create_colleges()
+        self.commit()
+
+    def __create_colleges(self):
+        """Create the colleges tables, with the triggers and index using them.
+
+        Once created, a college name written to `users.college` by any
+        program is replaced by the id of the college it names (see
+        `add_college_alias`), the college being added if new.
+        """
+        for sql in self.COLLEGES_SCHEMA:
+            self.__connection.execute(sql)
+        college_id = ('(SELECT college_id FROM college_aliases '
+                      'WHERE alias=TRIM(NEW.college))')
+        for name, event in (('insert', 'INSERT'),
+                            ('update', 'UPDATE OF college')):
+            self.__connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS users_college_{0} AFTER {1} '
+                "ON users WHEN TRIM(NEW.college) != '' BEGIN "
+                'INSERT OR IGNORE INTO colleges (name) '
+                'SELECT TRIM(NEW.college) WHERE {2} IS NULL; '
+                'INSERT OR IGNORE INTO college_aliases (alias, college_id) '
+                'SELECT name, id FROM colleges '
+                'WHERE name=TRIM(NEW.college); '
+                'UPDATE users SET college=NULL, college_id={2} '
+                'WHERE id=NEW.id; END'.format(name, event, college_id))
+        self.__connection.execute(
+            'CREATE TRIGGER IF NOT EXISTS users_college_clear AFTER UPDATE '
+            "OF college ON users WHEN TRIM(NEW.college) = '' BEGIN "
+            'UPDATE users SET college_id=NULL WHERE id=NEW.id; END')
+        # college filters and counts use college_id once this index exists
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS '
+                                  'users_college_id ON users (college_id)')
+        self.__colleges = True
+        if self.__connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='trigger' "
+                "AND name='users_changelog_update'").fetchone():
+            self.__create_changelog_triggers()
+
+    def __college_sql(self, table='users'):
+        """Return SQL for the college name of a row of `table`."""
+        if not self.__colleges:
+            return table + '.college'
+        return ('COALESCE((SELECT name FROM colleges WHERE '
+                'colleges.id={0}.college_id), {0}.college)'.format(table))
+
+    def __college_name_sql(self, value):
+        """Return SQL for the college named by the spelling `value`."""
+        if not self.__colleges:
+            return value
+        return ('COALESCE((SELECT colleges.name FROM college_aliases JOIN '
+                'colleges ON colleges.id=college_aliases.college_id '
+                'WHERE alias=TRIM({0})), {0})'.format(value))
+
+    @_profiled
+    def migrate_colleges(self, aliases=None, chunk_size=1000):
+        """Move college names from `users` rows to a `colleges` table.
+
+        Each college is stored once in `colleges` and rows refer to it by
+        the indexed integer `college_id`, so rows are smaller (once the
+        file is vacuumed) and college filters and `college_counts` use the
+        index alone. Every API still takes and returns college names:
+        names written to `users.college` are translated by triggers, and
+        reads look the names up. Rows are rewritten `chunk_size` at a time
+        as `migrate_barcode_keys` does.
+
+        Arguments:
+            aliases:    optional dict mapping variant spellings to college
+                        names, added with `add_college_alias` before any
+                        rows are migrated
+
+        Returns:
+            The number of rows rewritten.
+        """
+        with self._lock:
+            tables = ['users']
+            if self.__archive is not None:
+                tables.append(self.__archive)
+            elif self.__table_columns('users_archive'):
+                tables.append('users_archive')
+            for table in tables:
+                if 'college_id' not in self.__table_columns(table):
+                    self.__connection.execute(
+                        'ALTER TABLE {} ADD COLUMN college_id INTEGER '
+                        'REFERENCES colleges (id)'.format(table))
+            self.__create_colleges()
+            self.commit()
+
+        for alias, college in (aliases or {}).items():
+            self.add_college_alias(alias, college)
+        return self.__rewrite_in_chunks('college=college',
+                                        "TRIM(college) != ''", chunk_size)
+
+    @_synchronized
+    def add_college_alias(self, alias, college):
+        """Record `alias` as another spelling of the college `college`.
+
+        Names are compared regardless of case, so only other variants
+        need aliases. Members already stored under `alias`, as a college
+        of its own, are moved to `college`. Aliases may be added before
+        `migrate_colleges`, which then uses them.
+        """
+        alias, college = alias.strip(), college.strip()
+        cursor = self.__connection.cursor()
+        for sql in self.COLLEGES_SCHEMA:
+            cursor.execute(sql)
+        cursor.execute('INSERT OR IGNORE INTO colleges (name) VALUES (?)',
+                       (college, ))
+        cursor.execute('INSERT OR IGNORE INTO college_aliases '
+                       '(alias, college_id) SELECT name, id FROM colleges '
+                       'WHERE name=?', (college, ))
+        cursor.execute('SELECT college_id FROM college_aliases WHERE alias=?',
+                       (college, ))
+        college_id = cursor.fetchone()[0]
+        cursor.execute('SELECT college_id FROM college_aliases WHERE alias=?',
+                       (alias, ))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute('INSERT INTO college_aliases (alias, college_id) '
+                           'VALUES (?, ?)', (alias, college_id))
+        elif row[0] != college_id:
+            # the alias was a college of its own: merge it into `college`
+            for table in ('users', 'users_archive', 'college_aliases'):
+                if 'college_id' in self.__table_columns(table):
+                    cursor.execute('UPDATE {} SET college_id=? '
+                                   'WHERE college_id=?'.format(table),
+                                   (college_id, row[0]))
+            cursor.execute('DELETE FROM colleges WHERE id=?', (row[0], ))
+        self.commit()
+
+    def college_counts(self):
+        """Return a dict mapping each college to its number of members.
+
+        Members with no college are not counted.
+        """
+        cursor = self.__connection.cursor()
+        if self.__colleges:
+            cursor.execute(
+                'SELECT colleges.name, counts.members FROM (SELECT '
+                'college_id, COUNT(*) AS members FROM users WHERE college_id '
+                'IS NOT NULL GROUP BY college_id) counts JOIN colleges ON '
+                'colleges.id=counts.college_id ORDER BY colleges.name')
+        else:
+            self.__ensure_index('college')
+            cursor.execute("SELECT college, COUNT(*) FROM users WHERE "
+                           "college IS NOT NULL AND college != '' "
+                           'GROUP BY college ORDER BY college')
+        return dict(cursor.fetchall())
+
+    def __create_barcode_key_triggers(self):
+        """Create triggers keeping `barcode_key` in step with `barcode`.
+
+        This MemberDatabase sets the key itself whenever it writes a
+        barcode (see `_barcode_key`); the triggers fill it in for writes
+        which do not. Triggers from older versions are replaced.
+        """
+        for name, event, when in (
+                ('insert', 'INSERT', 'NEW.barcode_key IS NULL'),
+                ('update', 'UPDATE OF barcode',
+                 'NEW.barcode_key IS OLD.barcode_key AND '
+                 'NEW.barcode IS NOT OLD.barcode')):
+            trigger = 'users_barcode_key_' + name
+            sql = ('CREATE TRIGGER {} AFTER {} ON users WHEN {} '
+                   'BEGIN UPDATE users SET barcode_key={} '
+                   'WHERE id=NEW.id; END'.format(
+                       trigger, event, when,
+                       self.BARCODE_KEY_SQL.format('NEW.barcode')))
+            if (sql, ) != self.__connection.execute(
+                    "SELECT sql FROM sqlite_master WHERE type='trigger' "
+                    'AND name=?', (trigger, )).fetchone():
+                self.__connection.execute('DROP TRIGGER IF EXISTS ' +
+                                          trigger)
+                self.__connection.execute(sql)
+
+    def __barcode_key_column(self, barcode):
+        """Return the (columns, values) setting `barcode`'s key, if keyed."""
+        if not self.__barcode_keyed():
+            return (), ()
+        key = _barcode_key(barcode) if barcode is not None else None
+        return ('barcode_key', ), (key or None, )
+
+    def __create_barcode_key_index(self):
+        # lookups switch to barcode_key once this index exists
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS '
+                                  'users_barcode_key ON users (barcode_key)')
+        self.__keyed = True
+
+    def __barcode_keyed(self):
+        """Return whether barcode lookups can use the `barcode_key` column."""
+        if self.__keyed is None:
+            self.__keyed = any(row[1] == 'users_barcode_key' for row in
+                               self.__connection.execute(
+                                   'PRAGMA index_list(users)'))
+            if self.__keyed:
+                # a database keyed by an older version has older triggers
+                self.__create_barcode_key_triggers()
+        return self.__keyed
+
+    def __create_name_key_triggers(self):
+        """Create triggers keeping the name keys in step with the names.
+
+        Name keys are computed by `_name_key` in Python, so the triggers are
+        TEMP triggers, which exist only on this connection: other programs
+        writing to the database are not affected, but do not set the keys
+        either. Lookups match their rows by exact name until the keys are
+        filled in by `__backfill_name_keys` when the database is next
+        opened (see `__sql_name_key_phrase`).
+        """
+        for name, event in (('insert', 'INSERT'),
+                            ('update', 'UPDATE OF firstName, lastName')):
+            self.__connection.execute(
+                'CREATE TEMP TRIGGER IF NOT EXISTS users_name_key_{} AFTER {} '
+                'ON main.users BEGIN UPDATE users SET '
+                'firstName_key=socman_name_key(NEW.firstName), '
+                'lastName_key=socman_name_key(NEW.lastName) '
+                'WHERE id=NEW.id; END'.format(name, event))
+
+    def __backfill_name_keys(self):
+        """Fill in the name keys of rows written by other programs."""
+        # checked first, so that opening the database only writes to it
+        # when there is something to fill in
+        condition = ('firstName_key IS NULL AND lastName_key IS NULL AND '
+                     '(socman_name_key(firstName) IS NOT NULL OR '
+                     'socman_name_key(lastName) IS NOT NULL)')
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM users WHERE {})'.format(
+            condition))
+        if cursor.fetchone()[0]:
+            cursor.execute('UPDATE users SET '
+                           'firstName_key=socman_name_key(firstName), '
+                           'lastName_key=socman_name_key(lastName) '
+                           'WHERE ' + condition)
+
+    def __create_name_key_index(self):
+        # name lookups switch to the keys once this index exists
+        self.__connection.execute(
+            'CREATE INDEX IF NOT EXISTS users_name_key ON users '
+            '(lastName_key, firstName_key)')
+        self.__name_keyed = True
+
+    @_profiled
+    def migrate_name_keys(self, chunk_size=1000):
+        """Give an existing `users` table normalized name key columns.
+
+        Name lookups compare names exactly unless the table has the
+        `firstName_key` and `lastName_key` columns, holding names normalized
+        by `_name_key`. This adds them with an index, rewriting rows
+        `chunk_size` at a time as `migrate_barcode_keys` does; lookups use
+        the keys once the migration completes, matching names regardless
+        of case, accents and spacing.
+
+        Returns:
+            The number of rows rewritten.
+        """
+        with self._lock:
+            columns = self.__columns()
+            for column in ('firstName_key', 'lastName_key'):
+                if column not in columns:
+                    self.__connection.execute(
+                        'ALTER TABLE users ADD COLUMN {} '
+                        'VARCHAR(255)'.format(column))
+            self.__create_name_key_triggers()
+            self.commit()
+
+        migrated = self.__rewrite_in_chunks(
+            'firstName_key=socman_name_key(firstName), '
+            'lastName_key=socman_name_key(lastName)',
+            'firstName_key IS NOT socman_name_key(firstName) OR '
+            'lastName_key IS NOT socman_name_key(lastName)', chunk_size)
+
+        with self._lock:
+            self.__create_name_key_index()
+            self.commit()
+        return migrated
+
+    def __rewrite_in_chunks(self, assignments, condition, chunk_size):
+        """Update rows needing it, `chunk_size` ids per transaction.
+
+        Returns:
+            The number of rows updated.
+        """
+        rewritten = 0
+        last_id = -1
+        while True:
+            with self._lock, self.transaction():
+                cursor = self.__connection.cursor()
+                cursor.execute('SELECT id FROM users WHERE id>? ORDER BY id '
+                               'LIMIT ?', (last_id, chunk_size))
+                ids = cursor.fetchall()
+                if not ids:
+                    return rewritten
+                cursor.execute(
+                    'UPDATE users SET {} WHERE id BETWEEN ? AND ? '
+                    'AND ({})'.format(assignments, condition),
+                    (ids[0][0], ids[-1][0]))
+                rewritten += cursor.rowcount
+                last_id = ids[-1][0]
+
+    @_profiled
+    def migrate_barcode_keys(self, chunk_size=1000):
+        """Give an existing `users` table a canonical barcode key column.
+
+        SQLite's INTEGER affinity stores some barcodes as numbers and others
+        as text, and lookups then depend on how a barcode was bound. This
+        adds the `barcode_key` column, holding the canonical (text) form of
+        each barcode (see `_barcode_key`), with triggers keeping it up to
+        date and an index. Rows are rewritten `chunk_size` at a time, each
+        chunk committed separately, so a large table is never locked for
+        long. Lookups use the key column once the migration completes; an
+        interrupted migration can simply be run again.
+
+        Returns:
+            The number of rows rewritten.
+        """
+        with self._lock:
+            if 'barcode_key' not in self.__columns():
+                self.__connection.execute(
+                    'ALTER TABLE users ADD COLUMN barcode_key TEXT')
+            self.__create_barcode_key_triggers()
+            self.commit()
+
+        # keys already set, possibly by a writer, are left alone
+        key_sql = self.BARCODE_KEY_SQL.format('barcode')
+        migrated = self.__rewrite_in_chunks(
+            'barcode_key=' + key_sql,
+            'barcode_key IS NULL AND {} IS NOT NULL'.format(key_sql),
+            chunk_size)
+
+        with self._lock:
+            self.__create_barcode_key_index()
+            self.commit()
+        return migrated
+
+    def __columns(self):
+        """Return the set of column names of the `users` table."""
+        return set(self.__table_columns('users'))
+
+    def __table_columns(self, table):
+        """Return the column names of `table` (schema.table) in order."""
+        schema, _, table = table.rpartition('.')
+        return [row[1] for row in self.__connection.execute(
+            'PRAGMA {}table_info({})'.format(schema + '.' if schema else '',
+                                             table))]
 
     def optional_commit(self):
         """Commit changes to database if `safe` is set to `True`.
@@ -224,9 +1432,24 @@ class MemberDatabase:
         of write safety. For example, by default a timestamp is updated in the
         database every time a record is accessed. If a lot of members are
         checked, it may not be desirable to commit after every such change.
+
+        If a group commit policy was given (`commit_every` or
+        `commit_interval`), it decides instead when to commit.
         """
-        if self.__safe:
-            self.__connection.commit()
+        if self.__commit_every is None and self.__commit_interval is None:
+            if self.__safe:
+                self.commit()
+            return
+
+        self.__pending += 1
+        if self.__commit_every and self.__pending >= self.__commit_every:
+            self.commit()
+        elif (self.__commit_interval is not None and
+              self.__commit_timer is None):
+            self.__commit_timer = threading.Timer(self.__commit_interval,
+                                                  self.__timed_commit)
+            self.__commit_timer.daemon = True
+            self.__commit_timer.start()
 
     def __sql_build_name_value_pairs(self, member, sep):
         columns = []
@@ -250,18 +1473,40 @@ class MemberDatabase:
         raise MemberDatabase.BadSearchAuthorityError
 
     def __sql_search_barcode_phrase(self, member):
+        if self.__barcode_keyed():
+            return 'barcode_key=?', (_barcode_key(member.barcode), )
         return 'barcode=?', (member.barcode, )
 
     def __sql_search_name_phrase(self, member):
+        if self.__name_keyed:
+            return self.__sql_name_key_phrase(member)
         return self.__sql_build_name_value_pairs(member, ' AND ')
 
+    def __sql_name_key_phrase(self, member):
+        # as __sql_build_name_value_pairs, but matching the name keys;
+        # rows written without keys by other programs match exactly
+        names = [(column, name) for column, name
+                 in (('firstName', member.name.first()),
+                     ('lastName', member.name.last())) if name]
+        if not names:
+            return None, None
+        return ('({} OR firstName_key IS NULL AND lastName_key IS NULL '
+                'AND {})'.format(
+                    ' AND '.join(column + '_key=?' for column, _ in names),
+                    ' AND '.join(column + '=?' for column, _ in names)),
+                tuple(_name_key(name) for _, name in names) +
+                tuple(name for _, name in names))
+
     def __sql_update_phrase(self, member, authority):
         # authority='barcode' yields name update query and vice versa
         # if the barcode is authoritative, it is the name we should update
         if authority == 'barcode':
             update_phrase = self.__sql_build_name_value_pairs(member, sep=',')
         elif authority == 'name':
-            update_phrase = ('barcode=?', (member.barcode,))
+            columns, values = self.__barcode_key_column(member.barcode)
+            update_phrase = (','.join(column + '=?' for column
+                                      in ('barcode', ) + columns),
+                             (member.barcode, ) + values)
         else:
             raise MemberDatabase.BadSearchAuthorityError
         return self.__join_sql_cmds(update_phrase,
@@ -279,8 +1524,25 @@ class MemberDatabase:
             self.__sql_search_phrase(member, authority)
             ))
 
+    def __invalidate_snapshot(self, member, authority='barcode'):
+        """Hide the snapshot entries a write to `member` makes stale.
+
+        These are its own barcode and, when names are authoritative, the
+        barcodes its records had before.
+        """
+        if self.__snapshot is None:
+            return
+        barcodes = [member.barcode]
+        if authority == 'name':
+            barcodes.extend(row[0] for row in self.__connection.execute(
+                *self.__join_sql_cmds(('SELECT barcode FROM users WHERE ', ()),
+                                      self.__sql_search_name_phrase(member))))
+        self.__snapshot_stale.update(_barcode_key(barcode)
+                                     for barcode in barcodes if barcode)
+
     def __autofix(self, member, authority='barcode'):
         if member.barcode and member.name:
+            self.__invalidate_snapshot(member, authority)
             self.__connection.cursor().execute(*self.__join_sql_cmds(
                 ('UPDATE users SET ', ()),
                 self.__sql_update_phrase(member, authority),
@@ -288,6 +1550,7 @@ class MemberDatabase:
                 self.__sql_search_phrase(member, authority)
                 ))
 
+    @_synchronized
     def get_member(self, member, update_timestamp=True, autofix=False):
         """Retrieve a member's names from the database.
 
@@ -305,6 +1568,9 @@ class MemberDatabase:
             MemberNotFoundError: A member was not found in a database lookup
             BadMemberError: The member passed to `get_member` has neither name
                             nor barcode.
+            AmbiguousBarcodeError: A truncated barcode (see
+                                   `barcode_prefix_length`) matched several
+                                   members' barcodes.
 
         The Lookup
         ----------
@@ -312,6 +1578,8 @@ class MemberDatabase:
         barcode are supplied in `member` then the lookup will be done by
         barcode, and only if that lookup fails will the name be used.
         If only a name is provided, it will of course be used for lookup.
+        A truncated barcode is looked up by prefix, and the whole barcode
+        found is used in its place, e.g. when autofixing.
 
         Autofixing
         ----------
@@ -330,9 +1598,42 @@ class MemberDatabase:
         if not member or not (member.barcode or member.name):
             raise BadMemberError(member)
 
+        # a barcode cache, if enabled, answers barcode lookups from memory
+        if (member.barcode and self.__barcode_cache is not None and
+                not autofix and not self.__is_prefix(member.barcode)):
+            key = _barcode_key(member.barcode)
+            names = self.__barcode_cache.get(key)
+            if names is not None:
+                if update_timestamp:
+                    # write behind: recorded when next committed
+                    self.__attended[key] = member.barcode
+                    self.optional_commit()
+                return names
+
         search_authority = None
-        # first try to find member by barcode, if possible
-        if member.barcode:
+        # a snapshot, if present, can answer barcode lookups without SQL
+        if (member.barcode and self.__snapshot is not None and
+                _barcode_key(member.barcode) not in self.__snapshot_stale):
+            record = self.__snapshot.lookup(member.barcode)
+            if record:
+                users = [record[:2]]
+                search_authority = 'barcode'
+
+        # a barcode filter, if enabled, rules out unknown barcodes without SQL
+        barcode_known = (self.__barcode_filter is None or
+                         self.__stored_barcode(member.barcode) in
+                         self.__barcode_filter)
+
+        # a truncated barcode: one range scan finds the whole barcode
+        if (member.barcode and not search_authority and
+                self.__is_prefix(member.barcode)):
+            barcode, users = self.__find_prefix(member)
+            if users:
+                member = member._replace(barcode=barcode)
+                search_authority = 'barcode'
+
+        # otherwise first try to find member by barcode, if possible
+        elif member.barcode and barcode_known and not search_authority:
             cursor.execute(*self.__join_sql_cmds(
                 ('SELECT firstName,lastName FROM users WHERE ', ()),
                 self.__sql_search_barcode_phrase(member)
@@ -351,6 +1652,16 @@ class MemberDatabase:
             if users:
                 search_authority = 'name'
 
+        # only on a miss: reactivate the member if archived
+        if not search_authority and self.__archive is not None:
+            search_authority = self.__reactivate(member)
+            if search_authority:
+                cursor.execute(*self.__join_sql_cmds(
+                    ('SELECT firstName,lastName FROM users WHERE ', ()),
+                    self.__sql_search_phrase(member, search_authority)
+                    ))
+                users = cursor.fetchall()
+
         if not search_authority:
             raise MemberNotFoundError(member)
 
@@ -379,14 +1690,17 @@ class MemberDatabase:
         if not college:
             college = ''
 
-        return ("""INSERT INTO users (barcode, firstName, """
-                """lastName, college, """
-                """datejoined, created_at, updated_at, last_attended) """
-                """VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        key_columns, key_values = self.__barcode_key_column(barcode)
+        columns = ('barcode', 'firstName', 'lastName', 'college',
+                   'datejoined', 'created_at', 'updated_at',
+                   'last_attended') + key_columns
+        return ('INSERT INTO users ({}) VALUES ({})'.format(
+                    ', '.join(columns), ', '.join('?' * len(columns))),
                 (barcode, name.first(), name.last(), college,
                  date.today(), datetime.utcnow(),
-                 datetime.utcnow(), date.today()))
+                 datetime.utcnow(), date.today()) + key_values)
 
+    @_synchronized
     def add_member(self, member):
         """Add a member to the database.
 
@@ -419,10 +1733,12 @@ class MemberDatabase:
         # if member does not exist, add him/her
         cursor = self.__connection.cursor()
         cursor.execute(*self.__sql_add_query(member))
+        self.__invalidate_snapshot(member)
 
         # direct commit here: don't want to lose new member data
-        self.__connection.commit()
+        self.commit()
 
+    @_synchronized
     def update_member(self, member, authority='barcode', update_timestamp=True):
         """Update the record for a member already in the database.
 
@@ -459,21 +1775,1501 @@ class MemberDatabase:
         self.__autofix(member, authority=authority)
 
 
-    def member_count(self):
+    @_profiled
+    @_synchronized
+    def get_members(self, barcodes, update_timestamp=True, chunk_size=500):
+        """Retrieve the names of many members by barcode at once.
+
+        This is the batched counterpart of `get_member` for barcode-only
+        lookups: barcodes are resolved with one query per `chunk_size`
+        barcodes instead of one or two queries each, and timestamps are
+        updated with one statement per chunk. No name lookup or autofixing
+        is attempted. Barcodes in the barcode cache (see
+        `enable_barcode_cache`) are resolved from it, as in `get_member`.
+
+        Arguments:
+            barcodes:   an iterable of barcodes to look up
+            update_timestamp:   whether to update the last_attended date of
+                                every member found
+            chunk_size: the number of barcodes resolved per query
+
+        Returns:
+            A dict mapping each barcode found to a (first, last) names tuple.
+            Barcodes not in the database are absent from the dict.
+        """
+        found = {}
+        pending = {}
+        missed = {}
+        for barcode in barcodes:
+            key = _barcode_key(barcode) if barcode else None
+            if not key or key in pending or barcode in found:
+                continue
+            if (self.__barcode_cache is not None and
+                    key in self.__barcode_cache and
+                    not self.__is_prefix(barcode)):
+                found[barcode] = self.__barcode_cache[key]
+                if update_timestamp:
+                    self.__attended[key] = barcode
+                continue
+            if (self.__barcode_filter is not None and
+                    self.__stored_barcode(barcode) not in
+                    self.__barcode_filter and
+                    self.__archive is None and
+                    not self.__is_prefix(barcode)):
+                continue
+            pending[key] = barcode
+            if len(pending) >= chunk_size:
+                found.update(self.__get_members_chunk(pending,
+                                                      update_timestamp))
+                missed.update((key, barcode) for key, barcode
+                              in pending.items() if barcode not in found)
+                pending = {}
+        if pending:
+            found.update(self.__get_members_chunk(pending, update_timestamp))
+            missed.update((key, barcode) for key, barcode in pending.items()
+                          if barcode not in found)
+
+        # truncated barcodes are matched one by one, skipping ambiguous ones
+        for key, barcode in list(missed.items()):
+            if not self.__is_prefix(barcode):
+                continue
+            try:
+                full_barcode, users = self.__find_prefix(Member(barcode))
+            except AmbiguousBarcodeError:
+                continue
+            if users:
+                found[barcode] = users[0]
+                del missed[key]
+                if update_timestamp:
+                    self.__update_timestamp(Member(full_barcode))
+
+        # as in get_member, archived members are reactivated on a miss
+        if missed and self.__archive is not None:
+            missed = list(missed.items())
+            for start in range(0, len(missed), chunk_size):
+                pending = dict(missed[start:start + chunk_size])
+                where, values = self.__archive_barcode_phrase(
+                    list(pending.values()))
+                if self.__unarchive(where, values):
+                    self.commit()
+                    found.update(self.__get_members_chunk(
+                        pending, update_timestamp))
+
+        if update_timestamp and found:
+            self.optional_commit()
+        return found
+
+    def __get_members_chunk(self, pending, update_timestamp):
+        """Look up one chunk of barcodes, keyed by `_barcode_key`."""
+        cursor = self.__connection.cursor()
+        if self.__barcode_keyed():
+            column, values = 'barcode_key', tuple(pending)
+        else:
+            column, values = 'barcode', tuple(pending.values())
+        cursor.execute('SELECT {0},firstName,lastName FROM users '
+                       'WHERE {0} IN ({1})'.format(
+                           column, ','.join('?' * len(values))),
+                       values)
+        # the key of each barcode as stored (see `__stored_barcode`)
+        keys = {_barcode_key(self.__stored_barcode(barcode)): key
+                for key, barcode in pending.items()}
+        found = {}
+        found_values = []
+        for barcode, first_name, last_name in cursor.fetchall():
+            key = keys.get(_barcode_key(barcode))
+            if key in pending and pending[key] not in found:
+                found[pending[key]] = (first_name, last_name)
+                found_values.append(key if column == 'barcode_key'
+                                    else pending[key])
+
+        if update_timestamp and found:
+            cursor.execute('UPDATE users SET last_attended=? '
+                           'WHERE {} IN ({})'.format(
+                               column, ','.join('?' * len(found_values))),
+                           (date.today(), ) + tuple(found_values))
+        return found
+
+    def __is_prefix(self, barcode):
+        """Return whether `barcode` is of the truncated length.
+
+        The length is that of the barcode as scanned, leading zeros and all.
+        """
+        return (self.__prefix_length is not None and bool(barcode) and
+                len(str(barcode).strip()) == self.__prefix_length)
+
+    def match_barcode_prefix(self, prefix, limit=10):
+        """Return the barcodes starting with `prefix`, in sorted order.
+
+        On a database with barcode keys (see `migrate_barcode_keys`), this
+        is a range scan of the barcode key index; otherwise every barcode is
+        compared. Barcodes are compared in their canonical form (see
+        `_barcode_key`), so leading zeros are ignored.
+
+        Arguments:
+            prefix: the start of the barcodes to find
+            limit:  the greatest number of barcodes to return
+
+        Returns:
+            A list of (barcode, first name, last name) tuples, one per
+            member (not per distinct barcode).
+        """
+        prefix = _barcode_key(prefix)
+        cursor = self.__connection.cursor()
+        if self.__barcode_keyed():
+            # every key starting with prefix sorts in [prefix, upper)
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            cursor.execute('SELECT barcode,firstName,lastName FROM users '
+                           'WHERE barcode_key>=? AND barcode_key<? '
+                           'ORDER BY barcode_key LIMIT ?',
+                           (prefix, upper, limit))
+        else:
+            cursor.execute('SELECT barcode,firstName,lastName FROM users '
+                           'WHERE substr(barcode, 1, ?)=? '
+                           'ORDER BY CAST(barcode AS TEXT) LIMIT ?',
+                           (len(prefix), prefix, limit))
+        return cursor.fetchall()
+
+    def __find_prefix(self, member):
+        """Look up a truncated barcode, as `get_member` looks up barcodes.
+
+        A member whose barcode equals the prefix wins; otherwise every
+        member matched must share a barcode.
+
+        Returns:
+            A (barcode, users) tuple: the whole barcode found and a list of
+            (first name, last name) tuples (empty if none was found).
+
+        Raises:
+            AmbiguousBarcodeError: different barcodes start with the prefix
+        """
+        matches = self.match_barcode_prefix(member.barcode)
+        if not matches:
+            return None, []
+        barcodes = sorted(set(_barcode_key(match[0]) for match in matches))
+        barcode = _barcode_key(member.barcode)
+        if barcode not in barcodes:
+            if len(barcodes) > 1:
+                raise AmbiguousBarcodeError(member, barcodes)
+            barcode, = barcodes
+        return barcode, [match[1:] for match in matches
+                         if _barcode_key(match[0]) == barcode]
+
+    def enable_barcode_filter(self, error_rate=0.01, headroom=2):
+        """Load every barcode into a BarcodeFilter used by `get_member`.
+
+        Once enabled, barcodes which are definitely not in the database are
+        rejected without a barcode query, so an unknown barcode with no name
+        raises MemberNotFoundError straight away. TEMP triggers add every
+        barcode this connection writes to the filter, however it is written
+        (signups, autofixes, imports, syncs, reconciles or reactivations).
+        Barcodes written by other connections are not seen.
+
+        Arguments:
+            error_rate: target false positive rate of the filter
+            headroom:   the filter is sized for `headroom` times the current
+                        number of members, leaving room for new signups
+                        before the false positive rate degrades
+
+        Returns:
+            The BarcodeFilter, e.g. to report its false positive rate.
+        """
+        cursor = self.__connection.cursor()
+        barcode_filter = BarcodeFilter(
+            max(self.member_count() * headroom, 1024), error_rate)
+        # barcode keys are exact; without them, see `__stored_barcode`
+        column = 'barcode_key' if self.__barcode_keyed() else 'barcode'
+        cursor.execute("SELECT {0} FROM users "
+                       "WHERE {0} IS NOT NULL AND {0} != ''".format(column))
+        for barcode, in cursor:
+            barcode_filter.add(barcode)
+
+        def filter_add(barcode):
+            if barcode is not None and barcode != '':
+                barcode_filter.add(barcode)
+
+        self.__connection.create_function('socman_filter_add', 1,
+                                          filter_add)
+        barcode = 'NEW.barcode'
+        columns = 'barcode'
+        if self.__barcode_keyed():
+            barcode = 'COALESCE(NEW.barcode_key, NEW.barcode)'
+            columns = 'barcode, barcode_key'
+        for name, event in (('insert', 'INSERT'),
+                            ('update', 'UPDATE OF ' + columns)):
+            self.__connection.execute(
+                'CREATE TEMP TRIGGER IF NOT EXISTS users_barcode_filter_{} '
+                'AFTER {} ON main.users BEGIN SELECT socman_filter_add({}); '
+                'END'.format(name, event, barcode))
+        self.__barcode_filter = barcode_filter
+        return barcode_filter
+
+    def __stored_barcode(self, barcode):
+        """Return `barcode` in the form lookups find it stored.
+
+        With barcode keys this is `barcode` itself. Without, a barcode of
+        digits too long for a 64-bit integer is found as the REAL SQLite
+        converts it to.
+        """
+        if (not self.__barcode_keyed() and isinstance(barcode, str) and
+                _INTEGER_BARCODE.match(barcode) and
+                not -2**63 <= int(barcode) < 2**63):
+            return float(int(barcode))
+        return barcode
+
+    @_synchronized
+    def enable_barcode_cache(self):
+        """Load every member's barcode and names into a dict for `get_member`.
+
+        Once enabled, `get_member` answers barcode lookups from the dict
+        without SQL, and defers the attendance update of members found
+        there to the next commit, when it is written for every member at
+        once. The dict is loaded with a single streaming query and kept in
+        step by TEMP triggers with every change this connection makes to
+        the barcodes or names, whether by `add_member`, `update_member` or
+        bulk operations. Changes by other connections are not seen.
+        Barcodes missing from the dict are looked up with SQL as usual.
+
+        Returns:
+            The number of barcodes loaded.
+        """
+        def cache_put(barcode, first_name, last_name):
+            key = _barcode_key(barcode) if barcode is not None else None
+            if key:
+                self.__barcode_cache[key] = (first_name, last_name)
+
+        def cache_drop(barcode):
+            if barcode is not None:
+                self.__barcode_cache.pop(_barcode_key(barcode), None)
+
+        self.__connection.create_function('socman_cache_put', 3, cache_put)
+        self.__connection.create_function('socman_cache_drop', 1, cache_drop)
+        # a barcode's key, where stored, is exact (see `_barcode_key`)
+        key, columns = '{}.barcode', 'barcode'
+        if self.__barcode_keyed():
+            key = 'COALESCE({0}.barcode_key, {0}.barcode)'
+            columns = 'barcode, barcode_key'
+        put = ('SELECT socman_cache_put({}, NEW.firstName, '
+               'NEW.lastName); '.format(key.format('NEW')))
+        drop = 'SELECT socman_cache_drop({}); '.format(key.format('OLD'))
+        for name, event, body in (
+                ('insert', 'INSERT', put),
+                ('update', 'UPDATE OF {}, firstName, lastName'.format(
+                    columns), drop + put),
+                ('delete', 'DELETE', drop)):
+            self.__connection.execute(
+                'CREATE TEMP TRIGGER IF NOT EXISTS users_barcode_cache_{} '
+                'AFTER {} ON main.users BEGIN {}END'.format(name, event,
+                                                            body))
+        return self.__load_barcode_cache()
+
+    def __load_barcode_cache(self):
+        """(Re)load the barcode cache from the `users` table.
+
+        Rows are read newest first, so the oldest of several rows with the
+        same barcode wins, as in an SQL lookup.
+        """
+        cursor = self.__connection.cursor()
+        key = ('barcode_key' if self.__barcode_keyed()
+               else self.BARCODE_KEY_SQL.format('barcode'))
+        cursor.execute('SELECT {},firstName,lastName FROM users '
+                       "WHERE barcode IS NOT NULL AND barcode != '' "
+                       'ORDER BY id DESC'.format(key))
+        self.__barcode_cache = {row[0]: row[1:] for row in cursor}
+        return len(self.__barcode_cache)
+
+    def __write_attendance(self):
+        """Update last_attended for the members found in the barcode cache."""
+        attended, self.__attended = self.__attended, {}
+        if self.__barcode_keyed():
+            column, values = 'barcode_key', list(attended)
+        else:
+            column, values = 'barcode', list(attended.values())
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            self.__connection.execute(
+                'UPDATE users SET last_attended=? WHERE {} IN ({})'.format(
+                    column, ','.join('?' * len(chunk))),
+                (date.today(), ) + tuple(chunk))
+
+    @_profiled
+    def member_count(self, **filters):
         """Return the number of members in the database.
 
-        This is the number of rows in the `users` table.
+        This is the number of rows in the `users` table or, if any of the
+        filters of `query` are given as keyword arguments, the number of
+        rows matching them:
+
+            >>> db.member_count(college='Wolfson', unpaid=True)
         """
         cursor = self.__connection.cursor()
-        cursor.execute('SELECT COUNT(*) FROM users')
+        where, values = self.__sql_filter_phrase(**filters)
+        if where:
+            cursor.execute('SELECT COUNT(*) FROM users WHERE ' + where,
+                           values)
+        else:
+            cursor.execute('SELECT COUNT(*) FROM users')
         return int(cursor.fetchone()[0])
 
+    # the columns `query` can sort by, and the index used for each
+    QUERY_ORDERS = {
+        'id': ('id', ),
+        'name': ('lastName', 'firstName', 'id'),
+        'college': ('college', 'id'),
+        'datejoined': ('datejoined', 'id'),
+        'last_attended': ('last_attended', 'id'),
+        }
+
+    QUERY_INDEXES = {
+        'college': 'college',
+        'datejoined': 'datejoined',
+        'last_attended': 'last_attended',
+        'unpaid': 'unpaid',
+        'name': 'lastName, firstName',
+        }
+
+    def __ensure_index(self, name):
+        """Create the index `users_<name>` from QUERY_INDEXES if need be."""
+        if name in self.QUERY_INDEXES and name not in self.__indexes:
+            self.__connection.execute(
+                'CREATE INDEX IF NOT EXISTS users_{} ON users ({})'.format(
+                    name, self.QUERY_INDEXES[name]))
+            self.__indexes.add(name)
+
+    def __sql_filter_phrase(self, college=None, joined_since=None,
+                            joined_before=None, attended_since=None,
+                            attended_before=None, unpaid=None):
+        """Return a WHERE phrase and values for the `query` filters.
+
+        The index backing each filter given is created if need be.
+        """
+        phrases = []
+        values = ()
+        if college is not None:
+            colleges = ((college, ) if isinstance(college, str)
+                        else tuple(college))
+            if self.__colleges:
+                phrases.append(
+                    'college_id IN (SELECT college_id FROM college_aliases '
+                    'WHERE alias IN ({}))'.format(
+                        ','.join('?' * len(colleges))))
+                values += tuple(college.strip() for college in colleges)
+            else:
+                phrases.append('college IN ({})'.format(
+                    ','.join('?' * len(colleges))))
+                values += colleges
+                self.__ensure_index('college')
+        for column, since, before in (
+                ('datejoined', joined_since, joined_before),
+                ('last_attended', attended_since, attended_before)):
+            if since is not None:
+                phrases.append(column + '>=?')
+                values += (since, )
+            if before is not None:
+                phrases.append(column + '<?')
+                values += (before, )
+            if since is not None or before is not None:
+                self.__ensure_index(column)
+        if unpaid is not None:
+            # older databases lack the column: nobody there is unpaid
+            column = '0'
+            if 'unpaid' in self.__columns():
+                column = 'unpaid'
+                self.__ensure_index('unpaid')
+            if unpaid:
+                phrases.append('{}=1'.format(column))
+            else:
+                phrases.append('({0}=0 OR {0} IS NULL)'.format(column))
+        return ' AND '.join(phrases), values
+
+    def query(self, order_by='id', descending=False, limit=None, offset=0,
+              after=None, chunk_size=1000, **filters):
+        """Return an iterator over the MemberRecords matching filters.
+
+        Filters are given as keyword arguments and combined; members must
+        match all of them:
+
+            college:            a college name, or a list of college names
+            joined_since:       members who joined on or after this date
+            joined_before:      members who joined before this date
+            attended_since:     members who attended on or after this date
+            attended_before:    members who last attended before this date
+                                (members who never attended are excluded)
+            unpaid:             True for unpaid members only, False for
+                                paid members only
+
+        For example, everyone from Wolfson who joined this year:
+
+            >>> db.query(college='Wolfson', joined_since=date(2016, 1, 1))
+
+        The index backing each filter is created on first use, so filtering
+        never needs to scan the whole table. Records are streamed,
+        `chunk_size` rows at a time.
+
+        Arguments:
+            order_by:   'id', 'name', 'college', 'datejoined' or
+                        'last_attended'; ties are ordered by id
+            descending: sort in descending rather than ascending order
+            limit:      the greatest number of records to yield
+            offset:     the number of matching records to skip
+            after:      the last record of the previous page, for keyset
+                        pagination: records after it in the sort order are
+                        yielded. Unlike `offset` this costs the same
+                        however deep the page. Rows whose sort column is
+                        NULL are never after a record.
 
+        Raises:
+            ValueError: `order_by` is not a supported sort order.
+            TypeError: an unknown filter is given.
+        """
+        if order_by not in self.QUERY_ORDERS:
+            raise ValueError('cannot order by {!r}'.format(order_by))
+        where, values = self.__sql_filter_phrase(**filters)
+        phrases = [where] if where else []
+        order = self.QUERY_ORDERS[order_by]
+        keys = tuple(getattr(after, column) for column in order
+                     ) if after is not None else None
+        if self.__colleges and order_by == 'college':
+            # colleges are sorted by name, which the index does not hold
+            order = (self.__college_sql(), ) + order[1:]
+        else:
+            self.__ensure_index(order_by)
+        if after is not None:
+            # row values compare column by column, as ORDER BY sorts
+            phrases.append('({}) {} ({})'.format(
+                ','.join(order), '<' if descending else '>',
+                ','.join('?' * len(keys))))
+            values += keys
+
+        sql = 'SELECT {} FROM users'.format(self.__record_select())
+        if phrases:
+            sql += ' WHERE ' + ' AND '.join(phrases)
+        sql += ' ORDER BY ' + ','.join(
+            column + (' DESC' if descending else '') for column in order)
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            values += (-1 if limit is None else limit, offset)
+
+        cursor = self.__connection.cursor()
+        cursor.execute(sql, values)
+        return self.__iter_cursor(cursor, chunk_size, 'query')
+
+
+    @_profiled
+    def write_snapshot(self, snapshot_filename):
+        """Write a BarcodeSnapshot of every member with a barcode.
+
+        The snapshot maps barcodes to first name, last name and college and
+        can be opened with `BarcodeSnapshot` by read-only kiosks.
+
+        Returns:
+            The number of barcodes written to the snapshot.
+        """
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT {},firstName,lastName,{} FROM users '
+                       'ORDER BY id'.format(
+                           'barcode_key' if self.__barcode_keyed()
+                           else 'barcode', self.__college_sql()))
+        return BarcodeSnapshot.write(snapshot_filename, cursor)
+
+    def __record_columns(self):
+        # older databases may lack the unpaid column
+        if 'unpaid' in self.__columns():
+            return MemberRecord._fields
+        return MemberRecord._fields[:-1]
+
+    def __record_select(self):
+        """Return the SELECT list of the `users` columns of a MemberRecord."""
+        return ','.join(self.__college_sql() + ' AS college'
+                        if column == 'college' else column
+                        for column in self.__record_columns())
+
+    def iter_records(self, chunk_size=1000):
+        """Return an iterator over the `users` table's MemberRecords.
+
+        Rows are fetched `chunk_size` at a time, so the table is never held
+        in memory at once.
+        """
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT {} FROM users ORDER BY id'.format(
+            self.__record_select()))
+        return self.__iter_cursor(cursor, chunk_size, 'iter_records')
+
+    def __iter_cursor(self, cursor, chunk_size, operation):
+        """Return an iterator over the MemberRecords from `cursor`.
+
+        The iteration is measured as `operation` by any memory profiler.
+        """
+        records = self.__iter_records(cursor, chunk_size)
+        if self.memory_profiler is None:
+            return records
+        return self.memory_profiler.iterate(operation, records)
+
+    def __iter_records(self, cursor, chunk_size):
+        """Yield MemberRecords from `cursor`, `chunk_size` rows at a time."""
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield MemberRecord(*row)
+
+    def get_records(self, member, authority='barcode'):
+        """Return a list of the MemberRecords matching `member`.
+
+        Arguments:
+            member:     a member object to search for
+            authority:  'barcode' or 'name', the field to search by
+        """
+        cursor = self.__connection.cursor()
+        cursor.execute(*self.__join_sql_cmds(
+            ('SELECT {} FROM users WHERE '.format(
+                self.__record_select()), ()),
+            self.__sql_search_phrase(member, authority)
+            ))
+        return [MemberRecord(*row) for row in cursor.fetchall()]
+
+    @_profiled
+    def insert_records(self, records):
+        """Insert MemberRecords into the `users` table as new rows.
+
+        Record ids are ignored and new ids allocated. Changes are not
+        committed.
+
+        Returns:
+            The number of rows inserted.
+        """
+        columns = self.__record_columns()[1:]
+        key_columns = self.__barcode_key_column(None)[0]
+        cursor = self.__connection.cursor()
+        cursor.executemany(
+            'INSERT INTO users ({}) VALUES ({})'.format(
+                ','.join(columns + key_columns),
+                ','.join('?' * (len(columns) + len(key_columns)))),
+            (record[1:len(columns) + 1] +
+             self.__barcode_key_column(record.barcode)[1]
+             for record in records))
+        return cursor.rowcount
+
+    def delete_records(self, ids):
+        """Delete the rows with the given ids. Changes are not committed."""
+        self.__connection.cursor().executemany(
+            'DELETE FROM users WHERE id=?', ((row_id, ) for row_id in ids))
+
+    def enable_archive(self, archive_file=None):
+        """Keep archived members in an archive table searched on a miss.
+
+        The archive is the `users_archive` table of this database or, if
+        `archive_file` is given, the `users` table of that database file
+        (created if need be), which can itself be opened as a
+        MemberDatabase. Once enabled, `get_member` and `get_members` look
+        up members missing from `users` in the archive, and move any found
+        back into `users`, so archived members reactivate when they next
+        attend. Member counts and exports cover `users` only.
+
+        See `archive_inactive` for archiving members.
+        """
+        self.commit()  # attaching is not possible inside a transaction
+        if archive_file is None:
+            archive = 'main.users_archive'
+        else:
+            self.__connection.execute("ATTACH DATABASE ? AS archive",
+                                      (archive_file, ))
+            archive = 'archive.users'
+        self.__connection.execute(self.SCHEMA.replace(
+            'EXISTS users', 'EXISTS ' + archive, 1))
+        schema, table = archive.split('.')
+        indexes = [('barcode', 'barcode'), ('name', 'lastName, firstName')]
+        if 'barcode_key' in self.__table_columns(archive):
+            indexes.append(('barcode_key', 'barcode_key'))
+        for name, columns in indexes:
+            self.__connection.execute(
+                'CREATE INDEX IF NOT EXISTS {}.{}_{} ON {} ({})'.format(
+                    schema, table, name, table, columns))
+        self.commit()
+        self.__archive = archive
+
+    @_profiled
+    def archive_inactive(self, before, chunk_size=500, pause=0.0):
+        """Move members who last attended before `before` to the archive.
+
+        Members are moved `chunk_size` at a time, each chunk in its own
+        short transaction, so other connections (and other threads using
+        this object) can write between chunks. Members with no
+        last_attended date are not archived. The default archive is
+        enabled first if `enable_archive` has not been called.
+
+        Arguments:
+            before:     a date; members last attending earlier are archived
+            chunk_size: the number of members moved per transaction
+            pause:      seconds to sleep between chunks, giving other
+                        writers a turn
+
+        Returns:
+            The number of members archived.
+        """
+        if self.__archive is None:
+            self.enable_archive()
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS '
+                                  'users_last_attended ON users '
+                                  '(last_attended)')
+        archived = 0
+        while True:
+            with self._lock, self.transaction():
+                moved = self.__move_rows(
+                    'main.users', self.__archive,
+                    'id IN (SELECT id FROM main.users '
+                    'WHERE last_attended<? LIMIT ?)', (before, chunk_size))
+            archived += moved
+            if moved < chunk_size:
+                return archived
+            time.sleep(pause)
+
+    def __move_rows(self, source, dest, where, values):
+        """Move the rows of `source` matching `where` to `dest`.
+
+        Every column the tables have in common is copied, including the id.
+
+        Returns:
+            The number of rows moved.
+        """
+        dest_columns = set(self.__table_columns(dest))
+        columns = ','.join(column for column
+                           in self.__table_columns(source)
+                           if column in dest_columns)
+        cursor = self.__connection.cursor()
+        cursor.execute('INSERT INTO {dest} ({columns}) SELECT {columns} '
+                       'FROM {source} WHERE {where}'.format(
+                           dest=dest, columns=columns, source=source,
+                           where=where), values)
+        moved = cursor.rowcount
+        if moved:
+            cursor.execute('DELETE FROM {} WHERE {}'.format(source, where),
+                           values)
+        return moved
+
+    def __unarchive(self, where, values):
+        """Move archived members matching `where` back to `users`."""
+        return self.__move_rows(self.__archive, 'main.users', where, values)
+
+    def __archive_barcode_phrase(self, barcodes):
+        """Return the WHERE phrase matching `barcodes` in the archive.
+
+        Archives may predate the barcode_key column, and rows archived
+        before the keys were added have none, so those match by barcode.
+        """
+        marks = ','.join('?' * len(barcodes))
+        if 'barcode_key' not in self.__table_columns(self.__archive):
+            return 'barcode IN ({})'.format(marks), tuple(barcodes)
+        return ('barcode_key IN ({0}) OR '
+                'barcode_key IS NULL AND barcode IN ({0})'.format(marks),
+                tuple(_barcode_key(barcode) for barcode in barcodes) +
+                tuple(barcodes))
+
+    def __reactivate(self, member):
+        """Unarchive `member`, returning the authority it was found by."""
+        for authority in ('barcode', 'name'):
+            if not (member.barcode if authority == 'barcode'
+                    else member.name):
+                continue
+            if authority == 'barcode':
+                where, values = self.__archive_barcode_phrase(
+                    [member.barcode])
+            else:
+                where, values = self.__sql_search_name_phrase(member)
+            if where and self.__unarchive(where, values):
+                self.commit()
+                return authority
+        return None
+
+    def attach_history(self, db_files):
+        """Attach the databases of previous years for cross-year queries.
+
+        Each file is attached to this connection, and two TEMP views are
+        created over them: `history_users`, the union of their `users`
+        tables, and `all_users`, which adds this database's. Both have the
+        columns of MemberRecord plus a `source` column naming the file a
+        row came from ('main' for this database); columns missing from an
+        older file read as NULL. Views cannot be written to, so the
+        historical files are only ever read. Attaching again replaces the
+        previous set of files.
+
+        SQLite attaches at most 10 databases by default (an archive file
+        counts as one).
+
+        Arguments:
+            db_files:   the historical database files, e.g. one per year
+
+        Returns:
+            The source names of the files: their base names.
+        """
+        self.detach_history()
+        for index, db_file in enumerate(db_files):
+            schema = 'history_{:d}'.format(index)
+            self.__connection.execute('ATTACH DATABASE ? AS ' + schema,
+                                      (db_file, ))
+            self.__history.append((schema, os.path.basename(db_file)))
+
+        selects = [self.__history_select('main', 'main')] + [
+            self.__history_select(schema, source)
+            for schema, source in self.__history]
+        # with no files attached, history_users is empty
+        self.__connection.execute(
+            'CREATE TEMP VIEW history_users AS ' +
+            ' UNION ALL '.join(selects[1:] or [selects[0] + ' WHERE 0']))
+        self.__connection.execute(
+            'CREATE TEMP VIEW all_users AS ' + ' UNION ALL '.join(selects))
+        return [source for _, source in self.__history]
+
+    def __history_select(self, schema, source):
+        """Return a SELECT of `schema`.users for the history views."""
+        columns = set(self.__table_columns(schema + '.users'))
+        fields = {field: field if field in columns else 'NULL AS ' + field
+                  for field in MemberRecord._fields}
+        if ('college_id' in columns and
+                self.__table_columns(schema + '.colleges')):
+            fields['college'] = (
+                'COALESCE((SELECT name FROM {0}.colleges WHERE '
+                '{0}.colleges.id={0}.users.college_id), college) '
+                'AS college'.format(schema))
+        return "SELECT '{}' AS source,{} FROM {}.users".format(
+            source.replace("'", "''"),
+            ','.join(fields[field] for field in MemberRecord._fields),
+            schema)
+
+    def detach_history(self):
+        """Detach the files attached by `attach_history`."""
+        self.commit()  # detaching is not possible inside a transaction
+        self.__connection.execute('DROP VIEW IF EXISTS temp.history_users')
+        self.__connection.execute('DROP VIEW IF EXISTS temp.all_users')
+        for schema, _ in self.__history:
+            self.__connection.execute('DETACH DATABASE ' + schema)
+        self.__history = []
+
+    def get_history(self, member):
+        """Return `member`'s records from this year or else past years.
+
+        This database is searched first, as `get_records` does (by barcode,
+        then by name). Only if the member is not found are the files
+        attached by `attach_history` searched, with a single UNION ALL query
+        over all of them per authority. No timestamps are updated.
+
+        Returns:
+            A list of (source, MemberRecord) tuples, where `source` is 'main'
+            or the name of the historical file the record is from; empty if
+            the member was never found.
+
+        Raises:
+            BadMemberError: `member` has neither name nor barcode
+        """
+        if not member or not (member.barcode or member.name):
+            raise BadMemberError(member)
+        authorities = [authority for authority, given
+                       in (('barcode', member.barcode), ('name', member.name))
+                       if given]
+        for authority in authorities:
+            records = self.get_records(member, authority)
+            if records:
+                return [('main', record) for record in records]
+
+        if not self.__history:
+            return []
+        cursor = self.__connection.cursor()
+        for authority in authorities:
+            selects = []
+            values = ()
+            for schema, source in self.__history:
+                where, schema_values = self.__history_phrase(schema, member,
+                                                             authority)
+                if where:
+                    selects.append('{} WHERE {}'.format(
+                        self.__history_select(schema, source), where))
+                    values += schema_values
+            if not selects:
+                continue
+            cursor.execute(' UNION ALL '.join(selects), values)
+            records = [(row[0], MemberRecord(*row[1:]))
+                       for row in cursor.fetchall()]
+            if records:
+                return records
+        return []
+
+    def __history_phrase(self, schema, member, authority):
+        """Return the WHERE phrase searching `schema`.users for `member`.
+
+        Each file is searched with the keys it has indexes for, if any.
+        """
+        indexes = set(row[1] for row in self.__connection.execute(
+            'PRAGMA {}.index_list(users)'.format(schema)))
+        if authority == 'barcode':
+            if 'users_barcode_key' in indexes:
+                return 'barcode_key=?', (_barcode_key(member.barcode), )
+            return 'barcode=?', (member.barcode, )
+        if 'users_name_key' in indexes:
+            return self.__sql_name_key_phrase(member)
+        return self.__sql_build_name_value_pairs(member, ' AND ')
+
+    @_profiled
+    def history_count(self, distinct=False):
+        """Return the number of members across every year, in one query.
+
+        Counts the rows of this database and of every file attached by
+        `attach_history` (which must have been called).
+
+        Arguments:
+            distinct:   count distinct barcodes (see `_barcode_key`) rather
+                        than rows, so members present in several years are
+                        counted once and members without a barcode not at
+                        all
+        """
+        cursor = self.__connection.cursor()
+        if distinct:
+            cursor.execute('SELECT COUNT(DISTINCT {}) FROM '
+                           'temp.all_users'.format(
+                               self.BARCODE_KEY_SQL.format('barcode')))
+        else:
+            cursor.execute('SELECT COUNT(*) FROM temp.all_users')
+        return int(cursor.fetchone()[0])
+
+    @_profiled
+    def iter_history(self, chunk_size=1000):
+        """Yield (source, MemberRecord) tuples for every row of every year.
+
+        Rows are read with a single query over `all_users` (see
+        `attach_history`): this database first, then the attached files in
+        order, `chunk_size` rows at a time.
+        """
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT source,{} FROM temp.all_users'.format(
+            ','.join(MemberRecord._fields)))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row[0], MemberRecord(*row[1:])
+
+    def create_sync_indexes(self):
+        """Create the indexes used by `export_changes` and `merge_changes`.
+
+        With these, exports and merges cost time proportional to the number
+        of changed rows rather than the size of the table.
+        """
+        for name, columns in (('updated_at', 'updated_at'),
+                              ('last_attended', 'last_attended'),
+                              ('barcode', 'barcode'),
+                              ('name', 'lastName, firstName')):
+            self.__connection.execute(
+                'CREATE INDEX IF NOT EXISTS users_{} ON users ({})'.format(
+                    name, columns))
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS sync_watermarks ('
+            'source TEXT PRIMARY KEY NOT NULL, watermark DATETIME)')
+        self.commit()
+
+    @_profiled
+    def export_changes(self, since=None):
+        """Return the rows changed since the watermark `since`.
+
+        A row has changed if it was added or updated (its updated_at is later
+        than `since`) or if the member attended on or after `since`'s date.
+
+        Arguments:
+            since:  a watermark returned by a previous export, or None to
+                    export every row
+
+        Returns:
+            A (watermark, records) tuple: `records` is a list of
+            MemberRecords and `watermark` should be passed as `since` to the
+            next export to get only the rows changed after this one.
+        """
+        watermark = datetime.utcnow()
+        if since is None:
+            return watermark, list(self.iter_records())
+
+        if isinstance(since, str):
+            since_date = since[:10]
+        else:
+            since_date = since.date()
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT {} FROM users '
+                       'WHERE updated_at>? OR last_attended>=? '
+                       'ORDER BY id'.format(self.__record_select()),
+                       (since, since_date))
+        return watermark, [MemberRecord(*row) for row in cursor.fetchall()]
+
+    def __merge_record(self, record):
+        """Merge a record, returning 'inserted', 'updated' or 'unchanged'."""
+        member = Member(barcode=record.barcode,
+                        name=Name(record.firstName, record.lastName))
+        authority = None
+        existing = []
+        if record.barcode:
+            existing = self.get_records(member, authority='barcode')
+            authority = 'barcode'
+        if not existing and member.name:
+            existing = self.get_records(member, authority='name')
+            authority = 'name'
+        if not existing:
+            self.insert_records([record])
+            return 'inserted'
+
+        merged = 'unchanged'
+        cursor = self.__connection.cursor()
+        for row in existing:
+            last_attended = max(filter(None, [row.last_attended,
+                                              record.last_attended]),
+                                default=None)
+            if last_attended != row.last_attended:
+                cursor.execute('UPDATE users SET last_attended=? WHERE id=?',
+                               (last_attended, row.id))
+                merged = 'updated'
+            if str(record.updated_at or '') <= str(row.updated_at or ''):
+                continue  # the existing row is at least as recent
+
+            # as for autofix: the authority is kept and the rest updated
+            changes = (('college', record.college or row.college),
+                       ('updated_at', record.updated_at))
+            if authority == 'barcode' and member.name:
+                changes += (('firstName', record.firstName),
+                            ('lastName', record.lastName))
+            elif authority == 'name' and record.barcode:
+                changes += (('barcode', record.barcode), ) + tuple(zip(
+                    *self.__barcode_key_column(record.barcode)))
+            cursor.execute(
+                'UPDATE users SET {} WHERE id=?'.format(
+                    ','.join(column + '=?' for column, _ in changes)),
+                tuple(value for _, value in changes) + (row.id, ))
+            merged = 'updated'
+        return merged
+
+    @_profiled
+    def merge_changes(self, records):
+        """Merge rows exported from another database into this one.
+
+        Each record is matched against existing rows by barcode or, failing
+        that, by name, as in `get_member`. Unmatched records are inserted.
+        Where a record is newer (by updated_at) than the row it matches, the
+        row is updated with the same rules as autofixing: a barcode match
+        takes the record's name and a name match takes its barcode. The
+        later last_attended date always wins. Changes are committed at the
+        end of the merge.
+
+        Returns:
+            A MergeReport counting inserted, updated and unchanged records.
+        """
+        counts = collections.Counter()
+        for record in records:
+            counts[self.__merge_record(record)] += 1
+        self.commit()
+        return MergeReport(counts['inserted'], counts['updated'],
+                           counts['unchanged'])
+
+    def sync_from(self, source, source_name):
+        """Merge the rows changed in `source` since the last sync from it.
+
+        The watermark of each source is stored in this database, so repeated
+        syncs only transfer rows changed since the previous one.
+
+        Arguments:
+            source:         the MemberDatabase to pull changes from
+            source_name:    a name identifying `source` across syncs, such as
+                            the name of the kiosk
+
+        Returns:
+            The MergeReport of the merge.
+        """
+        self.create_sync_indexes()
+        source.create_sync_indexes()
+        cursor = self.__connection.cursor()
+        cursor.execute('SELECT watermark FROM sync_watermarks WHERE source=?',
+                       (source_name, ))
+        row = cursor.fetchone()
+        watermark, records = source.export_changes(row[0] if row else None)
+        report = self.merge_changes(records)
+        cursor.execute('INSERT OR REPLACE INTO sync_watermarks '
+                       '(source, watermark) VALUES (?, ?)',
+                       (source_name, watermark))
+        self.commit()
+        return report
+
+    # per authority: the roster columns identifying a member, the detail
+    # columns the roster may change and the index backing the join
+    RECONCILE_KEYS = {
+        'barcode': (('barcode', ), ('firstName', 'lastName', 'college'),
+                    ('barcode', 'barcode')),
+        'name': (('firstName', 'lastName'), ('barcode', 'college'),
+                 ('name', 'lastName, firstName')),
+        }
+
+    @_profiled
+    @_synchronized
+    def reconcile(self, roster, authority='barcode', apply=True):
+        """Reconcile the database with a roster of members.
+
+        The roster is loaded into a temporary table and compared with the
+        `users` table by joins, so reconciling costs a handful of statements
+        rather than a lookup and autofix per member. Roster members are
+        matched by barcode or by name, as `authority` determines, and the
+        other details are updated as by autofixing: details missing from a
+        roster member are left alone. Roster members with no match are
+        added, without an attendance date. Members missing from the roster
+        are reported but not removed. If a member appears in the roster
+        more than once, the first appearance is used.
+
+        Arguments:
+            roster:     an iterable of Member objects
+            authority:  'barcode' or 'name': how roster members are matched
+                        to existing members (roster members without one are
+                        skipped); names are matched by their keys if the
+                        database has them, as in `get_member`
+            apply:      if False, only report the differences
+
+        Returns:
+            A ReconcileReport.
+
+        Raises:
+            BadSearchAuthorityError: `authority` is not 'barcode' or 'name'
+        """
+        if authority not in self.RECONCILE_KEYS:
+            raise MemberDatabase.BadSearchAuthorityError(authority)
+
+        with self.transaction():
+            return self.__reconcile(roster, authority, apply)
+
+    def __reconcile(self, roster, authority, apply):
+        keys, details, (index, index_columns) = self.RECONCILE_KEYS[authority]
+        cursor = self.__connection.cursor()
+        roster_rows = self.__roster_rows(roster, keys)
+        if authority == 'name' and self.__name_keyed:
+            keys = ('firstName_key', 'lastName_key')
+            self.__backfill_name_keys()
+        elif authority == 'barcode' and self.__barcode_keyed():
+            keys = ('barcode_key', )
+        else:
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS users_{} ON users ({})'.format(
+                    index, index_columns))
+        cursor.execute('DROP TABLE IF EXISTS temp.socman_roster')
+        cursor.execute('CREATE TEMP TABLE socman_roster ('
+                       'barcode INTEGER, firstName VARCHAR(255), '
+                       'lastName VARCHAR(255), college VARCHAR(255), '
+                       'firstName_key VARCHAR(255), '
+                       'lastName_key VARCHAR(255), barcode_key TEXT, '
+                       'UNIQUE ({}))'.format(','.join(keys)))
+        try:
+            cursor.executemany(
+                'INSERT OR IGNORE INTO temp.socman_roster '
+                '(barcode, firstName, lastName, college, firstName_key, '
+                'lastName_key, barcode_key) VALUES (?1, ?2, ?3, ?4, '
+                'socman_name_key(?2), socman_name_key(?3), ?5)', roster_rows)
+            # barcode keys are written with barcodes (see `_barcode_key`)
+            key_columns = self.__barcode_key_column(None)[0]
+            assigned = details + (key_columns if 'barcode' in details
+                                  else ())
+
+            match = ' AND '.join('users.{0}=r.{0}'.format(key)
+                                 for key in keys)
+            differs = ' OR '.join(
+                '(r.{} IS NOT NULL AND {} IS NOT {})'.format(
+                    column, *((self.__college_sql(),
+                               self.__college_name_sql('r.college'))
+                              if column == 'college' else
+                              ('users.' + column, 'r.' + column)))
+                for column in details)
+            select = ('SELECT r.barcode,r.firstName,r.lastName,r.college '
+                      'FROM temp.socman_roster r WHERE ')
+            cursor.execute(select + 'NOT EXISTS (SELECT 1 FROM users '
+                           'WHERE {}) ORDER BY r.rowid'.format(match))
+            new = [self.__roster_member(row) for row in cursor.fetchall()]
+            cursor.execute(select + 'EXISTS (SELECT 1 FROM users WHERE {} '
+                           'AND ({})) ORDER BY r.rowid'.format(match, differs))
+            changed = [self.__roster_member(row)
+                       for row in cursor.fetchall()]
+            cursor.execute('SELECT COUNT(*) FROM temp.socman_roster')
+            matched = cursor.fetchone()[0] - len(new) - len(changed)
+            cursor.execute(
+                'SELECT barcode,firstName,lastName,{} FROM users '
+                'WHERE NOT EXISTS (SELECT 1 FROM temp.socman_roster r '
+                'WHERE {}) ORDER BY id'.format(self.__college_sql(), match))
+            missing = [self.__roster_member(row)
+                       for row in cursor.fetchall()]
+
+            if apply and changed:
+                now = datetime.utcnow()
+                cursor.execute(
+                    'UPDATE users SET ({}, updated_at) = (SELECT {}, ? '
+                    'FROM temp.socman_roster r WHERE {}) WHERE EXISTS ('
+                    'SELECT 1 FROM temp.socman_roster r WHERE {} AND '
+                    '({}))'.format(
+                        ','.join(assigned),
+                        ','.join('COALESCE(r.{0}, users.{0})'.format(column)
+                                 for column in assigned),
+                        match, match, differs),
+                    (now, ))
+            if apply and new:
+                now = datetime.utcnow()
+                cursor.execute(
+                    'INSERT INTO users (barcode, firstName, lastName, '
+                    'college, datejoined, created_at, updated_at{}) '
+                    "SELECT COALESCE(r.barcode, ''), r.firstName, "
+                    "r.lastName, COALESCE(r.college, ''), ?, ?, ?{} "
+                    'FROM temp.socman_roster r WHERE NOT EXISTS ('
+                    'SELECT 1 FROM users WHERE {}) ORDER BY r.rowid'.format(
+                        ''.join(',' + column for column in key_columns),
+                        ''.join(',r.' + column for column in key_columns),
+                        match),
+                    (date.today(), now, now))
+        finally:
+            cursor.execute('DROP TABLE temp.socman_roster')
+        return ReconcileReport(matched, new, changed, missing)
+
+    def __roster_rows(self, roster, keys):
+        """Yield roster members as rows, skipping those without `keys`."""
+        for member in roster:
+            name = member.name or Name()
+            row = {'barcode': member.barcode or None,
+                   'firstName': name.first() or None,
+                   'lastName': name.last() or None,
+                   'college': member.college or None}
+            if all(row[key] is not None for key in keys):
+                yield (row['barcode'], row['firstName'], row['lastName'],
+                       row['college'], row['barcode'] and _barcode_key(
+                           row['barcode']) or None)
+
+    def __roster_member(self, row):
+        barcode, first_name, last_name, college = row
+        return Member(barcode=barcode, name=Name(first_name, last_name),
+                      college=college)
+
+    def enable_changelog(self, retain=100000):
+        """Maintain a changelog of inserts, updates and deletes by trigger.
+
+        Triggers on the `users` table append an entry to the `changelog`
+        table whenever a row is inserted, deleted or has a member detail
+        changed (attendance timestamps alone are not logged). Entries are
+        read with `changes_since`. Calling this again replaces the triggers,
+        e.g. to change `retain`.
+
+        Arguments:
+            retain: number of most recent entries to keep. Older entries are
+                    deleted automatically every 1000 changes; consumers that
+                    fall further behind should resynchronise fully.
+        """
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS changelog ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
+            'operation TEXT NOT NULL, '
+            'member_id INTEGER NOT NULL, '
+            'barcode, '
+            'changed_at DATETIME DEFAULT CURRENT_TIMESTAMP)')
+        self.__create_changelog_triggers()
+        self.__connection.execute('DROP TRIGGER IF EXISTS changelog_compact')
+        self.__connection.execute(
+            'CREATE TRIGGER changelog_compact AFTER INSERT ON changelog '
+            'WHEN NEW.seq % 1000 = 0 BEGIN '
+            'DELETE FROM changelog WHERE seq <= NEW.seq - {:d}; END'.format(
+                retain))
+        self.commit()
+
+    def __create_changelog_triggers(self):
+        """(Re)create the triggers on `users` appending to the changelog."""
+        columns = [column for column in self.__record_columns()
+                   if column not in ('id', 'created_at', 'updated_at',
+                                     'last_attended')]
+        when = ''
+        if self.__colleges:
+            # a college rewritten as itself or replaced by its id (see
+            # `__create_colleges`, `migrate_colleges`) is not a change
+            college = ('CASE WHEN {0}.college IS NULL THEN (SELECT name FROM '
+                       'colleges WHERE colleges.id={0}.college_id) '
+                       'ELSE {1} END')
+            when = 'WHEN NOT ({} IS {} AND {}) '.format(
+                college.format('OLD', self.__college_name_sql(
+                    'TRIM(OLD.college)')),
+                college.format('NEW', self.__college_name_sql(
+                    'TRIM(NEW.college)')),
+                ' AND '.join('OLD.{0} IS NEW.{0}'.format(column)
+                             for column in columns if column != 'college'))
+        triggers = (
+            ('insert', 'AFTER INSERT ON users ', 'NEW'),
+            ('update', 'AFTER UPDATE OF {} ON users {}'.format(
+                ', '.join(columns), when), 'NEW'),
+            ('delete', 'AFTER DELETE ON users ', 'OLD'),
+            )
+        for operation, event, row in triggers:
+            self.__connection.execute(
+                'DROP TRIGGER IF EXISTS users_changelog_' + operation)
+            self.__connection.execute(
+                'CREATE TRIGGER users_changelog_{0} {1}BEGIN '
+                'INSERT INTO changelog (operation, member_id, barcode) '
+                "VALUES ('{0}', {2}.id, {2}.barcode); END".format(
+                    operation, event, row))
+
+    def disable_changelog(self):
+        """Remove the changelog triggers, keeping existing entries."""
+        for trigger in ('users_changelog_insert', 'users_changelog_update',
+                        'users_changelog_delete', 'changelog_compact'):
+            self.__connection.execute('DROP TRIGGER IF EXISTS ' + trigger)
+        self.commit()
+
+    def changes_since(self, seq=0, chunk_size=500):
+        """Yield the changelog entries after sequence number `seq` in order.
+
+        Entries are fetched `chunk_size` at a time with no cursor held open
+        between chunks, so slow consumers do not block writers. Pass the
+        `seq` of the last entry processed to resume polling later.
+
+        Yields:
+            ChangelogEntry tuples.
+        """
+        cursor = self.__connection.cursor()
+        while True:
+            cursor.execute('SELECT seq,operation,member_id,barcode,changed_at '
+                           'FROM changelog WHERE seq>? ORDER BY seq LIMIT ?',
+                           (seq, chunk_size))
+            entries = cursor.fetchall()
+            for entry in entries:
+                yield ChangelogEntry(*entry)
+            if len(entries) < chunk_size:
+                break
+            seq = entries[-1][0]
+
+    def compact_changelog(self):
+        """Keep only the latest changelog entry for each member.
+
+        A consumer reading the compacted log sees every member changed since
+        its last poll, but only the last operation on each.
+
+        Returns:
+            The number of entries removed.
+        """
+        cursor = self.__connection.cursor()
+        cursor.execute('DELETE FROM changelog WHERE seq NOT IN '
+                       '(SELECT MAX(seq) FROM changelog GROUP BY member_id)')
+        self.commit()
+        return cursor.rowcount
+
+    def __backup_filename(self, dest):
+        """Return the file to back up to, given a file or directory `dest`."""
+        if not os.path.isdir(dest):
+            return dest
+        stem, extension = os.path.splitext(os.path.basename(
+            str(self.__db_file)))
+        return os.path.join(dest, '{}-{}{}'.format(
+            stem, datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+            extension or '.db'))
+
+    def __rotate_backups(self, backup_filename, keep):
+        """Delete all but the `keep` most recent backups like this one."""
+        directory = os.path.dirname(backup_filename) or '.'
+        stem, extension = os.path.splitext(os.path.basename(
+            str(self.__db_file)))
+        backups = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith(stem + '-') and
+            name.endswith(extension or '.db'))
+        for name in backups[:-keep]:
+            os.remove(os.path.join(directory, name))
+
+    # pages freed by each incremental vacuum step of `maintain`
+    VACUUM_STEP_PAGES = 256
+
+    @_synchronized
+    def maintain(self, budget=5.0, analyze=True, vacuum=True, check=True,
+                 log=None):
+        """Run routine maintenance, taking at most `budget` seconds.
+
+        The steps run in order while time remains:
+
+            analyze:    refresh the query planner's statistics with an
+                        ANALYZE bounded by `PRAGMA analysis_limit`, then
+                        `PRAGMA optimize`
+            vacuum:     return free pages to the file system, a few at a
+                        time until none are left; skipped unless the
+                        database uses incremental auto-vacuum (see
+                        `enable_incremental_vacuum`)
+            check:      verify the database with `PRAGMA quick_check`
+
+        A step still running when the budget runs out is interrupted and
+        its work rolled back. Pending changes are committed first, so do
+        not call this inside a `transaction` block. A replica maintains its
+        file rather than the copy in memory.
+
+        Arguments:
+            budget:     the time budget in seconds
+            analyze, vacuum, check:     whether to run each step
+            log:        a callable given a message about each step, with
+                        file sizes and timings; by default messages go to
+                        the 'socman' logger at INFO level
+
+        Returns:
+            A MaintenanceReport.
+        """
+        log = log or logging.getLogger('socman').info
+        schema = 'socman_disk' if self.__replica else 'main'
+        self.commit()
+        deadline = time.monotonic() + budget
+        size_before = self.__file_size(schema)
+        log('Maintaining {}: {} bytes, {} free pages.'.format(
+            self.__db_file, size_before, self.__pragma(schema,
+                                                       'freelist_count')))
+
+        def vacuum_steps():
+            if self.__pragma(schema, 'auto_vacuum') != 2:
+                log('Skipping vacuum: incremental vacuum is not enabled.')
+                return
+            while self.__pragma(schema, 'freelist_count'):
+                self.__connection.execute(
+                    'PRAGMA {}.incremental_vacuum({:d})'.format(
+                        schema, self.VACUUM_STEP_PAGES)).fetchall()
+
+        def quick_check():
+            return [row[0] for row in self.__connection.execute(
+                'PRAGMA {}.quick_check'.format(schema))]
+
+        steps = [(name, function) for name, function, wanted in (
+            ('analyze', lambda: self.__connection.executescript(
+                'PRAGMA {0}.analysis_limit=400; ANALYZE {0}; '
+                'PRAGMA {0}.optimize;'.format(schema)), analyze),
+            ('vacuum', vacuum_steps, vacuum),
+            ('check', quick_check, check)) if wanted]
+        timings = collections.OrderedDict()
+        interrupted = None
+        integrity = None
+        # the progress handler interrupts any statement overrunning
+        self.__connection.set_progress_handler(
+            lambda: time.monotonic() > deadline, 1000)
+        try:
+            for name, function in steps:
+                if time.monotonic() > deadline:
+                    log('Skipping {}: out of time.'.format(name))
+                    continue
+                start = time.monotonic()
+                try:
+                    result = function()
+                except sqlite3.OperationalError as error:
+                    if 'interrupt' not in str(error):
+                        raise
+                    interrupted = name
+                    log('Interrupted {}: out of time.'.format(name))
+                    continue
+                finally:
+                    timings[name] = time.monotonic() - start
+                log('Ran {} in {:.3f} s.'.format(name, timings[name]))
+                if name == 'check':
+                    integrity = 'ok' if result == ['ok'] else result
+                    log('Integrity check: {}.'.format(
+                        '; '.join(result)))
+        finally:
+            self.__connection.set_progress_handler(None, 0)
+        size_after = self.__file_size(schema)
+        log('Maintained {} in {:.3f} s: {} bytes, {} bytes freed.'.format(
+            self.__db_file, sum(timings.values()), size_after,
+            size_before - size_after))
+        return MaintenanceReport(size_before, size_after, dict(timings),
+                                 interrupted, integrity)
+
+    def __pragma(self, schema, pragma):
+        """Return the value of an integer PRAGMA of `schema`."""
+        return self.__connection.execute(
+            'PRAGMA {}.{}'.format(schema, pragma)).fetchone()[0]
+
+    def __file_size(self, schema):
+        """Return the size in bytes of the database `schema`."""
+        return (self.__pragma(schema, 'page_count') *
+                self.__pragma(schema, 'page_size'))
+
+    @_synchronized
+    def enable_incremental_vacuum(self):
+        """Switch the database to incremental auto-vacuum.
+
+        This lets `maintain` shrink the file a few pages at a time. It
+        rewrites the whole file with VACUUM once, which takes a while on a
+        large database and needs as much free disk space again.
+        """
+        schema = 'socman_disk' if self.__replica else 'main'
+        self.commit()
+        if self.__pragma(schema, 'auto_vacuum') != 2:
+            self.__connection.execute(
+                'PRAGMA {}.auto_vacuum=INCREMENTAL'.format(schema))
+            self.__connection.execute('VACUUM ' + schema)
+
+    def backup(self, dest, pages_per_step=64, sleep=0.005, progress=None,
+               keep=None, background=False):
+        """Back up the database while it stays in use.
+
+        The copy is made with SQLite's online backup API over a separate
+        connection, `pages_per_step` pages at a time with a pause of `sleep`
+        seconds between steps. Each step only holds a read lock briefly, so
+        check-ins on this or other connections wait at most one step. The
+        copy is written to a temporary file and renamed into place once
+        complete, so `dest` never holds a torn copy. Requires Python 3.7.
+
+        Note that SQLite restarts a backup when the database is written by
+        another connection between steps, so very frequent writes delay
+        the backup (but never corrupt it).
+
+        Arguments:
+            dest:       filename of the backup, or a directory in which to
+                        create a timestamped backup file
+            pages_per_step: number of pages copied per step; smaller values
+                            keep check-in latency lower
+            sleep:      seconds to pause between steps, and before retrying
+                        a step that found the database locked
+            progress:   optional callable, called after every step as
+                        progress(status, remaining, total) (see sqlite3)
+            keep:       if `dest` is a directory, delete all but the `keep`
+                        most recent backups of this database there
+            background: if True, run the backup on a new thread and return
+                        the (started) threading.Thread instead of waiting
+
+        Returns:
+            The backup's filename, or the backup thread if `background`.
+        """
+        # committed changes only are visible to the backup connection
+        self.commit()
+        backup_filename = self.__backup_filename(dest)
+        in_memory = self.__db_file == ':memory:'
+
+        def step(status, remaining, total):
+            if progress is not None:
+                progress(status, remaining, total)
+            # sqlite3 itself only sleeps when a step finds the database busy
+            if remaining and sleep:
+                time.sleep(sleep)
+
+        def run():
+            temp_filename = backup_filename + '.tmp'
+            source = (self.__connection if in_memory
+                      else sqlite3.connect(self.__db_file))
+            target = sqlite3.connect(temp_filename)
+            try:
+                source.backup(target, pages=pages_per_step, progress=step,
+                              sleep=sleep)
+            finally:
+                target.close()
+                if not in_memory:
+                    source.close()
+            os.replace(temp_filename, backup_filename)
+            if keep and os.path.isdir(dest):
+                self.__rotate_backups(backup_filename, keep)
+
+        if background and not in_memory:
+            thread = threading.Thread(target=run, name='socman-backup')
+            thread.start()
+            return thread
+        run()
+        return backup_filename
+
+    @_profiled
     def write_csv(self, csv_filename):
         """Write the entire database to a CSV file."""
-        csv_writer = csv.writer(open(csv_filename, 'w'))
+        with open(csv_filename, 'w') as csv_file:
+            self.__write_csv(csv.writer(csv_file))
+
+    def __write_csv(self, csv_writer):
         cursor = self.__connection.cursor()
-        cursor.execute('SELECT * FROM users')
+        cursor.execute('SELECT {} FROM users'.format(self.__record_select()))
 
         csv_writer.writerow([
             'id',
@@ -487,4 +3283,374 @@ class MemberDatabase:
             'last_attended',
             'unpaid'
             ])
-        csv_writer.writerows(cursor.fetchall())
+        csv_writer.writerows(cursor)
+
+
+class ShardedMemberDatabase:
+
+    """A member database split across several SQLite3 files.
+
+    Members are routed to a shard by a hash of their barcode, so barcode
+    lookups touch a single file. Lookups by name cannot be routed and are
+    run on every shard in parallel threads. The interface matches
+    MemberDatabase: `get_member`, `get_members`, `add_member`,
+    `update_member`, `member_count`, `write_csv` and `write_snapshot` behave
+    as for a single database, merging results from every shard where needed.
+
+    Members without a barcode live in the shard of the empty barcode. When
+    an autofix gives a member a barcode belonging to another shard, the
+    member's row is moved to that shard.
+
+    Use `rebalance` to copy a sharded database to a different number of
+    shards.
+    """
+
+    def __init__(self, db_files, safe=True):
+        """Create a ShardedMemberDatabase.
+
+        Arguments:
+            db_files:   list of SQLite3 database filenames, one per shard. The
+                        order matters: routing depends on each file's position.
+                        Missing files and tables are created.
+            safe:       passed to the MemberDatabase of each shard
+        """
+        if not db_files:
+            raise ValueError('at least one shard is required')
+        self.__db_files = [os.path.abspath(db_file) for db_file in db_files]
+        self.__shards = [MemberDatabase(db_file, safe=safe,
+                                        check_same_thread=False)
+                         for db_file in db_files]
+        for shard in self.__shards:
+            shard.create_schema()
+        self.__executor = ThreadPoolExecutor(len(self.__shards))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close every shard and stop the worker threads."""
+        self.__executor.shutdown()
+        for shard in self.__shards:
+            shard.close()
+
+    @property
+    def shards(self):
+        """The list of MemberDatabase objects, one per shard."""
+        return list(self.__shards)
+
+    def shard_index(self, barcode):
+        """Return the index of the shard holding members with `barcode`."""
+        key = _barcode_key(barcode) if barcode else ''
+        return zlib.crc32(key.encode('utf-8')) % len(self.__shards)
+
+    def shard_for(self, barcode):
+        """Return the MemberDatabase holding members with `barcode`."""
+        return self.__shards[self.shard_index(barcode)]
+
+    def __map(self, function, shards=None):
+        """Call `function` on every shard in parallel; return the results."""
+        return list(self.__executor.map(function, shards or self.__shards))
+
+    def commit(self):
+        """Commit pending changes on every shard."""
+        for shard in self.__shards:
+            shard.commit()
+
+    def optional_commit(self):
+        """Commit pending changes on every shard if `safe` is set."""
+        for shard in self.__shards:
+            shard.optional_commit()
+
+    def __find_by_name(self, member, exclude=None):
+        """Return the shards (other than `exclude`) where `member`'s name is.
+
+        `exclude` is skipped because its caller has already searched it.
+        """
+        by_name = Member(barcode=None, name=member.name)
+
+        def lookup(shard):
+            try:
+                shard.get_member(by_name, update_timestamp=False)
+            except MemberNotFoundError:
+                return None
+            return shard
+
+        shards = [shard for shard in self.__shards if shard is not exclude]
+        return [shard for shard in self.__map(lookup, shards) if shard]
+
+    def __move_by_name(self, source, member, update_timestamp):
+        """Move rows matching `member`'s name to its barcode's shard."""
+        records = source.get_records(member, authority='name')
+        source.delete_records(record.id for record in records)
+        changes = {'barcode': member.barcode, 'updated_at': datetime.utcnow()}
+        if update_timestamp:
+            changes['last_attended'] = date.today()
+        target = self.shard_for(member.barcode)
+        target.insert_records(record._replace(**changes)
+                              for record in records)
+        target.commit()
+        source.commit()
+
+    def get_member(self, member, update_timestamp=True, autofix=False):
+        """Retrieve a member's names from the database.
+
+        See `MemberDatabase.get_member`. The barcode's shard is searched first
+        (by barcode and then by name); only if that fails are the other
+        shards searched by name, in parallel.
+        """
+        if not member or not (member.barcode or member.name):
+            raise BadMemberError(member)
+
+        home = self.shard_for(member.barcode)
+        try:
+            return home.get_member(member, update_timestamp=update_timestamp,
+                                   autofix=autofix)
+        except MemberNotFoundError:
+            if not member.name:
+                raise
+
+        shards = self.__find_by_name(member, exclude=home)
+        if not shards:
+            raise MemberNotFoundError(member)
+        by_name = Member(barcode=None, name=member.name)
+        names = shards[0].get_member(by_name, update_timestamp=False)
+        if autofix and member.barcode:
+            for shard in shards:
+                self.__move_by_name(shard, member, update_timestamp)
+        elif update_timestamp:
+            for shard in shards:
+                shard.get_member(by_name, update_timestamp=True)
+        return names
+
+    def get_members(self, barcodes, update_timestamp=True, chunk_size=500):
+        """Retrieve the names of many members by barcode at once.
+
+        See `MemberDatabase.get_members`. Barcodes are grouped by shard and
+        each shard is queried in parallel.
+        """
+        groups = collections.defaultdict(list)
+        for barcode in barcodes:
+            if barcode:
+                groups[self.shard_index(barcode)].append(barcode)
+
+        def lookup(index):
+            return self.__shards[index].get_members(
+                groups[index], update_timestamp=update_timestamp,
+                chunk_size=chunk_size)
+
+        found = {}
+        for shard_found in self.__executor.map(lookup, list(groups)):
+            found.update(shard_found)
+        return found
+
+    def add_member(self, member):
+        """Add a member to the database.
+
+        See `MemberDatabase.add_member`. New members are added to the shard
+        of their barcode.
+        """
+        if not member or not (member.barcode or member.name):
+            raise BadMemberError(member)
+
+        try:
+            self.get_member(member, update_timestamp=True, autofix=True)
+        except MemberNotFoundError:
+            self.shard_for(member.barcode).add_member(member)
+
+    def update_member(self, member, authority='barcode',
+                      update_timestamp=True):
+        """Update the record for a member already in the database.
+
+        See `MemberDatabase.update_member`.
+        """
+        if not member or not (member.barcode or member.name):
+            raise BadMemberError(member)
+
+        if not (member.barcode and member.name):
+            raise IncompleteMemberError(member)
+
+        home = self.shard_for(member.barcode)
+        if authority == 'barcode':
+            self.get_member(member, update_timestamp=update_timestamp)
+            try:
+                home.update_member(member, authority='barcode',
+                                   update_timestamp=False)
+            except MemberNotFoundError:
+                pass  # only found by name, so there is nothing to rename
+        elif authority == 'name':
+            try:
+                home.update_member(member, authority='name',
+                                   update_timestamp=update_timestamp)
+                return
+            except MemberNotFoundError:
+                pass
+            shards = self.__find_by_name(member, exclude=home)
+            if not shards:
+                raise MemberNotFoundError(member)
+            for shard in shards:
+                self.__move_by_name(shard, member, update_timestamp)
+        else:
+            raise MemberDatabase.BadSearchAuthorityError(authority)
+
+    def member_count(self):
+        """Return the total number of members across all shards."""
+        return sum(self.__map(lambda shard: shard.member_count()))
+
+    def iter_records(self, chunk_size=1000):
+        """Yield every row of every shard as a MemberRecord, shard by shard."""
+        for shard in self.__shards:
+            for record in shard.iter_records(chunk_size):
+                yield record
+
+    def write_csv(self, csv_filename):
+        """Write the rows of every shard to a single CSV file."""
+        with open(csv_filename, 'w') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(MemberRecord._fields)
+            csv_writer.writerows(self.iter_records())
+
+    def write_snapshot(self, snapshot_filename):
+        """Write a BarcodeSnapshot of every member in every shard.
+
+        See `MemberDatabase.write_snapshot`.
+        """
+        return BarcodeSnapshot.write(
+            snapshot_filename,
+            ((record.barcode, record.firstName, record.lastName,
+              record.college) for record in self.iter_records()))
+
+    def rebalance(self, db_files, chunk_size=1000):
+        """Copy every member into a new set of shards.
+
+        The existing shards are left untouched; once the copy is complete,
+        open the new files with ShardedMemberDatabase in their place.
+
+        Arguments:
+            db_files:   the filenames of the new shards, which must not be
+                        shards of this database
+            chunk_size: number of rows inserted per statement
+
+        Returns:
+            A ShardedMemberDatabase over the new shards.
+        """
+        if set(map(os.path.abspath, db_files)) & set(self.__db_files):
+            raise ValueError('cannot rebalance into an existing shard')
+        target = ShardedMemberDatabase(db_files, safe=False)
+        chunks = collections.defaultdict(list)
+        for record in self.iter_records(chunk_size):
+            index = target.shard_index(record.barcode)
+            chunks[index].append(record)
+            if len(chunks[index]) >= chunk_size:
+                target.shards[index].insert_records(chunks.pop(index))
+        for index, records in chunks.items():
+            target.shards[index].insert_records(records)
+        target.commit()
+        return target
+
+
+class EventLog:
+
+    """A buffered, structured log of check-in events in JSON Lines format.
+
+    Each call to `record` appends one JSON object to the log file, holding
+    the event type, a UTC timestamp and any extra fields given. Writes are
+    buffered in memory and the file is flushed and fsynced according to
+    the sync policy: after every `sync_every` records or `sync_interval`
+    seconds after the first unsynced record, whichever comes first. The
+    interval is driven by a timer, so events are synced even when no further
+    records arrive. Logs can be read back with `read_event_log`.
+
+    Attributes:
+        filename:       path of the log file
+        sync_every:     number of records between syncs (None to disable)
+        sync_interval:  seconds between syncs (None to disable)
+    """
+
+    def __init__(self, filename, sync_every=100, sync_interval=5.0,
+                 buffer_size=65536):
+        """Open `filename` for appending events.
+
+        Arguments:
+            filename:       path of the log file, created if necessary
+            sync_every:     sync after this many records
+            sync_interval:  sync this many seconds after the first unsynced
+                            record, even if no further records are added
+            buffer_size:    size of the in-memory write buffer in bytes
+        """
+        self.filename = filename
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.__file = open(filename, 'a', buffering=buffer_size,
+                           encoding='utf-8')
+        self.__unsynced = 0
+        self.__sync_timer = None
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @_synchronized
+    def record(self, event, **fields):
+        """Append an event of type `event` with extra `fields` to the log."""
+        fields['event'] = event
+        fields['time'] = datetime.utcnow().isoformat()
+        self.__file.write(json.dumps(fields, sort_keys=True) + '\n')
+        self.__unsynced += 1
+
+        if self.sync_every and self.__unsynced >= self.sync_every:
+            self.sync()
+        elif self.sync_interval is not None and self.__sync_timer is None:
+            self.__sync_timer = threading.Timer(self.sync_interval,
+                                                self.__timed_sync)
+            self.__sync_timer.daemon = True
+            self.__sync_timer.start()
+
+    @_synchronized
+    def __timed_sync(self):
+        """Sync events left unsynced when the sync interval expires."""
+        self.__sync_timer = None
+        if self.__unsynced and not self.__file.closed:
+            self.sync()
+
+    @_synchronized
+    def sync(self):
+        """Flush buffered events and fsync the log file."""
+        if self.__sync_timer is not None:
+            self.__sync_timer.cancel()
+            self.__sync_timer = None
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__unsynced = 0
+
+    @_synchronized
+    def close(self):
+        """Sync and close the log file."""
+        if not self.__file.closed:
+            self.sync()
+            self.__file.close()
+
+
+def read_event_log(filename):
+    """Yield the events in a log written by EventLog, one dict at a time.
+
+    A truncated final line, as left by a crash between syncs, is skipped;
+    a line that cannot be parsed anywhere else in the log raises ValueError.
+    """
+    with open(filename, encoding='utf-8') as log_file:
+        bad_line = None
+        for line_number, line in enumerate(log_file, 1):
+            if bad_line is not None:
+                raise ValueError('corrupt event log {} at line {}'.format(
+                    filename, bad_line))
+            try:
+                event = json.loads(line)
+            except ValueError:
+                bad_line = line_number
+                continue
+            yield event
@@ -0,0 +1,810 @@
+"""
+socman_cli provides the `socman` command line interface.
+
+Each task is a subcommand: checkin, import, export, info, stats, sync,
+rebalance, serve and maintenance. Run `socman --help` or
+`socman SUBCOMMAND --help` for usage.
+
+Only argparse is imported at startup. Each subcommand imports the modules
+it needs when it runs, so that the command starts quickly on slow kiosk
+laptops however much the library grows; test_benchmarks.py guards this.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import argparse
+import sys
+
+
+def checkin(args):
+    """Check members in at an event, interactively or from a scan file."""
+    from datetime import date
+    from socman import (Name, Member, MemberDatabase, MemberNotFoundError,
+                        AmbiguousBarcodeError, EventLog)
+    from socman_server import CheckinClient, is_address
+
+    # track the number of members attending
+    attended = 0
+    newmembers = 0
+    oneoffs = 0
+    unknowns = 0
+
+    log_filename = str(date.today()) + '.jsonl'
+
+    def truncate(barcode):
+        # scanners may append check digits: only the first few are used
+        if args.barcode_length:
+            return barcode[:args.barcode_length]
+        return barcode
+    unknown_filename = args.unknown or str(date.today()) + '.unknown'
+
+    if is_address(args.db_file):
+        print('Connecting to {}'.format(args.db_file))
+        db = CheckinClient(args.db_file)
+    else:
+        print('Opening {}'.format(args.db_file))
+        db = MemberDatabase(args.db_file, commit_every=args.commit_every,
+                            commit_interval=args.commit_interval,
+                            barcode_prefix_length=args.barcode_length or None,
+                            replica=args.replica)
+    log = EventLog(log_filename, sync_every=args.log_sync_every,
+                   sync_interval=args.log_sync_interval)
+
+    try:
+        if args.barcode_cache and isinstance(db, MemberDatabase):
+            print('Loaded {} barcodes into memory.'.format(
+                db.enable_barcode_cache()))
+        if args.filter_error_rate and isinstance(db, MemberDatabase):
+            barcode_filter = db.enable_barcode_filter(args.filter_error_rate)
+            print('Loaded {} barcodes into filter '
+                  '(false positive rate {:.2%}).'.format(
+                      len(barcode_filter),
+                      barcode_filter.false_positive_rate()))
+
+        if args.input is not None:
+            scan_file = sys.stdin if args.input == '-' else open(args.input)
+            with scan_file, open(unknown_filename, 'w') as unknown_file:
+                for batch in read_batches(scan_file, args.batch_size):
+                    barcodes = [truncate(barcode) for barcode in batch
+                                if barcode != 'ONE']
+                    found = db.get_members(barcodes)
+                    oneoffs += len(batch) - len(barcodes)
+                    attended += len(batch) - len(barcodes)
+                    for _ in range(len(batch) - len(barcodes)):
+                        log.record('oneoff')
+                    for barcode in barcodes:
+                        log.record('scan', barcode=barcode)
+                        if barcode in found:
+                            first_name, last_name = found[barcode]
+                            log.record('member', barcode=barcode,
+                                       first_name=first_name,
+                                       last_name=last_name)
+                            attended += 1
+                        else:
+                            log.record('unknown', barcode=barcode)
+                            print(barcode, file=unknown_file)
+                            unknowns += 1
+            print('Wrote {} unknown barcodes to {}'.format(unknowns,
+                                                           unknown_filename))
+
+        while args.input is None:
+            try:
+                barcode = input('Enter barcode (or QUIT to exit): ')
+            except EOFError:
+                break
+            if barcode == 'QUIT':
+                break
+            if barcode == 'ONE':
+                log.record('oneoff')
+                oneoffs += 1
+                attended += 1
+                continue
+
+            if barcode:
+                barcode = truncate(barcode)
+                member = Member(barcode=barcode)
+                log.record('scan', barcode=barcode)
+                try:
+                    first_name, last_name = db.get_member(member)
+                    log.record('member', barcode=barcode,
+                               first_name=first_name, last_name=last_name)
+                except AmbiguousBarcodeError as error:
+                    log.record('ambiguous', barcode=barcode)
+                    print('Barcode matches several members ({}); please '
+                          'enter the whole barcode.'.format(
+                              ', '.join(error.barcodes)))
+                    continue
+                except MemberNotFoundError:
+                    log.record('unknown', barcode=barcode)
+                    print('Not a member. Enter name to add member.')
+                    print('Enter EOF or blank first and last name to cancel.')
+                    try:
+                        first_name = input('First name: ')
+                        last_name = input('Last name: ')
+                    except EOFError:
+                        log.record('oneoff', barcode=barcode)
+                        oneoffs += 1
+                        print('Cancelling adding member.')
+                        print()
+                        continue
+                    if first_name == '' and last_name == '':
+                        # cancel adding member
+                        log.record('cancel', barcode=barcode)
+                        print('Cancelling adding member.')
+                        print()
+                        continue
+                    member = Member(name=Name(first_name, last_name),
+                                    barcode=barcode)
+                    db.add_member(member)
+                    log.record('signup', barcode=barcode,
+                               first_name=first_name, last_name=last_name)
+                    newmembers += 1
+
+                print(first_name, last_name)
+                attended += 1
+    finally:
+        log.close()
+        db.close()
+
+    members = attended - newmembers - oneoffs
+    summary = """Attendance Summary
+------------------
+Members:        {}
+New Signups:    {}
+One offs:       {}
+Total:          {}""".format(members, newmembers, oneoffs, attended)
+
+    print(summary)
+
+    if args.report_filename is not None:
+        print('Writing summary to {}'.format(args.report_filename))
+        with open(args.report_filename, 'a') as report_file:
+            print(str(date.today()), file=report_file)
+            print('----------', file=report_file)
+            print(summary, file=report_file)
+            print('----------', file=report_file)
+            print(file=report_file)
+    return 0
+
+
+def read_batches(scan_file, batch_size):
+    """Yield lists of scanned lines from `scan_file`, stopping at QUIT."""
+    batch = []
+    for line in scan_file:
+        barcode = line.strip()
+        if barcode == 'QUIT':
+            break
+        if barcode:
+            batch.append(barcode)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_members(args):
+    """Add members to the database, prompting for each one's details."""
+    from socman import Name, Member, MemberDatabase
+
+    # track the number of members added
+    count = 0
+
+    print('Opening {}'.format(args.db_file))
+    with MemberDatabase(args.db_file) as db:
+        while True:
+            try:
+                first_name = input('Enter first name: ')
+                last_name = input('Enter last name: ')
+                barcode = input('Enter barcode: ')
+            except EOFError:
+                break
+
+            if first_name and last_name and barcode:
+                member = Member(name=Name(first_name, last_name),
+                                barcode=barcode)
+                db.add_member(member)
+                count += 1
+
+    print('Done adding {} members.'.format(count))
+    return 0
+
+
+def memory_profiler(args):
+    """Return a MemoryProfiler if --profile-memory was given, else None."""
+    if not args.profile_memory:
+        return None
+    from socman import MemoryProfiler
+    return MemoryProfiler()
+
+
+def print_memory_reports(profiler):
+    """Print the reports of a MemoryProfiler, if any, to standard error."""
+    if profiler is None:
+        return
+    for report in profiler.reports:
+        print('{}: peak {:.1f} KiB, retained {:.1f} KiB, {:.3f} s'.format(
+            report.operation, report.peak / 1024, report.retained / 1024,
+            report.seconds), file=sys.stderr)
+
+
+def export(args):
+    """Export the database to CSV and/or a barcode snapshot."""
+    from socman import MemberDatabase
+
+    profiler = memory_profiler(args)
+    with MemberDatabase(args.db_file, memory_profiler=profiler) as db:
+        if args.csv_filename:
+            print('Dumping database to {}.'.format(args.csv_filename))
+            db.write_csv(args.csv_filename)
+        if args.snapshot:
+            count = db.write_snapshot(args.snapshot)
+            print('Wrote {} barcodes to snapshot {}.'.format(
+                count, args.snapshot))
+    print_memory_reports(profiler)
+    return 0
+
+
+def info(args):
+    """Print the number of members, optionally dumping them to CSV."""
+    from socman import MemberDatabase
+
+    profiler = memory_profiler(args)
+    with MemberDatabase(args.db_file, memory_profiler=profiler) as db:
+        print('There are {} members in the database.'.format(
+            db.member_count()))
+        if args.history:
+            db.attach_history(args.history)
+            print('There are {} distinct members across {} years.'.format(
+                db.history_count(distinct=True), len(args.history) + 1))
+
+        if args.csv_filename:
+            print('Dumping database to {}.'.format(args.csv_filename))
+            db.write_csv(args.csv_filename)
+    print_memory_reports(profiler)
+    return 0
+
+
+def list_members(args):
+    """Write the members matching filters to standard output as CSV."""
+    import csv
+    from socman import MemberDatabase, MemberRecord
+
+    filters = {name: getattr(args, name) for name in (
+        'college', 'joined_since', 'joined_before', 'attended_since',
+        'attended_before', 'unpaid') if getattr(args, name) is not None}
+    with MemberDatabase(args.db_file) as db:
+        if args.count:
+            print(db.member_count(**filters))
+            return 0
+        if args.count_by_college:
+            csv_writer = csv.writer(sys.stdout)
+            csv_writer.writerow(['college', 'members'])
+            csv_writer.writerows(db.college_counts().items())
+            return 0
+        csv_writer = csv.writer(sys.stdout)
+        csv_writer.writerow(MemberRecord._fields)
+        csv_writer.writerows(db.query(order_by=args.order_by,
+                                      descending=args.descending,
+                                      limit=args.limit, **filters))
+    return 0
+
+
+def stats(args):
+    """Aggregate attendance from check-in event logs."""
+    import collections
+    from socman import read_event_log
+
+    events = collections.Counter()
+    barcodes = set()
+    for log_filename in args.log_filenames:
+        for event in read_event_log(log_filename):
+            events[event['event']] += 1
+            if event['event'] in ('member', 'signup'):
+                barcodes.add(event['barcode'])
+
+    print("""Attendance Statistics
+---------------------
+Logs:           {}
+Scans:          {}
+Members:        {}
+New Signups:    {}
+One offs:       {}
+Unknown:        {}
+Distinct:       {}""".format(len(args.log_filenames), events['scan'],
+                             events['member'], events['signup'],
+                             events['oneoff'], events['unknown'],
+                             len(barcodes)))
+    return 0
+
+
+def sync(args):
+    """Merge changes from kiosk databases into a target database."""
+    import os
+    from socman import MemberDatabase
+
+    with MemberDatabase(args.db_file) as target:
+        for kiosk_file in args.kiosk_files:
+            # the kiosk's filename identifies it across syncs
+            kiosk_name = os.path.basename(kiosk_file)
+            with MemberDatabase(kiosk_file) as kiosk:
+                report = target.sync_from(kiosk, kiosk_name)
+            print('{}: {} new, {} updated, {} unchanged'.format(
+                kiosk_name, report.inserted, report.updated,
+                report.unchanged))
+    return 0
+
+
+def read_roster(roster_file):
+    """Yield a Member for each row of a roster CSV file.
+
+    The file needs a header naming its columns: barcode, firstName,
+    lastName and college, as in CSV exports. Missing columns are left empty.
+    """
+    import csv
+    from socman import Name, Member
+
+    for row in csv.DictReader(roster_file):
+        yield Member(barcode=row.get('barcode'),
+                     name=Name(row.get('firstName'), row.get('lastName')),
+                     college=row.get('college'))
+
+
+def reconcile(args):
+    """Bring the database in line with a membership roster."""
+    from socman import MemberDatabase
+
+    with MemberDatabase(args.db_file) as db, \
+            open(args.roster, newline='') as roster_file:
+        report = db.reconcile(read_roster(roster_file),
+                              authority=args.authority,
+                              apply=not args.dry_run)
+    print('{} matched, {} new, {} changed, {} missing from the roster'.format(
+        report.matched, len(report.new), len(report.changed),
+        len(report.missing)))
+    if args.dry_run:
+        print('Dry run: the database was not changed.')
+    return 0
+
+
+def rebalance(args):
+    """Copy a sharded database into a different number of shards."""
+    from socman import ShardedMemberDatabase
+
+    print('Rebalancing {} shards into {}'.format(len(args.old_shards),
+                                                 len(args.new_shards)))
+    with ShardedMemberDatabase(args.old_shards) as db:
+        with db.rebalance(args.new_shards) as new_db:
+            print('Copied {} members.'.format(new_db.member_count()))
+    return 0
+
+
+def serve(args):
+    """Run a check-in server for the database."""
+    import socman_server
+    return socman_server.main(
+        ['socman serve', args.db_file, args.address],
+        barcode_prefix_length=args.barcode_length or None,
+        maintain_every=args.maintain_every)
+
+
+def maintenance(args):
+    """Run maintenance tasks on the database."""
+    from socman import MemberDatabase
+
+    with MemberDatabase(args.db_file) as db:
+        if args.migrate_barcode_keys:
+            print('Migrated {} barcodes to barcode keys.'.format(
+                db.migrate_barcode_keys()))
+        if args.migrate_name_keys:
+            print('Migrated {} names to name keys.'.format(
+                db.migrate_name_keys()))
+        aliases = dict(args.college_alias or ())
+        if args.migrate_colleges:
+            print('Migrated {} colleges to the colleges table.'.format(
+                db.migrate_colleges(aliases)))
+        else:
+            for alias, college in aliases.items():
+                db.add_college_alias(alias, college)
+        if args.archive_before:
+            db.enable_archive(args.archive_file)
+            print('Archived {} inactive members.'.format(
+                db.archive_inactive(args.archive_before)))
+        if args.compact_changelog:
+            print('Compacted {} changelog entries.'.format(
+                db.compact_changelog()))
+        if args.enable_incremental_vacuum:
+            db.enable_incremental_vacuum()
+            print('Enabled incremental vacuum.')
+        if args.optimize:
+            report = db.maintain(args.budget, log=print)
+            if report.integrity not in ('ok', None):
+                return 1
+        if args.backup:
+            print('Backed up to {}.'.format(db.backup(args.backup,
+                                                      keep=args.keep)))
+    return 0
+
+
+def loadtest(args):
+    """Simulate many scanners checking in at once and report latency."""
+    import contextlib
+    import functools
+    from socman import Member, Name, MemberDatabase, ShardedMemberDatabase
+    from socman_server import CheckinClient, is_address
+    import socman_loadtest
+
+    close = True
+    if is_address(args.db_files[0]):
+        connect = functools.partial(CheckinClient, args.db_files[0])
+        mode = 'a client per worker of {}'.format(args.db_files[0])
+    elif len(args.db_files) > 1:
+        shared = ShardedMemberDatabase(args.db_files)
+        connect, close = (lambda: shared), False
+        mode = 'one database sharded {} ways'.format(len(args.db_files))
+    elif args.shared:
+        shared = MemberDatabase(args.db_files[0], check_same_thread=False,
+                                commit_every=args.commit_every)
+        connect, close = (lambda: shared), False
+        mode = 'one shared database'
+    else:
+        connect = functools.partial(MemberDatabase, args.db_files[0],
+                                    commit_every=args.commit_every)
+        mode = 'a connection per worker'
+    if args.processes and not close:
+        print('A shared database cannot be used from processes.')
+        return 1
+
+    # members for the repeat scans: those present plus any added now
+    db = connect()
+    known = []
+    if isinstance(db, (MemberDatabase, ShardedMemberDatabase)):
+        known = [record.barcode for record in db.iter_records()
+                 if record.barcode]
+    with getattr(db, 'transaction', contextlib.nullcontext)():
+        for index in range(args.populate):
+            barcode = '8{:09d}'.format(index)
+            db.add_member(Member(barcode, Name('Load', barcode)))
+            known.append(barcode)
+    if close:
+        db.close()
+    else:
+        db.commit()
+
+    print('Running {} {} with {}.'.format(
+        args.workers, 'processes' if args.processes else 'threads', mode))
+    mix = socman_loadtest.ScanMix(*args.mix)
+    report = socman_loadtest.run_load(
+        connect, workers=args.workers, scans=args.scans, rate=args.rate,
+        mix=mix, known=known, processes=args.processes, close=close,
+        seed=args.seed)
+    if not close:
+        db.close()
+    print(socman_loadtest.format_report(report))
+    return 0
+
+
+def scan_mix(text):
+    """Parse a repeat,signup,unknown scan mix argument."""
+    try:
+        mix = tuple(float(weight) for weight in text.split(','))
+    except ValueError:
+        mix = ()
+    if len(mix) != 3 or min(mix) < 0 or not sum(mix):
+        raise argparse.ArgumentTypeError(
+            'not a repeat,signup,unknown mix: {!r}'.format(text))
+    return mix
+
+
+def iso_date(text):
+    """Parse a YYYY-MM-DD date argument."""
+    from datetime import datetime
+
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'not a YYYY-MM-DD date: {!r}'.format(text))
+
+
+def college_alias(text):
+    """Parse an ALIAS=COLLEGE argument."""
+    alias, sep, college = text.partition('=')
+    if not (sep and alias.strip() and college.strip()):
+        raise argparse.ArgumentTypeError(
+            'not an ALIAS=COLLEGE pair: {!r}'.format(text))
+    return alias, college
+
+
+def build_parser():
+    """Return the argparse parser for the socman command."""
+    parser = argparse.ArgumentParser(
+        prog='socman', description='Society membership and attendance.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    checkin_parser = subparsers.add_parser(
+        'checkin', help='check members in at an event')
+    checkin_parser.add_argument(
+        'db_file', help='the member database file, or the address of a '
+                        'check-in server (tcp://host:port or unix:///path)')
+    checkin_parser.add_argument(
+        'report_filename', nargs='?', default=None,
+        help='file to append the attendance summary to')
+    checkin_parser.add_argument(
+        '--filter-error-rate', type=float, default=0, metavar='RATE',
+        help='reject unknown barcodes quickly with a filter of this false '
+             'positive rate (default: 0, no filter). The filter is built at '
+             'startup, so only use it when this is the sole writer: members '
+             'added elsewhere meanwhile would be rejected and added again')
+    checkin_parser.add_argument(
+        '--input', default=None,
+        help='read barcodes non-interactively from this file (- for '
+             'standard input) instead of prompting')
+    checkin_parser.add_argument(
+        '--unknown', default=None,
+        help='with --input, write unknown barcodes to this file '
+             '(default: <date>.unknown)')
+    checkin_parser.add_argument(
+        '--barcode-length', type=int, default=7, metavar='N',
+        help='use only the first N characters of scanned barcodes, '
+             'matching them to longer stored barcodes (default: 7, 0 to '
+             'use whole barcodes)')
+    checkin_parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='with --input, the number of barcodes resolved per query')
+    checkin_parser.add_argument(
+        '--commit-every', type=int, default=None, metavar='N',
+        help='commit attendance after every N scans instead of every scan')
+    checkin_parser.add_argument(
+        '--commit-interval', type=float, default=None, metavar='SECONDS',
+        help='commit attendance at most this long after a scan')
+    checkin_parser.add_argument(
+        '--barcode-cache', action='store_true',
+        help='load every barcode and name into memory at startup, so scans '
+             'of members are looked up without SQL')
+    checkin_parser.add_argument(
+        '--replica', action='store_true',
+        help='load the database into memory and look members up there, '
+             'writing changes through to the file as they are committed')
+    checkin_parser.add_argument(
+        '--log-sync-every', type=int, default=100,
+        help='fsync the event log after this many events')
+    checkin_parser.add_argument(
+        '--log-sync-interval', type=float, default=5.0,
+        help='fsync the event log at least this often (seconds)')
+    checkin_parser.set_defaults(function=checkin)
+
+    import_parser = subparsers.add_parser(
+        'import', help='add members, prompting for their details')
+    import_parser.add_argument('db_file', help='the member database file')
+    import_parser.set_defaults(function=import_members)
+
+    export_parser = subparsers.add_parser(
+        'export', help='export members to CSV or a barcode snapshot')
+    export_parser.add_argument('db_file', help='the member database file')
+    export_parser.add_argument('csv_filename', nargs='?', default=None,
+                               help='CSV file to write')
+    export_parser.add_argument('--snapshot', default=None,
+                               help='barcode snapshot file to write')
+    export_parser.add_argument('--profile-memory', action='store_true',
+                               help='report the memory used by each '
+                                    'operation on standard error')
+    export_parser.set_defaults(function=export)
+
+    info_parser = subparsers.add_parser(
+        'info', help='show the number of members')
+    info_parser.add_argument('db_file', help='the member database file')
+    info_parser.add_argument('csv_filename', nargs='?', default=None,
+                             help='also dump the database to this CSV file')
+    info_parser.add_argument('--history', nargs='+', default=None,
+                             metavar='OLD_DB',
+                             help="also count members across previous years' "
+                                  'database files')
+    info_parser.add_argument('--profile-memory', action='store_true',
+                             help='report the memory used by each '
+                                  'operation on standard error')
+    info_parser.set_defaults(function=info)
+
+    list_parser = subparsers.add_parser(
+        'list', help='list the members matching filters as CSV')
+    list_parser.add_argument('db_file', help='the member database file')
+    list_parser.add_argument('--college', action='append', default=None,
+                             help='members of this college (repeatable)')
+    for name, help_text in (
+            ('joined-since', 'members who joined on or after this date'),
+            ('joined-before', 'members who joined before this date'),
+            ('attended-since', 'members who attended on or after this date'),
+            ('attended-before', 'members who last attended before this '
+                                'date')):
+        list_parser.add_argument('--' + name, type=iso_date, default=None,
+                                 metavar='YYYY-MM-DD', help=help_text)
+    paid_group = list_parser.add_mutually_exclusive_group()
+    paid_group.add_argument('--unpaid', action='store_true', default=None,
+                            help='unpaid members only')
+    paid_group.add_argument('--paid', dest='unpaid', action='store_false',
+                            help='paid members only')
+    list_parser.add_argument(
+        '--order-by', default='id',
+        choices=['id', 'name', 'college', 'datejoined', 'last_attended'],
+        help='sort order (default: id)')
+    list_parser.add_argument('--descending', action='store_true',
+                             help='sort in descending order')
+    list_parser.add_argument('--limit', type=int, default=None,
+                             help='list at most this many members')
+    list_parser.add_argument('--count', action='store_true',
+                             help='print the number of members only')
+    list_parser.add_argument('--count-by-college', action='store_true',
+                             help='print the number of members of each '
+                                  'college only (filters are ignored)')
+    list_parser.set_defaults(function=list_members)
+
+    stats_parser = subparsers.add_parser(
+        'stats', help='aggregate attendance from check-in event logs')
+    stats_parser.add_argument('log_filenames', nargs='+', metavar='LOG',
+                              help='event log (.jsonl) written by checkin')
+    stats_parser.set_defaults(function=stats)
+
+    sync_parser = subparsers.add_parser(
+        'sync', help='merge changes from kiosk databases')
+    sync_parser.add_argument('db_file', help='the database to merge into')
+    sync_parser.add_argument('kiosk_files', nargs='+', metavar='KIOSK_DB',
+                             help='kiosk database to merge from')
+    sync_parser.set_defaults(function=sync)
+
+    reconcile_parser = subparsers.add_parser(
+        'reconcile', help='update members from a membership roster CSV')
+    reconcile_parser.add_argument('db_file', help='the member database file')
+    reconcile_parser.add_argument(
+        'roster', help='CSV file with barcode, firstName, lastName and '
+                       'college columns')
+    reconcile_parser.add_argument(
+        '--authority', choices=['barcode', 'name'], default='barcode',
+        help='match roster members by barcode (default) or by name')
+    reconcile_parser.add_argument('--dry-run', action='store_true',
+                                  help='report differences only')
+    reconcile_parser.set_defaults(function=reconcile)
+
+    rebalance_parser = subparsers.add_parser(
+        'rebalance', help='copy a sharded database to new shards')
+    rebalance_parser.add_argument('old_shards', nargs='+', metavar='OLD',
+                                  help='existing shard file')
+    rebalance_parser.add_argument('--to', dest='new_shards', nargs='+',
+                                  metavar='NEW', required=True,
+                                  help='new shard file')
+    rebalance_parser.set_defaults(function=rebalance)
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='run a check-in server shared by many scanners')
+    serve_parser.add_argument('db_file', help='the member database file')
+    serve_parser.add_argument('address', nargs='?',
+                              default='tcp://127.0.0.1:8642',
+                              help='address to listen on (tcp://host:port '
+                                   'or unix:///path)')
+    serve_parser.add_argument(
+        '--barcode-length', type=int, default=7, metavar='N',
+        help='look up barcodes of N characters, as truncated by checkin, by '
+             'prefix (default: 7, 0 to disable)')
+    serve_parser.add_argument(
+        '--maintain-every', type=float, default=None, metavar='SECONDS',
+        help='optimize and check the database when idle, at most once every '
+             'SECONDS')
+    serve_parser.set_defaults(function=serve)
+
+    loadtest_parser = subparsers.add_parser(
+        'loadtest', help='simulate many scanners to measure scan latency')
+    loadtest_parser.add_argument(
+        'db_files', nargs='+', metavar='DB',
+        help='the database to load: a file, several shard files, or the '
+             'address of a check-in server')
+    loadtest_parser.add_argument('--workers', type=int, default=4,
+                                 help='the number of simulated scanners')
+    loadtest_parser.add_argument('--scans', type=int, default=1000,
+                                 help='the number of scans per scanner')
+    loadtest_parser.add_argument(
+        '--rate', type=float, default=None,
+        help='mean scans per second per scanner (default: flat out)')
+    loadtest_parser.add_argument(
+        '--mix', type=scan_mix, default=(0.8, 0.1, 0.1),
+        metavar='REPEAT,SIGNUP,UNKNOWN',
+        help='relative frequencies of member, signup and unknown scans '
+             '(default: 0.8,0.1,0.1)')
+    loadtest_parser.add_argument('--processes', action='store_true',
+                                 help='run scanners as processes, not '
+                                      'threads')
+    loadtest_parser.add_argument('--shared', action='store_true',
+                                 help='share one database object between '
+                                      'the scanner threads')
+    loadtest_parser.add_argument('--commit-every', type=int, default=None,
+                                 metavar='N',
+                                 help='group commit every N scans')
+    loadtest_parser.add_argument('--populate', type=int, default=0,
+                                 metavar='N',
+                                 help='add N members for scanners to scan')
+    loadtest_parser.add_argument('--seed', type=int, default=0,
+                                 help='random seed for the scan sequence')
+    loadtest_parser.set_defaults(function=loadtest)
+
+    maintenance_parser = subparsers.add_parser(
+        'maintenance', help='back up and tidy the database')
+    maintenance_parser.add_argument('db_file',
+                                    help='the member database file')
+    maintenance_parser.add_argument('--backup', default=None, metavar='DEST',
+                                    help='back up to this file or directory')
+    maintenance_parser.add_argument('--keep', type=int, default=None,
+                                    help='with a --backup directory, keep '
+                                         'only this many backups')
+    maintenance_parser.add_argument(
+        '--migrate-barcode-keys', action='store_true',
+        help='add the indexed canonical barcode column to an older database')
+    maintenance_parser.add_argument(
+        '--migrate-name-keys', action='store_true',
+        help='add the indexed normalized name columns to an older database, '
+             'so names match regardless of case, accents and spacing')
+    maintenance_parser.add_argument(
+        '--migrate-colleges', action='store_true',
+        help='store each college once, in a table of colleges, instead of '
+             'on every member of it')
+    maintenance_parser.add_argument(
+        '--college-alias', type=college_alias, action='append',
+        metavar='ALIAS=COLLEGE',
+        help='record ALIAS as another spelling of COLLEGE (repeatable)')
+    maintenance_parser.add_argument(
+        '--archive-before', type=iso_date, default=None,
+        metavar='YYYY-MM-DD',
+        help='archive members who have not attended since before this date')
+    maintenance_parser.add_argument(
+        '--archive-file', default=None,
+        help='with --archive-before, archive to this database file instead '
+             'of a table of the same database')
+    maintenance_parser.add_argument('--compact-changelog',
+                                    action='store_true',
+                                    help='keep only the latest changelog '
+                                         'entry per member')
+    maintenance_parser.add_argument(
+        '--enable-incremental-vacuum', action='store_true',
+        help='rewrite the database once so that --optimize can return free '
+             'space to the file system')
+    maintenance_parser.add_argument(
+        '--optimize', action='store_true',
+        help='refresh query statistics, vacuum free space and check '
+             'integrity, logging file sizes and timings')
+    maintenance_parser.add_argument(
+        '--budget', type=float, default=5.0, metavar='SECONDS',
+        help='with --optimize, stop after SECONDS (default: 5)')
+    maintenance_parser.set_defaults(function=maintenance)
+
+    return parser
+
+
+def main(argv=None):
+    """Run the socman command with arguments `argv` (default sys.argv)."""
+    args = build_parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
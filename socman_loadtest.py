@@ -0,0 +1,211 @@
+"""
+socman_loadtest simulates many check-in scanners hitting one database.
+
+`run_load` drives a database from several worker threads or processes, each
+playing a scanner: members rescanning, new members signing up and unknown
+barcodes. Scans arrive as fast as possible or at a given mean rate (with
+exponentially distributed gaps, as for independent arrivals). The result is
+a LoadReport of throughput, latency percentiles and the number of scans
+which failed because the database was locked (SQLITE_BUSY).
+
+A worker gets its database from a `connect` callable, so every concurrency
+mode can be measured the same way: a MemberDatabase per worker, one shared
+MemberDatabase or ShardedMemberDatabase, or a CheckinClient per worker
+talking to a check-in server. With processes, `connect` must be picklable,
+e.g. `functools.partial(socman.MemberDatabase, 'members.db')`.
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import random
+import sqlite3
+import time
+
+import socman
+
+
+ScanMix = collections.namedtuple('ScanMix', 'repeat signup unknown')
+ScanMix.__new__.__defaults__ = (0.1, 0.1)
+ScanMix.__doc__ = """
+                  The relative frequencies of the kinds of scan.
+
+                  `repeat` scans are of existing members, `signup` scans
+                  add a new member and `unknown` scans are of barcodes which
+                  are not in the database (and are not added).
+                  """
+
+LoadReport = collections.namedtuple(
+    'LoadReport', 'workers scans busy errors duration throughput '
+                  'p50 p90 p99 max kinds')
+LoadReport.__doc__ = """
+                     The results of a load test.
+
+                     `scans` counts completed scans and `busy` those which
+                     failed with SQLITE_BUSY (database is locked); `errors`
+                     counts other failures. `throughput` is completed scans
+                     per second over the `duration` in seconds. Latencies
+                     (p50, p90, p99 and max) are in seconds and measured
+                     from each scan's arrival, so they include any time
+                     spent waiting behind earlier scans. `kinds` counts
+                     completed scans of each kind of ScanMix.
+                     """
+
+
+def _scan(db, kind, barcode):
+    """Perform one scan of `kind` as check-in does."""
+    member = socman.Member(barcode)
+    if kind == 'repeat':
+        db.get_member(member)
+        return
+    try:
+        db.get_member(member)
+    except socman.MemberNotFoundError:
+        if kind == 'signup':
+            db.add_member(socman.Member(barcode,
+                                        socman.Name('Load', barcode)))
+
+
+def _worker(connect, close, worker, scans, rate, mix, known, seed):
+    """Run one simulated scanner, returning its latencies and counts."""
+    rng = random.Random(seed + worker)
+    db = connect()
+    latencies = []
+    counts = collections.Counter()
+    kinds = list(mix._fields)
+    weights = list(mix)
+    start = arrival = time.perf_counter()
+    try:
+        for scan in range(scans):
+            kind = rng.choices(kinds, weights)[0]
+            if kind == 'repeat' and not known:
+                kind = 'unknown'
+            if kind == 'repeat':
+                barcode = rng.choice(known)
+            else:
+                # unique to this worker and scan, so never a member
+                barcode = '9{:03d}{:07d}{}'.format(
+                    worker, scan, 1 if kind == 'signup' else 0)
+
+            if rate:
+                arrival += rng.expovariate(rate)
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                arrival = time.perf_counter()
+
+            try:
+                _scan(db, kind, barcode)
+            except sqlite3.OperationalError as error:
+                if 'locked' in str(error) or 'busy' in str(error):
+                    counts['busy'] += 1
+                else:
+                    counts['errors'] += 1
+                continue
+            except socman.Error:
+                counts['errors'] += 1
+                continue
+            latencies.append(time.perf_counter() - arrival)
+            counts[kind] += 1
+    finally:
+        if close:
+            db.close()
+        elif hasattr(db, 'commit'):
+            db.commit()
+    return latencies, counts, time.perf_counter() - start
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run_load(connect, workers=4, scans=1000, rate=None, mix=ScanMix(0.8),
+             known=(), processes=False, close=True, seed=0):
+    """Run a load test and return its LoadReport.
+
+    Arguments:
+        connect:    a callable returning the database (or client) a worker
+                    scans against; called once in each worker
+        workers:    the number of simulated scanners
+        scans:      the number of scans made by each worker
+        rate:       the mean number of scans per second from each worker,
+                    or None to scan as fast as possible
+        mix:        a ScanMix of the kinds of scan
+        known:      the barcodes of existing members, rescanned by repeat
+                    scans (with none, repeat scans become unknown scans)
+        processes:  run workers as processes rather than threads
+        close:      whether each worker closes the database `connect`
+                    returned it when done; pass False if `connect` returns
+                    a database shared by the workers (which is committed
+                    instead)
+        seed:       seed for the random scan sequences, for repeatability
+    """
+    known = list(known)
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    start = time.perf_counter()
+    with pool(max_workers=workers) as executor:
+        results = list(executor.map(
+            _worker, [connect] * workers, [close] * workers, range(workers),
+            [scans] * workers, [rate] * workers, [mix] * workers,
+            [known] * workers, [seed] * workers))
+    duration = time.perf_counter() - start
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    counts = sum((result[1] for result in results), collections.Counter())
+    return LoadReport(
+        workers=workers, scans=len(latencies), busy=counts.pop('busy', 0),
+        errors=counts.pop('errors', 0), duration=duration,
+        throughput=len(latencies) / duration if duration else 0.0,
+        p50=_percentile(latencies, 0.5), p90=_percentile(latencies, 0.9),
+        p99=_percentile(latencies, 0.99),
+        max=latencies[-1] if latencies else None, kinds=dict(counts))
+
+
+def format_report(report):
+    """Return a LoadReport as a human readable table."""
+    def milliseconds(seconds):
+        return '-' if seconds is None else '{:.2f} ms'.format(seconds * 1000)
+
+    return """Load Test Results
+-----------------
+Workers:        {}
+Scans:          {} ({})
+Busy errors:    {}
+Other errors:   {}
+Duration:       {:.2f} s
+Throughput:     {:.1f} scans/s
+Latency p50:    {}
+Latency p90:    {}
+Latency p99:    {}
+Latency max:    {}""".format(
+        report.workers, report.scans,
+        ', '.join('{} {}'.format(count, kind)
+                  for kind, count in sorted(report.kinds.items())),
+        report.busy, report.errors, report.duration, report.throughput,
+        milliseconds(report.p50), milliseconds(report.p90),
+        milliseconds(report.p99), milliseconds(report.max))
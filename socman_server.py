@@ -0,0 +1,362 @@
+"""
+socman_server lets many check-in scanners share one member database.
+
+A CheckinServer owns a MemberDatabase and serves lookup, add and attendance
+requests from any number of clients over a local TCP or Unix socket, so that
+scanners no longer contend for the SQLite file lock. Writes from all clients
+are committed together in batches. CheckinClient talks to a server and
+offers the same lookup interface as MemberDatabase.
+
+Requests and responses are JSON objects, one per line. A request names an
+operation with "op" and carries a member as "barcode", "names" (the list of
+name parts, as in `socman.Name`) and "college". Responses have "ok" set to
+true and a "result", or "ok" set to false and an "error" naming the socman
+exception raised.
+
+Addresses are written as tcp://host:port or unix:///path/to/socket.
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+import asyncio
+import json
+import socket
+import sys
+
+import socman
+
+
+DEFAULT_ADDRESS = 'tcp://127.0.0.1:8642'
+
+
+def is_address(string):
+    """Return whether `string` is a server address rather than a filename."""
+    return string.startswith(('tcp://', 'unix://'))
+
+
+def parse_address(address):
+    """Split a server address into a (family, location) tuple.
+
+    Returns ('tcp', (host, port)) or ('unix', path).
+
+    Raises:
+        ValueError: `address` is not a tcp:// or unix:// address
+    """
+    if address.startswith('unix://'):
+        return 'unix', address[len('unix://'):]
+    if address.startswith('tcp://'):
+        host, _, port = address[len('tcp://'):].rpartition(':')
+        if host and port.isdigit():
+            return 'tcp', (host, int(port))
+    raise ValueError('bad server address: {}'.format(address))
+
+
+def member_to_json(member):
+    """Return a JSON serialisable dict describing `member`."""
+    return {
+        'barcode': member.barcode,
+        'names': member.name.names if member.name else None,
+        'college': member.college,
+        }
+
+
+def member_from_json(data):
+    """Return the Member described by a dict from `member_to_json`."""
+    names = data.get('names')
+    return socman.Member(barcode=data.get('barcode'),
+                         name=socman.Name(*names) if names else None,
+                         college=data.get('college'))
+
+
+class CheckinServer:
+
+    """Serve requests for a MemberDatabase to many check-in clients.
+
+    The server runs on an asyncio event loop and handles every request on
+    the loop's thread, so the database connection is only ever used by one
+    thread and clients never wait on SQLite locks. Writes are not committed
+    per request: the first write opens a transaction on the database which
+    is committed `commit_interval` seconds later, so writes (new members
+    included) from every client arriving in that window share one fsync.
+
+    Given a socman.MaintenanceScheduler, the server reports every request
+    to it as activity and runs maintenance on the loop's thread when the
+    scheduler says it is due and no writes are pending.
+
+    Attributes:
+        db:                 the MemberDatabase being served
+        commit_interval:    seconds to wait before committing pending writes
+        maintenance:        the MaintenanceScheduler, or None
+        requests:           the number of requests handled so far
+    """
+
+    WRITE_OPS = frozenset(['attend', 'attend_many', 'add', 'update'])
+
+    # the least number of seconds between maintenance polls
+    MAINTENANCE_POLL = 1.0
+
+    def __init__(self, db, commit_interval=0.1, maintenance=None):
+        """Create a server for MemberDatabase `db`."""
+        self.db = db
+        self.commit_interval = commit_interval
+        self.maintenance = maintenance
+        self.requests = 0
+        self.__commit_handle = None
+        self.__maintenance_handle = None
+        self.__transaction = None
+
+    def flush(self):
+        """Commit any writes not yet committed."""
+        if self.__commit_handle is not None:
+            self.__commit_handle.cancel()
+            self.__commit_handle = None
+        if self.__transaction is not None:
+            transaction, self.__transaction = self.__transaction, None
+            transaction.__exit__(None, None, None)
+        self.db.commit()
+
+    def __begin_write(self):
+        """Open the transaction shared by writes until the next commit."""
+        if self.__transaction is None:
+            self.__transaction = self.db.transaction()
+            self.__transaction.__enter__()
+        if self.__commit_handle is None:
+            self.__commit_handle = asyncio.get_event_loop().call_later(
+                self.commit_interval, self.flush)
+
+    def __maintain(self):
+        """Run maintenance if due, then poll again when it next may be."""
+        if self.__transaction is None:
+            self.maintenance.poll()
+        self.__maintenance_handle = asyncio.get_event_loop().call_later(
+            max(self.maintenance.next_due(), self.MAINTENANCE_POLL),
+            self.__maintain)
+
+    def __dispatch(self, request):
+        operation = request.get('op')
+        if operation == 'count':
+            return self.db.member_count()
+
+        if operation == 'attend_many':
+            return self.db.get_members(
+                request.get('barcodes', []),
+                update_timestamp=request.get('update_timestamp', True))
+
+        member = member_from_json(request)
+        if operation == 'lookup':
+            return self.db.get_member(
+                member, update_timestamp=False,
+                autofix=request.get('autofix', False))
+        if operation == 'attend':
+            return self.db.get_member(
+                member, update_timestamp=True,
+                autofix=request.get('autofix', False))
+        if operation == 'add':
+            return self.db.add_member(member)
+        if operation == 'update':
+            return self.db.update_member(
+                member, authority=request.get('authority', 'barcode'),
+                update_timestamp=request.get('update_timestamp', True))
+        raise ValueError('unknown operation: {}'.format(operation))
+
+    def handle_request(self, line):
+        """Handle one request line and return the response line (as bytes)."""
+        self.requests += 1
+        if self.maintenance is not None:
+            self.maintenance.activity()
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if request.get('op') in self.WRITE_OPS:
+                self.__begin_write()
+            result = self.__dispatch(request)
+        except socman.AmbiguousBarcodeError as error:
+            response = {'ok': False, 'error': type(error).__name__,
+                        'barcodes': error.barcodes}
+        except socman.Error as error:
+            response = {'ok': False, 'error': type(error).__name__}
+        except (ValueError, AttributeError, TypeError) as error:
+            response = {'ok': False, 'error': 'BadRequest',
+                        'message': str(error)}
+        else:
+            response = {'ok': True, 'result': result}
+        return json.dumps(response).encode('utf-8') + b'\n'
+
+    async def handle_client(self, reader, writer):
+        """Serve requests from one client connection until it closes."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self.handle_request(line))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, address=DEFAULT_ADDRESS):
+        """Start listening on `address` and return the asyncio Server."""
+        family, location = parse_address(address)
+        if family == 'unix':
+            return await asyncio.start_unix_server(self.handle_client,
+                                                   path=location)
+        return await asyncio.start_server(self.handle_client, *location)
+
+    async def serve(self, address=DEFAULT_ADDRESS):
+        """Serve clients on `address` until cancelled."""
+        server = await self.start(address)
+        if self.maintenance is not None:
+            self.__maintain()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.__maintenance_handle is not None:
+                self.__maintenance_handle.cancel()
+                self.__maintenance_handle = None
+            self.flush()
+
+
+class CheckinClient:
+
+    """A client for a CheckinServer with the lookup interface of a database.
+
+    `get_member`, `get_members`, `add_member`, `update_member` and
+    `member_count` behave like the MemberDatabase methods of the same name
+    and raise the same exceptions, so scripts can use a client in place of
+    a database.
+    """
+
+    ERRORS = {
+        'BadMemberError': socman.BadMemberError,
+        'IncompleteMemberError': socman.IncompleteMemberError,
+        'MemberNotFoundError': socman.MemberNotFoundError,
+        }
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        """Connect to the server listening on `address`."""
+        family, location = parse_address(address)
+        if family == 'unix':
+            self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.__socket.settimeout(timeout)
+            self.__socket.connect(location)
+        else:
+            self.__socket = socket.create_connection(location, timeout)
+        self.__file = self.__socket.makefile('rwb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the connection to the server."""
+        self.__file.close()
+        self.__socket.close()
+
+    def __request(self, operation, member=None, **options):
+        request = dict(options, op=operation)
+        if member is not None:
+            if not member or not (member.barcode or member.name):
+                raise socman.BadMemberError(member)
+            request.update(member_to_json(member))
+        self.__file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.__file.flush()
+
+        line = self.__file.readline()
+        if not line:
+            raise socman.Error('connection closed by server')
+        response = json.loads(line.decode('utf-8'))
+        if not response['ok']:
+            if response['error'] == 'AmbiguousBarcodeError':
+                raise socman.AmbiguousBarcodeError(member,
+                                                   response['barcodes'])
+            error = self.ERRORS.get(response['error'])
+            if error is None:
+                raise socman.Error(response.get('message', response['error']))
+            raise error(member)
+        return response['result']
+
+    def get_member(self, member, update_timestamp=True, autofix=False):
+        """Retrieve a member's names from the server's database."""
+        operation = 'attend' if update_timestamp else 'lookup'
+        return tuple(self.__request(operation, member, autofix=autofix))
+
+    def get_members(self, barcodes, update_timestamp=True):
+        """Retrieve the names of many members by barcode at once."""
+        found = self.__request('attend_many', barcodes=list(barcodes),
+                               update_timestamp=update_timestamp)
+        return {barcode: tuple(names) for barcode, names in found.items()}
+
+    def add_member(self, member):
+        """Add a member to the server's database."""
+        self.__request('add', member)
+
+    def update_member(self, member, authority='barcode',
+                      update_timestamp=True):
+        """Update a member already in the server's database."""
+        self.__request('update', member, authority=authority,
+                       update_timestamp=update_timestamp)
+
+    def member_count(self):
+        """Return the number of members in the server's database."""
+        return self.__request('count')
+
+
+def main(argv, barcode_prefix_length=None, maintain_every=None):
+    """Run a check-in server for the database named in `argv`.
+
+    `barcode_prefix_length` is passed to the MemberDatabase, for clients
+    sending truncated barcodes. Given `maintain_every`, the server runs
+    database maintenance in idle moments at most once every that many
+    seconds.
+    """
+    if len(argv) <= 1:
+        print('No database file specified.')
+        return 1
+    db_file = argv[1]
+    address = argv[2] if len(argv) > 2 else DEFAULT_ADDRESS
+
+    print('Opening {}'.format(db_file))
+    with socman.MemberDatabase(
+            db_file, safe=False,
+            barcode_prefix_length=barcode_prefix_length) as db:
+        maintenance = None
+        if maintain_every is not None:
+            maintenance = socman.MaintenanceScheduler(db, maintain_every,
+                                                      log=print)
+        server = CheckinServer(db, maintenance=maintenance)
+        print('Serving on {}'.format(address))
+        try:
+            asyncio.run(server.serve(address))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,65 @@
+"""
+conftest.py contains pytest fixtures shared between the socman test modules.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+# pylint: disable=redefined-outer-name
+import datetime
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def db_file(tmpdir):
+    """Return the path to a test database file with sample entries."""
+    db_path = str(tmpdir.join('test.db'))
+    conn = sqlite3.connect(db_path)
+
+    cursor = conn.cursor()
+
+    cursor.execute("""CREATE TABLE users ("""
+                   """id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, """
+                   """firstName VARCHAR(255), """
+                   """lastName VARCHAR(255), """
+                   """barcode INTEGER, """
+                   """datejoined DATE, """
+                   """created_at DATETIME, """
+                   """updated_at DATETIME, """
+                   """college VARCHAR(255), """
+                   """last_attended DATE)""")
+
+    cursor.execute("""INSERT INTO users """
+                   """(firstName,lastName,barcode,college,"""
+                   """datejoined,created_at,updated_at,last_attended) """
+                   """VALUES (?,?,?,?,?,?,?,?)""",
+                   ('Ted', 'Bobson', '12341234', 'Wolfson',
+                    datetime.date.min, datetime.datetime.min,
+                    datetime.datetime.min, datetime.date.min))
+
+    conn.commit()
+    conn.close()
+
+    yield db_path
@@ -0,0 +1,228 @@
+"""
+test_benchmarks.py contains performance regression tests for socman.
+
+Each test measures one operation and prints the result. Wall-clock budgets
+are deliberately generous, several times the time measured on a modest
+laptop, and are only checked when SOCMAN_BENCHMARKS is set in the
+environment, since timings depend on the machine running the tests.
+
+Tests on socman should be run with `python -m pytest`. To run just these tests,
+run `pytest tests/test_benchmarks.py`.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+import pytest
+
+import socman
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules which no subcommand needs just to start and parse its arguments
+HEAVY_MODULES = ['socman', 'socman_server', 'sqlite3', 'asyncio', 'csv',
+                 'json', 'concurrent.futures']
+
+# wall-clock budgets depend on the machine, so they are only checked when
+# SOCMAN_BENCHMARKS is set in the environment
+BENCHMARKS = bool(os.environ.get('SOCMAN_BENCHMARKS'))
+
+benchmark = pytest.mark.skipif(not BENCHMARKS,
+                               reason='set SOCMAN_BENCHMARKS to run')
+
+
+def run_python(*args):
+    """Run a Python interpreter in the repository and return its stdout."""
+    return subprocess.run([sys.executable] + list(args), cwd=REPO_DIR,
+                          stdout=subprocess.PIPE, check=True,
+                          universal_newlines=True).stdout
+
+
+def time_python(*args, repeat=5):
+    """Return the best wall time of `repeat` interpreter runs."""
+    return min(timeit.repeat(lambda: run_python(*args), number=1,
+                             repeat=repeat))
+
+
+def check_budget(seconds, budget):
+    """Assert that `seconds` is within `budget` if benchmarks are enabled."""
+    if BENCHMARKS:
+        assert seconds < budget
+
+
+@pytest.mark.parametrize('command', ['checkin', 'info', 'maintenance'])
+def test_cli_startup_imports(command):
+    """Test that parsing arguments imports none of the heavy modules."""
+    modules = run_python('-c', """if True:
+        import sys
+        import socman_cli
+        socman_cli.build_parser().parse_args(['{}', 'members.db'])
+        print('\\n'.join(sys.modules))
+        """.format(command)).split()
+    assert [] == [module for module in HEAVY_MODULES if module in modules]
+
+
+@benchmark
+def test_cli_startup_time():
+    """Test that `socman --help` starts quickly.
+
+    The budget is the time taken over a bare interpreter start.
+    """
+    baseline = time_python('-c', 'pass')
+    startup = time_python('socman_cli.py', '--help')
+    assert startup - baseline < 0.25
+
+
+def scan_latencies(db_file, scans, **options):
+    """Return the latency of each of `scans` check-in scans in seconds.
+
+    `options` are passed to MemberDatabase, so policies can be compared.
+    """
+    latencies = []
+    with socman.MemberDatabase(db_file, **options) as mdb:
+        for _ in range(scans):
+            start = time.perf_counter()
+            mdb.get_member(socman.Member('12341234'))
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+@pytest.mark.parametrize('policy', [
+    {'safe': True},
+    {'commit_every': 10},
+    {'commit_every': 100},
+    {'commit_interval': 0.05},
+    {'commit_every': 100, 'commit_interval': 0.05},
+    {'safe': False},
+    {'replica': True, 'commit_every': 100},
+    ], ids=lambda policy: ','.join('{}={}'.format(*item)
+                                   for item in sorted(policy.items())))
+def test_group_commit_latency(db_file, policy):
+    """Measure scan latency under each commit policy.
+
+    Run with `pytest -s` to see the latency/durability trade-off: the mean
+    and 99th percentile latency of each policy are printed. Committing every
+    scan costs an fsync each; grouped commits amortise it. Nothing is
+    asserted, as the cost of an fsync depends on the disk.
+    """
+    latencies = sorted(scan_latencies(db_file, 500, **policy))
+    mean = statistics.mean(latencies)
+    print('\n{}: mean {:.3f} ms, p99 {:.3f} ms'.format(
+        policy, mean * 1000, latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+def test_replica_lookup_latency(db_file):
+    """Test that lookups in a replica take microseconds.
+
+    Attendance is not recorded, so only the lookup itself is timed.
+    """
+    with socman.MemberDatabase(db_file, replica=True) as mdb:
+        member = socman.Member('12341234')
+        latency = min(timeit.repeat(
+            lambda: mdb.get_member(member, update_timestamp=False),
+            number=1000, repeat=5)) / 1000
+    print('\nreplica lookup: {:.1f} us'.format(latency * 1e6))
+    check_budget(latency, 0.0005)
+
+
+def test_barcode_cache_preload(db_file):
+    """Test that 100k members load into the barcode cache in under a second.
+
+    Lookups from the cache are timed too, and take microseconds.
+    """
+    with socman.MemberDatabase(db_file) as mdb:
+        mdb.insert_records([
+            socman.MemberRecord(firstName='First{}'.format(i),
+                                lastName='Last', barcode=10000000 + i)
+            for i in range(100000)])
+        mdb.commit()
+        start = time.perf_counter()
+        assert 100001 == mdb.enable_barcode_cache()
+        preload = time.perf_counter() - start
+        member = socman.Member('10050000')
+        latency = min(timeit.repeat(
+            lambda: mdb.get_member(member, update_timestamp=False),
+            number=1000, repeat=5)) / 1000
+    print('\npreload: {:.3f} s, lookup: {:.1f} us'.format(preload,
+                                                          latency * 1e6))
+    check_budget(preload, 1)
+    check_budget(latency, 0.0001)
+
+
+def test_reconcile_time(db_file):
+    """Test that a 50k member roster reconciles in seconds."""
+    roster = [socman.Member(str(10000000 + i),
+                            socman.Name('First{}'.format(i), 'Last'),
+                            'Wolfson')
+              for i in range(50000)]
+    with socman.MemberDatabase(db_file) as mdb:
+        start = time.perf_counter()
+        report = mdb.reconcile(roster)
+        added = time.perf_counter() - start
+        assert 50000 == len(report.new)
+
+        roster[::2] = [member._replace(college='Balliol')
+                       for member in roster[::2]]
+        start = time.perf_counter()
+        report = mdb.reconcile(roster)
+        changed = time.perf_counter() - start
+        assert (25000, 25000) == (report.matched, len(report.changed))
+    print('\nreconcile: add {:.2f} s, update {:.2f} s'.format(added, changed))
+    check_budget(max(added, changed), 5)
+
+
+@pytest.mark.parametrize('operation', ['write_csv', 'iter_records',
+                                       'member_count'])
+def test_bulk_memory(db_file, tmpdir, operation):
+    """Test that bulk operations stream rather than load the whole table.
+
+    The budget is for 50k members, whose rows alone take tens of megabytes
+    as Python objects, so holding them at once fails.
+    """
+    with socman.MemberDatabase(db_file) as mdb:
+        mdb.insert_records([
+            socman.MemberRecord(firstName='First{}'.format(i),
+                                lastName='Last', barcode=10000000 + i,
+                                college='Wolfson') for i in range(50000)])
+        mdb.commit()
+        mdb.memory_profiler = profiler = socman.MemoryProfiler()
+        if operation == 'write_csv':
+            mdb.write_csv(str(tmpdir.join('members.csv')))
+        elif operation == 'iter_records':
+            for _ in mdb.iter_records():
+                pass
+        else:
+            mdb.member_count()
+    report = profiler.reports[-1]
+    print('\n{}: peak {:.0f} KiB, retained {:.0f} KiB'.format(
+        operation, report.peak / 1024, report.retained / 1024))
+    assert report.peak < 2 * 1024 * 1024
@@ -0,0 +1,271 @@
+"""
+test_cli.py contains functional tests for the socman command line interface.
+
+Tests on socman should be run with `python -m pytest`. To run just these tests,
+run `pytest tests/test_cli.py`.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# pylint: disable=redefined-outer-name
+import datetime
+import io
+
+import pytest
+
+import socman
+import socman_cli
+
+
+@pytest.fixture
+def in_tmpdir(tmpdir, monkeypatch):
+    """Run the test in a temporary directory, where logs are written."""
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+def test_info(db_file, capsys):
+    """Test that info reports the number of members."""
+    assert 0 == socman_cli.main(['info', db_file])
+    assert 'There are 1 members' in capsys.readouterr().out
+
+
+def test_info_history(db_file, tmpdir, capsys):
+    """Test counting members across the files of several years."""
+    old_file = str(tmpdir.join('2015.db'))
+    with socman.MemberDatabase(old_file) as old:
+        old.create_schema()
+        old.add_member(socman.Member('12341234', socman.Name('Ted', 'B')))
+        old.add_member(socman.Member('43214321', socman.Name('Bill', 'R')))
+    assert 0 == socman_cli.main(['info', db_file, '--history', old_file])
+    assert '2 distinct members across 2 years' in capsys.readouterr().out
+
+
+def test_export(db_file, tmpdir):
+    """Test exporting to CSV and a snapshot together."""
+    csv_path = str(tmpdir.join('members.csv'))
+    snapshot_path = str(tmpdir.join('members.snapshot'))
+    assert 0 == socman_cli.main(['export', db_file, csv_path,
+                                 '--snapshot', snapshot_path])
+    assert 2 == len(tmpdir.join('members.csv').readlines())
+    with socman.BarcodeSnapshot(snapshot_path) as snapshot:
+        assert ('Ted', 'Bobson', 'Wolfson') == snapshot.lookup('12341234')
+
+
+def test_export_profile_memory(db_file, tmpdir, capsys):
+    """Test that --profile-memory reports each bulk operation."""
+    csv_path = str(tmpdir.join('members.csv'))
+    snapshot_path = str(tmpdir.join('members.snapshot'))
+    assert 0 == socman_cli.main(['export', db_file, csv_path, '--snapshot',
+                                 snapshot_path, '--profile-memory'])
+    report = capsys.readouterr().err.splitlines()
+    assert ['write_csv', 'write_snapshot'] == [
+        line.split(':')[0] for line in report]
+    assert 'peak' in report[0]
+
+
+def test_checkin_interactive(db_file, in_tmpdir, monkeypatch, capsys):
+    """Test an interactive check-in with a signup, a member and a one off."""
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        '7654321\nBill\nRogers\n7654321\nONE\nQUIT\n'))
+    report_path = str(in_tmpdir.join('report.txt'))
+    assert 0 == socman_cli.main(['checkin', db_file, report_path])
+
+    output = capsys.readouterr().out
+    assert 'Bill Rogers' in output
+    assert 'New Signups:    1' in output
+    assert 'One offs:       1' in output
+    assert 'Total:          3' in output
+    assert 'Total:          3' in in_tmpdir.join('report.txt').read()
+    assert ('Bill', 'Rogers') == socman.MemberDatabase(db_file).get_member(
+        socman.Member('7654321'))
+
+
+def test_checkin_truncated_barcode(db_file, in_tmpdir, monkeypatch,
+                                   capsys):
+    """Test that a truncated scan of a longer barcode finds the member."""
+    monkeypatch.setattr('sys.stdin', io.StringIO('123412349\nQUIT\n'))
+    assert 0 == socman_cli.main(['checkin', db_file])
+    output = capsys.readouterr().out
+    assert 'Ted Bobson' in output
+    assert 'Members:        1' in output
+
+
+def test_checkin_replica(db_file, in_tmpdir, monkeypatch, capsys):
+    """Test that a check-in from a replica writes signups to the file."""
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        '12341234\n7654321\nBill\nRogers\nQUIT\n'))
+    assert 0 == socman_cli.main(['checkin', db_file, '--replica',
+                                 '--commit-every', '10'])
+    assert 'Ted Bobson' in capsys.readouterr().out
+    with socman.MemberDatabase(db_file) as mdb:
+        assert ('Bill', 'Rogers') == mdb.get_member(
+            socman.Member('7654321'))
+        record, = mdb.get_records(socman.Member('12341234'))
+        assert datetime.date.today().isoformat() == record.last_attended
+
+
+def test_checkin_interrupted(db_file, in_tmpdir, monkeypatch):
+    """Test that Ctrl-C still flushes the event log and attendance."""
+    scans = iter(['12341234'])
+
+    def scan(prompt):
+        try:
+            return next(scans)
+        except StopIteration:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr('builtins.input', scan)
+    # excinfo keeps checkin's locals alive, so garbage collection closes
+    # nothing behind checkin's back
+    with pytest.raises(KeyboardInterrupt) as excinfo:
+        socman_cli.main(['checkin', db_file, '--commit-every', '10'])
+    assert excinfo.traceback
+    log_path = str(in_tmpdir.join(datetime.date.today().isoformat() +
+                                  '.jsonl'))
+    assert ['scan', 'member'] == [
+        event['event'] for event in socman.read_event_log(log_path)]
+    with socman.MemberDatabase(db_file) as mdb:
+        record, = mdb.get_records(socman.Member('12341234'))
+        assert datetime.date.today().isoformat() == record.last_attended
+
+
+def test_checkin_barcode_cache(db_file, in_tmpdir, capsys):
+    """Test a check-in answered from the barcode cache."""
+    in_tmpdir.join('scans.txt').write('12341234\n12341234\n')
+    assert 0 == socman_cli.main(['checkin', db_file, '--input', 'scans.txt',
+                                 '--barcode-cache', '--commit-every', '10'])
+    output = capsys.readouterr().out
+    assert 'Loaded 1 barcodes into memory.' in output
+    assert 'Members:        2' in output
+    with socman.MemberDatabase(db_file) as mdb:
+        record, = mdb.get_records(socman.Member('12341234'))
+        assert datetime.date.today().isoformat() == record.last_attended
+
+
+def test_checkin_input_and_stats(db_file, in_tmpdir, capsys):
+    """Test a non-interactive check-in followed by stats over its log."""
+    mdb = socman.MemberDatabase(db_file)
+    mdb.add_member(socman.Member('1234567', socman.Name('Bill', 'Rogers')))
+    mdb.commit()
+    in_tmpdir.join('scans.txt').write('1234567\n9999999\nONE\n1234567\n')
+    assert 0 == socman_cli.main(['checkin', db_file, '--input', 'scans.txt',
+                                 '--unknown', 'unknown.txt'])
+    assert 'Total:          3' in capsys.readouterr().out
+    assert ['9999999\n'] == in_tmpdir.join('unknown.txt').readlines()
+
+    logs = [str(path) for path in in_tmpdir.listdir('*.jsonl')]
+    assert 0 == socman_cli.main(['stats'] + logs)
+    output = capsys.readouterr().out
+    assert 'Scans:          3' in output
+    assert 'Unknown:        1' in output
+    assert 'Distinct:       1' in output
+
+
+def test_reconcile(db_file, tmpdir, capsys):
+    """Test reconciling the database with a roster CSV."""
+    roster = tmpdir.join('roster.csv')
+    roster.write('barcode,firstName,lastName\n'
+                 '12341234,Ted,Bobson\n'
+                 '7654321,Bill,Rogers\n')
+    assert 0 == socman_cli.main(['reconcile', db_file, str(roster),
+                                 '--dry-run'])
+    assert '1 matched, 1 new' in capsys.readouterr().out
+    assert 1 == socman.MemberDatabase(db_file).member_count()
+
+    assert 0 == socman_cli.main(['reconcile', db_file, str(roster)])
+    assert 2 == socman.MemberDatabase(db_file).member_count()
+
+
+def test_maintenance_archive(db_file, tmpdir, capsys):
+    """Test archiving inactive members to a separate file."""
+    archive_path = str(tmpdir.join('archive.db'))
+    assert 0 == socman_cli.main(['maintenance', db_file, '--archive-before',
+                                 '2000-01-01', '--archive-file',
+                                 archive_path])
+    assert 'Archived 1 inactive members' in capsys.readouterr().out
+    assert 0 == socman.MemberDatabase(db_file).member_count()
+    assert 1 == socman.MemberDatabase(archive_path).member_count()
+
+    with pytest.raises(SystemExit):
+        socman_cli.main(['maintenance', db_file, '--archive-before', 'May'])
+
+
+def test_list(db_file, capsys):
+    """Test listing and counting members by filter."""
+    assert 0 == socman_cli.main(['list', db_file, '--college', 'Wolfson',
+                                 '--paid'])
+    lines = capsys.readouterr().out.splitlines()
+    assert 2 == len(lines)
+    assert lines[1].startswith('1,Ted,Bobson,12341234')
+
+    assert 0 == socman_cli.main(['list', db_file, '--count',
+                                 '--joined-since', '2016-01-01'])
+    assert '0' == capsys.readouterr().out.strip()
+
+
+def test_maintenance_migrate_keys(db_file, capsys):
+    """Test the one-off barcode and name key migrations."""
+    assert 0 == socman_cli.main(['maintenance', db_file,
+                                 '--migrate-barcode-keys',
+                                 '--migrate-name-keys'])
+    output = capsys.readouterr().out
+    assert 'Migrated 1 barcodes' in output
+    assert 'Migrated 1 names' in output
+
+
+def test_maintenance_migrate_colleges(db_file, capsys):
+    """Test migrating colleges, with an alias, and counting by college."""
+    assert 0 == socman_cli.main(['maintenance', db_file,
+                                 '--migrate-colleges', '--college-alias',
+                                 'Wolfson College=Wolfson'])
+    assert 'Migrated 1 colleges' in capsys.readouterr().out
+    with socman.MemberDatabase(db_file) as mdb:
+        mdb.add_member(socman.Member('7654321', socman.Name('Bill', 'R'),
+                                     'Wolfson College'))
+    assert 0 == socman_cli.main(['list', db_file, '--count-by-college'])
+    assert ['college,members', 'Wolfson,2'] == (
+        capsys.readouterr().out.splitlines())
+
+    with pytest.raises(SystemExit):
+        socman_cli.main(['maintenance', db_file, '--college-alias', 'Keble'])
+
+
+def test_maintenance_optimize(db_file, capsys):
+    """Test optimizing the database within a time budget."""
+    assert 0 == socman_cli.main(['maintenance', db_file,
+                                 '--enable-incremental-vacuum', '--optimize',
+                                 '--budget', '10'])
+    output = capsys.readouterr().out
+    assert 'Enabled incremental vacuum.' in output
+    assert 'Integrity check: ok.' in output
+    assert 'bytes freed' in output
+
+
+def test_bad_command(capsys):
+    """Test that an unknown subcommand is rejected with a usage message."""
+    with pytest.raises(SystemExit):
+        socman_cli.main(['frobnicate'])
+    assert 'usage: socman' in capsys.readouterr().err
@@ -29,50 +29,22 @@ SOFTWARE.
 """
 # pylint: disable=redefined-outer-name
 import datetime
+import os
 import sqlite3
+import threading
+import time
 
 import pytest
 
 import socman
 
 
-@pytest.fixture
-def db_file(tmpdir):
-    """Return the path to a test database file with sample entries."""
-    db_path = str(tmpdir.join('test.db'))
-    conn = sqlite3.connect(db_path)
-
-    cursor = conn.cursor()
-
-    cursor.execute("""CREATE TABLE users ("""
-                   """id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, """
-                   """firstName VARCHAR(255), """
-                   """lastName VARCHAR(255), """
-                   """barcode INTEGER, """
-                   """datejoined DATE, """
-                   """created_at DATETIME, """
-                   """updated_at DATETIME, """
-                   """college VARCHAR(255), """
-                   """last_attended DATE)""")
-
-    cursor.execute("""INSERT INTO users """
-                   """(firstName,lastName,barcode,college,"""
-                   """datejoined,created_at,updated_at,last_attended) """
-                   """VALUES (?,?,?,?,?,?,?,?)""",
-                   ('Ted', 'Bobson', '12341234', 'Wolfson',
-                    datetime.date.min, datetime.datetime.min,
-                    datetime.datetime.min, datetime.date.min))
-
-    conn.commit()
-    conn.close()
-
-    yield db_path
-
-
 @pytest.fixture
 def mdb(db_file):
     """Return a fixture to a MemberDatabase connected to a real database."""
-    return socman.MemberDatabase(db_file)
+    mdb_fixture = socman.MemberDatabase(db_file)
+    yield mdb_fixture
+    mdb_fixture.close()
 
 
 def test_get_member_bad_member_(mdb):
@@ -183,3 +155,1051 @@ def test_update_member_name(mdb):
             mdb.get_member(socman.Member(barcode=None, name=newname)))
     with pytest.raises(socman.MemberNotFoundError):
         mdb.get_member(socman.Member(barcode=None, name=name))
+
+
+@pytest.fixture
+def snapshot(mdb, tmpdir):
+    """Return a BarcodeSnapshot written from the test database."""
+    snapshot_path = str(tmpdir.join('test.snapshot'))
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers'),
+                                 'Keble'))
+    assert mdb.write_snapshot(snapshot_path) == 2
+    with socman.BarcodeSnapshot(snapshot_path) as snapshot_fixture:
+        yield snapshot_fixture
+
+
+def test_snapshot_lookup(snapshot):
+    """Test that a snapshot maps barcodes to names and college."""
+    assert len(snapshot) == 2
+    assert snapshot.lookup('12341234') == ('Ted', 'Bobson', 'Wolfson')
+    assert snapshot.lookup('43214321') == ('Bill', 'Rogers', 'Keble')
+    assert '43214321' in snapshot
+
+
+@pytest.mark.parametrize('barcode', ['11111111', '1234', '123412345', ''])
+def test_snapshot_lookup_missing(snapshot, barcode):
+    """Test that a snapshot returns None for barcodes it does not hold."""
+    assert snapshot.lookup(barcode) is None
+    assert barcode not in snapshot
+
+
+def test_snapshot_bad_file(tmpdir):
+    """Test that opening a file which is not a snapshot raises an error."""
+    bad_path = tmpdir.join('bad.snapshot')
+    bad_path.write('not a snapshot at all')
+    with pytest.raises(socman.BarcodeSnapshot.BadSnapshotError):
+        socman.BarcodeSnapshot(str(bad_path))
+
+
+def test_get_member_snapshot_tier(db_file, snapshot):
+    """Test get_member answers from the snapshot before the database."""
+    mdb = socman.MemberDatabase(db_file, snapshot=snapshot)
+    # rename Ted from another connection: the snapshot still answers
+    with socman.MemberDatabase(db_file) as other:
+        other.update_member(socman.Member('12341234',
+                                          socman.Name('Bill', 'Bob')))
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('12341234'))
+
+    # but this connection's own writes are never hidden by the snapshot
+    mdb.update_member(socman.Member('12341234', socman.Name('Tim', 'Bob')))
+    assert ('Tim', 'Bob') == mdb.get_member(socman.Member('12341234'))
+    mdb.update_member(socman.Member('87654321',
+                                    socman.Name('Bill', 'Rogers')),
+                      authority='name')
+    with pytest.raises(socman.MemberNotFoundError):
+        mdb.get_member(socman.Member('43214321'))
+
+    # barcodes missing from the snapshot fall through to the database
+    mdb.add_member(socman.Member('55555555', socman.Name('Ann', 'Lee')))
+    assert ('Ann', 'Lee') == mdb.get_member(socman.Member('55555555'))
+
+
+def test_barcode_filter():
+    """Test a BarcodeFilter has no false negatives and a sane error rate."""
+    barcode_filter = socman.BarcodeFilter(1000, error_rate=0.01)
+    for barcode in range(1000):
+        barcode_filter.add(str(barcode))
+    assert all(str(barcode) in barcode_filter for barcode in range(1000))
+
+    false_positives = sum(str(barcode) in barcode_filter
+                          for barcode in range(1000, 11000))
+    assert false_positives < 300
+    assert 0 < barcode_filter.false_positive_rate() < 0.03
+
+
+@pytest.mark.parametrize('error_rate', [0, 1, -0.5])
+def test_barcode_filter_bad_error_rate(error_rate):
+    """Test a BarcodeFilter rejects error rates outside (0, 1)."""
+    with pytest.raises(ValueError):
+        socman.BarcodeFilter(10, error_rate=error_rate)
+
+
+def test_get_member_barcode_filter(mdb):
+    """Test get_member with a barcode filter enabled."""
+    barcode_filter = mdb.enable_barcode_filter()
+    assert len(barcode_filter) == 1
+    assert '12341234' in barcode_filter
+
+    with pytest.raises(socman.MemberNotFoundError):
+        mdb.get_member(socman.Member('11111111'))
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('12341234'))
+
+    # new barcodes, whether added or autofixed by name, enter the filter
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    mdb.add_member(socman.Member('55555555', socman.Name('Ted', 'Bobson')))
+    assert ('Bill', 'Rogers') == mdb.get_member(socman.Member('43214321'))
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('55555555'))
+
+
+@pytest.mark.parametrize('keyed', [False, True])
+def test_barcode_filter_long_barcode(mdb, keyed):
+    """Test that the filter holds barcodes too long for 64-bit integers."""
+    if keyed:
+        mdb.migrate_barcode_keys()
+    barcode = '123456789012345678901234'
+    mdb.add_member(socman.Member(barcode, socman.Name('Ann', 'Lee')))
+    mdb.enable_barcode_filter()
+    assert ('Ann', 'Lee') == mdb.get_member(socman.Member(barcode))
+    assert {barcode: ('Ann', 'Lee')} == mdb.get_members([barcode])
+
+
+def test_barcode_filter_sync(mdb, kiosk):
+    """Test that barcodes arriving by sync or import enter the filter."""
+    mdb.enable_barcode_filter()
+    kiosk.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    assert (1, 0, 0) == mdb.sync_from(kiosk, 'kiosk')
+    assert ('Bill', 'Rogers') == mdb.get_member(socman.Member('43214321'))
+    mdb.insert_records([socman.MemberRecord(barcode='55555555',
+                                            firstName='Ann')])
+    assert 'Ann' == mdb.get_member(socman.Member('55555555'))[0]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 500])
+def test_get_members(mdb, chunk_size):
+    """Test batched barcode lookups with get_members."""
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    found = mdb.get_members(['12341234', '11111111', '43214321', '12341234',
+                             '', '22222222'], chunk_size=chunk_size)
+    assert found == {'12341234': ('Ted', 'Bobson'),
+                     '43214321': ('Bill', 'Rogers')}
+    assert mdb.get_members([]) == {}
+
+
+def test_get_members_barcode_filter(mdb):
+    """Test get_members skips barcodes ruled out by the barcode filter."""
+    mdb.enable_barcode_filter()
+    assert mdb.get_members(['11111111', '12341234']) == {
+        '12341234': ('Ted', 'Bobson')}
+
+
+@pytest.fixture
+def kiosk(tmpdir):
+    """Return a second, empty MemberDatabase standing in for a kiosk."""
+    kiosk_fixture = socman.MemberDatabase(str(tmpdir.join('kiosk.db')))
+    kiosk_fixture.create_schema()
+    return kiosk_fixture
+
+
+def test_export_changes_watermark(mdb):
+    """Test that exports after a watermark only include changed rows."""
+    mdb.create_sync_indexes()
+    watermark, records = mdb.export_changes()
+    assert ['Ted'] == [record.firstName for record in records]
+
+    watermark, records = mdb.export_changes(watermark)
+    assert [] == records
+
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    _, records = mdb.export_changes(watermark)
+    assert ['Bill'] == [record.firstName for record in records]
+
+
+def test_sync_from(mdb, kiosk):
+    """Test syncing new members and renames between databases."""
+    kiosk.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    kiosk.add_member(socman.Member('12341234', socman.Name('Ted', 'Rogers')))
+
+    # the main database's Ted is older than the kiosk's, so is not merged
+    assert (0, 0, 1) == kiosk.sync_from(mdb, 'main')
+    assert ('Ted', 'Rogers') == kiosk.get_member(socman.Member('12341234'))
+
+    assert (1, 1, 0) == mdb.sync_from(kiosk, 'kiosk')
+    assert 2 == mdb.member_count()
+    assert ('Ted', 'Rogers') == mdb.get_member(socman.Member('12341234'))
+    assert ('Bill', 'Rogers') == mdb.get_member(socman.Member('43214321'))
+
+    # nothing has changed on the kiosk since the last sync, though rows
+    # attended today may be sent again because last_attended is a date
+    report = mdb.sync_from(kiosk, 'kiosk')
+    assert (0, 0) == (report.inserted, report.updated)
+
+
+def test_merge_changes_by_name(mdb):
+    """Test that a record matching only by name updates the barcode."""
+    record = socman.MemberRecord(
+        firstName='Ted', lastName='Bobson', barcode='55555555',
+        updated_at='9999-01-01 00:00:00', last_attended='9999-01-01')
+    assert (0, 1, 0) == mdb.merge_changes([record])
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('55555555'),
+                                               update_timestamp=False)
+    assert 1 == mdb.member_count()
+
+    # an older record loses to the existing row
+    old = record._replace(barcode='66666666', updated_at='0001-01-01')
+    assert (0, 0, 1) == mdb.merge_changes([old])
+    with pytest.raises(socman.MemberNotFoundError):
+        mdb.get_member(socman.Member('66666666'))
+
+
+def test_reconcile(mdb):
+    """Test reconciling a roster with new, changed and missing members."""
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    roster = [socman.Member('12341234', socman.Name('Ted', 'Rogers')),
+              socman.Member('55555555', socman.Name('Ann', 'Smith'),
+                            'Wolfson'),
+              socman.Member('12341234', socman.Name('Ted', 'Other')),
+              socman.Member(None, socman.Name('No', 'Barcode'))]
+
+    report = mdb.reconcile(roster, apply=False)
+    assert 0 == report.matched
+    assert [55555555] == [member.barcode for member in report.new]
+    assert [('Ted', 'Rogers')] == [
+        (member.name.first(), member.name.last())
+        for member in report.changed]
+    assert [43214321] == [member.barcode for member in report.missing]
+    assert 2 == mdb.member_count()
+
+    assert report == mdb.reconcile(roster)
+    assert ('Ted', 'Rogers') == mdb.get_member(socman.Member('12341234'))
+    assert ('Ann', 'Smith') == mdb.get_member(socman.Member('55555555'))
+    record, = mdb.get_records(socman.Member('12341234'))
+    assert 'Wolfson' == record.college  # not in the roster so kept
+
+    report = mdb.reconcile(roster)
+    assert (2, [], []) == report[:3]
+
+
+def test_reconcile_by_name(mdb):
+    """Test that reconciling by name updates barcodes."""
+    report = mdb.reconcile(
+        [socman.Member('55555555', socman.Name('Ted', 'Bobson'))],
+        authority='name')
+    assert 1 == len(report.changed)
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('55555555'))
+    with pytest.raises(socman.MemberDatabase.BadSearchAuthorityError):
+        mdb.reconcile([], authority='college')
+
+
+@pytest.mark.parametrize('archive_file', [None, 'archive.db'])
+def test_archive_inactive(mdb, tmpdir, archive_file):
+    """Test archiving inactive members and reactivating them on a scan."""
+    if archive_file:
+        archive_file = str(tmpdir.join(archive_file))
+    mdb.enable_archive(archive_file)
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    assert 1 == mdb.archive_inactive(datetime.date(2000, 1, 1),
+                                     chunk_size=1)
+    assert 1 == mdb.member_count()
+    assert 0 == mdb.archive_inactive(datetime.date(2000, 1, 1))
+
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('12341234'))
+    assert 2 == mdb.member_count()
+    # the scan updated last_attended, so Ted is active again
+    assert 0 == mdb.archive_inactive(datetime.date(2000, 1, 1))
+
+
+def test_archive_barcode_filter(mdb):
+    """Test that a member reactivated by a scan passes the barcode filter."""
+    mdb.archive_inactive(datetime.date(2000, 1, 1))
+    mdb.enable_barcode_filter()
+    for _ in range(2):
+        assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('12341234'))
+
+
+def test_archive_get_members(mdb):
+    """Test that batched lookups also reactivate archived members."""
+    mdb.archive_inactive(datetime.date(2000, 1, 1))
+    assert 0 == mdb.member_count()
+    assert {'12341234': ('Ted', 'Bobson')} == mdb.get_members(
+        ['12341234', '99999999'])
+    # reactivated, and its attendance recorded
+    assert 0 == mdb.archive_inactive(datetime.date(2000, 1, 1))
+
+
+def test_archive_by_name(mdb):
+    """Test that an archived member can be reactivated by name."""
+    mdb.archive_inactive(datetime.date(2000, 1, 1))
+    assert ('Ted', 'Bobson') == mdb.get_member(
+        socman.Member(None, socman.Name('Ted', 'Bobson')))
+
+
+@pytest.fixture
+def college_mdb(mdb):
+    """Return the mdb fixture with members of several colleges added."""
+    mdb.insert_records([
+        socman.MemberRecord(firstName=first, lastName=last, barcode=barcode,
+                            college=college, datejoined=joined,
+                            last_attended=attended)
+        for first, last, barcode, college, joined, attended in (
+            ('Ann', 'Smith', '1', 'Wolfson', '2016-10-01', '2016-10-01'),
+            ('Bill', 'Rogers', '2', 'Balliol', '2016-10-02', '2017-03-01'),
+            ('Cat', 'Jones', '3', 'Wolfson', '2015-10-01', None),
+            ('Dan', 'Brown', '4', 'Wolfson', '2016-11-01', '2017-05-01'),
+            )])
+    mdb.commit()
+    return mdb
+
+
+@pytest.mark.parametrize('filters, names', [
+    ({}, ['Ted', 'Ann', 'Bill', 'Cat', 'Dan']),
+    ({'college': 'Wolfson'}, ['Ted', 'Ann', 'Cat', 'Dan']),
+    ({'college': ['Balliol', 'Keble']}, ['Bill']),
+    ({'college': 'Wolfson', 'joined_since': datetime.date(2016, 1, 1)},
+     ['Ann', 'Dan']),
+    ({'joined_before': datetime.date(2016, 1, 1)}, ['Ted', 'Cat']),
+    ({'attended_before': datetime.date(2017, 3, 1)}, ['Ted', 'Ann']),
+    ({'attended_since': datetime.date(2017, 3, 1)}, ['Bill', 'Dan']),
+    ({'unpaid': True}, []),
+    ({'unpaid': False, 'college': 'Balliol'}, ['Bill']),
+    ])
+def test_query_filters(college_mdb, filters, names):
+    """Test that query filters combine and member_count agrees."""
+    assert names == [record.firstName
+                     for record in college_mdb.query(**filters)]
+    assert len(names) == college_mdb.member_count(**filters)
+
+
+def test_query_order_and_pages(college_mdb):
+    """Test sorting and offset and keyset pagination."""
+    assert ['Bobson', 'Brown', 'Jones', 'Rogers', 'Smith'] == [
+        record.lastName for record in college_mdb.query(order_by='name')]
+    assert ['Dan', 'Bill'] == [
+        record.firstName for record in college_mdb.query(
+            order_by='datejoined', descending=True, limit=2)]
+    assert ['Ann', 'Cat'] == [
+        record.firstName for record in college_mdb.query(
+            college='Wolfson', limit=2, offset=1)]
+
+    pages = []
+    after = None
+    while True:
+        page = list(college_mdb.query(order_by='college', limit=2,
+                                      after=after))
+        if not page:
+            break
+        pages.append([record.firstName for record in page])
+        after = page[-1]
+    assert [['Bill', 'Ted'], ['Ann', 'Cat'], ['Dan']] == pages
+
+    with pytest.raises(ValueError):
+        college_mdb.query(order_by='barcode')
+
+
+def test_query_unpaid(tmpdir):
+    """Test the unpaid filter on a database with the unpaid column."""
+    with socman.MemberDatabase(str(tmpdir.join('new.db'))) as mdb:
+        mdb.create_schema()
+        mdb.insert_records([socman.MemberRecord(firstName='Ann', unpaid=True),
+                            socman.MemberRecord(firstName='Bill'),
+                            socman.MemberRecord(firstName='Cat',
+                                                unpaid=False)])
+        assert ['Ann'] == [record.firstName
+                           for record in mdb.query(unpaid=True)]
+        assert 2 == mdb.member_count(unpaid=False)
+
+
+def test_query_uses_indexes(college_mdb, db_file):
+    """Test that every filter is answered from an index."""
+    for filters in ({'college': 'Wolfson'},
+                    {'joined_since': datetime.date(2016, 1, 1)},
+                    {'attended_before': datetime.date(2017, 1, 1)}):
+        list(college_mdb.query(**filters))
+    college_mdb.commit()
+    conn = sqlite3.connect(db_file)
+    try:
+        for where in ('college=?', 'datejoined>=?', 'last_attended<?'):
+            plan = ' '.join(row[-1] for row in conn.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM users WHERE ' + where,
+                ('x', )))
+            assert 'USING INDEX' in plan
+    finally:
+        conn.close()
+
+
+def test_maintain(mdb, db_file):
+    """Test that maintenance returns freed space and checks integrity."""
+    mdb.enable_incremental_vacuum()
+    for barcode in range(1000):
+        mdb.add_member(socman.Member(str(barcode),
+                                     socman.Name('Ann', str(barcode))))
+    mdb.delete_records(range(2, 1002))
+    mdb.commit()
+    messages = []
+    report = mdb.maintain(log=messages.append)
+    assert report.size_after < report.size_before
+    assert report.size_after == os.path.getsize(db_file)
+    assert ['analyze', 'vacuum', 'check'] == list(report.timings)
+    assert (None, 'ok') == (report.interrupted, report.integrity)
+    assert 'Integrity check: ok.' in messages
+    assert 1 == mdb.member_count()
+
+    report = mdb.maintain(budget=0, log=messages.append)
+    assert ({}, None) == (report.timings, report.integrity)
+    assert 'Skipping check: out of time.' in messages
+
+
+def test_maintain_holds_lock(db_file):
+    """Test that other threads wait for maintenance to finish."""
+    started, proceed = threading.Event(), threading.Event()
+
+    def log(message):
+        started.set()
+        proceed.wait(5)
+
+    with socman.MemberDatabase(db_file, check_same_thread=False) as mdb:
+        maintenance = threading.Thread(target=mdb.maintain,
+                                       kwargs={'log': log})
+        maintenance.start()
+        started.wait(5)
+        lookup = threading.Thread(target=mdb.get_member,
+                                  args=(socman.Member('12341234'), ))
+        lookup.start()
+        lookup.join(0.1)
+        assert lookup.is_alive()
+        proceed.set()
+        maintenance.join()
+        lookup.join()
+
+
+def test_maintenance_scheduler(mdb):
+    """Test that scheduled maintenance waits for idleness and the interval."""
+    scheduler = socman.MaintenanceScheduler(mdb, interval=3600, idle=0,
+                                            log=lambda message: None)
+    assert 0 == scheduler.next_due()
+    assert 'ok' == scheduler.poll().integrity
+    assert scheduler.poll() is None
+    assert scheduler.next_due() > 3500
+
+    scheduler = socman.MaintenanceScheduler(mdb, idle=60)
+    scheduler.activity()
+    assert scheduler.poll() is None
+    assert 59 < scheduler.next_due() <= 60
+
+
+def test_migrate_colleges(college_mdb, db_file):
+    """Test that colleges are moved to their own table transparently."""
+    assert {'Balliol': 1, 'Wolfson': 4} == college_mdb.college_counts()
+    assert 5 == college_mdb.migrate_colleges({'Wolfson Coll.': 'Wolfson'},
+                                             chunk_size=2)
+    conn = sqlite3.connect(db_file)
+    try:
+        assert [(None, )] == conn.execute(
+            'SELECT DISTINCT college FROM users').fetchall()
+        assert 2 == conn.execute('SELECT COUNT(*) FROM colleges').fetchone()[0]
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT college_id, COUNT(*) FROM users '
+            'GROUP BY college_id'))
+        assert 'COVERING INDEX users_college_id' in plan
+    finally:
+        conn.close()
+
+    # names are translated on the way in and out
+    college_mdb.add_member(socman.Member('5', socman.Name('Eve', 'Ng'),
+                                         'wolfson coll.'))
+    college_mdb.add_member(socman.Member('6', socman.Name('Fay', 'Li'),
+                                         'Keble'))
+    assert {'Balliol': 1, 'Keble': 1, 'Wolfson': 5} == (
+        college_mdb.college_counts())
+    assert ['Wolfson', 'Wolfson', 'Balliol', 'Wolfson', 'Wolfson',
+            'Wolfson', 'Keble'] == [record.college
+                                    for record in college_mdb.iter_records()]
+    assert ['Ted', 'Ann', 'Cat', 'Dan', 'Eve'] == [
+        record.firstName for record in college_mdb.query(college='WOLFSON')]
+    assert 2 == college_mdb.member_count(college=['Keble', 'Balliol'])
+    assert ['Bill', 'Fay', 'Ted'] == [
+        record.firstName for record in college_mdb.query(order_by='college',
+                                                         limit=3)]
+    page = list(college_mdb.query(order_by='college', limit=2))
+    assert ['Ted'] == [record.firstName for record in college_mdb.query(
+        order_by='college', limit=1, after=page[-1])]
+
+    # a roster spelling a college differently changes nothing
+    report = college_mdb.reconcile(
+        [socman.Member('1', socman.Name('Ann', 'Smith'), 'Wolfson Coll.'),
+         socman.Member('2', socman.Name('Bill', 'Rogers'), 'Keble')])
+    assert 1 == report.matched
+    assert [2] == [member.barcode for member in report.changed]
+    assert 'Keble' == college_mdb.get_records(socman.Member('2'))[0].college
+
+    # an alias added later merges a college stored under it
+    college_mdb.add_member(socman.Member('7', socman.Name('Gus', 'Po'),
+                                         'Keble Coll'))
+    assert 1 == college_mdb.college_counts()['Keble Coll']
+    college_mdb.add_college_alias('Keble Coll', 'Keble')
+    assert {'Keble': 3, 'Wolfson': 5} == college_mdb.college_counts()
+    assert 'Keble' == college_mdb.get_records(socman.Member('7'))[0].college
+
+
+@pytest.mark.parametrize('barcode', [
+    '12341234', ' 0042 ', '+7', 12341234, 'AB12 ', ' x y ', '0',
+    '12345678901234567890', ' 0012345678901234567890',
+    ])
+def test_barcode_key_matches_sql(tmpdir, barcode):
+    """Test that _barcode_key agrees with the key stored by the trigger."""
+    with socman.MemberDatabase(str(tmpdir.join('new.db'))) as mdb:
+        mdb.create_schema()
+        mdb.insert_records([socman.MemberRecord(barcode=barcode)])
+        mdb.commit()
+    conn = sqlite3.connect(str(tmpdir.join('new.db')))
+    try:
+        key, = conn.execute('SELECT barcode_key FROM users').fetchone()
+    finally:
+        conn.close()
+    assert socman._barcode_key(barcode) == key
+
+
+def test_long_numeric_barcode(tmpdir):
+    """Test that barcodes too long for a 64-bit integer are found again."""
+    barcode = '12345678901234567890'
+    with socman.MemberDatabase(str(tmpdir.join('new.db'))) as mdb:
+        mdb.create_schema()
+        mdb.add_member(socman.Member(barcode, socman.Name('Ann', 'Lee')))
+        assert ('Ann', 'Lee') == mdb.get_member(socman.Member(barcode))
+        assert ('Ann', 'Lee') == mdb.get_member(socman.Member('0' + barcode))
+        assert {barcode: ('Ann', 'Lee')} == mdb.get_members([barcode])
+        mdb.update_member(socman.Member('98765432109876543210',
+                                        socman.Name('Ann', 'Lee')),
+                          authority='name')
+        assert ('Ann', 'Lee') == mdb.get_member(
+            socman.Member('98765432109876543210'))
+
+
+def test_migrate_barcode_keys(mdb, db_file):
+    """Test migrating to barcode keys and looking members up by them."""
+    mdb.insert_records([socman.MemberRecord(firstName='Ann', barcode=' 007'),
+                        socman.MemberRecord(firstName='Bill',
+                                            barcode='AB12 '),
+                        socman.MemberRecord(firstName='Cat', barcode='')])
+    mdb.commit()
+    assert 3 == mdb.migrate_barcode_keys(chunk_size=2)
+    assert 0 == mdb.migrate_barcode_keys()
+
+    assert 'Ann' == mdb.get_member(socman.Member('0007 '))[0]
+    assert 'Bill' == mdb.get_member(socman.Member(' AB12'))[0]
+    assert {'7': ('Ann', None), 'AB12': ('Bill', None)} == mdb.get_members(
+        ['7', 'AB12'])
+    mdb.add_member(socman.Member(' 0042', socman.Name('Dan', 'Brown')))
+    assert ('Dan', 'Brown') == mdb.get_member(socman.Member(42))
+
+    conn = sqlite3.connect(db_file)
+    try:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM users WHERE barcode_key=?',
+            ('7', )))
+    finally:
+        conn.close()
+    assert 'users_barcode_key' in plan
+
+
+def test_barcode_keys_reconcile_archive(mdb):
+    """Test that reconcile, merges and the archive match by barcode key."""
+    mdb.migrate_barcode_keys()
+    # distinct barcodes which are equal as REALs, as SQLite stores them
+    ann, bill = '123456789012345678901234', '123456789012345678901235'
+    mdb.insert_records([
+        socman.MemberRecord(firstName='Ann', barcode=ann,
+                            last_attended='1999-01-01'),
+        socman.MemberRecord(firstName='Bill', barcode=bill,
+                            last_attended='1999-01-01')])
+    report = mdb.reconcile([socman.Member(ann, socman.Name('Ann', 'Lee'))])
+    assert 1 == len(report.changed)
+    assert ['Bill', 'Ted'] == sorted(member.name.first()
+                                     for member in report.missing)
+    assert 'Bill' == mdb.get_member(socman.Member(bill),
+                                    update_timestamp=False)[0]
+
+    assert 3 == mdb.archive_inactive(datetime.date(2000, 1, 1))
+    assert ('Ann', 'Lee') == mdb.get_member(socman.Member(ann))
+    assert 1 == mdb.member_count()
+    assert {bill: ('Bill', None)} == mdb.get_members([bill])
+    assert 2 == mdb.member_count()
+
+    record = socman.MemberRecord(firstName='Ann', lastName='Lee',
+                                 barcode=' 0055', updated_at='9999-01-01')
+    assert (0, 1, 0) == mdb.merge_changes([record])
+    assert ('Ann', 'Lee') == mdb.get_member(socman.Member('55'))
+
+
+@pytest.mark.parametrize('keyed', [False, True])
+def test_barcode_prefix(db_file, keyed):
+    """Test that truncated barcodes find the member with the whole one."""
+    with socman.MemberDatabase(db_file, barcode_prefix_length=4) as mdb:
+        if keyed:
+            mdb.migrate_barcode_keys()
+        assert [(12341234, 'Ted', 'Bobson')] == mdb.match_barcode_prefix(
+            '1234')
+        assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('1234'),
+                                                   autofix=True)
+        assert str(datetime.date.today()) == last_attended(db_file,
+                                                           '12341234')
+        assert {'1234': ('Ted', 'Bobson')} == mdb.get_members(['1234'])
+
+        # another barcode with the same prefix makes it ambiguous, unless a
+        # barcode equals the prefix exactly
+        mdb.add_member(socman.Member('12349999', socman.Name('Bill', 'Ro')))
+        with pytest.raises(socman.AmbiguousBarcodeError) as error:
+            mdb.get_member(socman.Member('1234'))
+        assert ['12341234', '12349999'] == error.value.barcodes
+        assert {} == mdb.get_members(['1234'])
+        mdb.insert_records([socman.MemberRecord(firstName='Cat',
+                                                lastName='Jones',
+                                                barcode='1234')])
+        assert ('Cat', 'Jones') == mdb.get_member(socman.Member('1234'))
+
+        # other lengths are whole barcodes
+        with pytest.raises(socman.MemberNotFoundError):
+            mdb.get_member(socman.Member('12341'))
+
+
+@pytest.mark.parametrize('keyed', [False, True])
+def test_barcode_prefix_leading_zeros(db_file, keyed):
+    """Test that a truncated barcode with leading zeros is a prefix."""
+    with socman.MemberDatabase(db_file, barcode_prefix_length=4) as mdb:
+        if keyed:
+            mdb.migrate_barcode_keys()
+        mdb.add_member(socman.Member('00987654', socman.Name('Ann', 'Lee')))
+        assert ('Ann', 'Lee') == mdb.get_member(socman.Member('0098'))
+        assert {'0098': ('Ann', 'Lee')} == mdb.get_members(['0098'])
+
+
+@pytest.mark.parametrize('name, key', [
+    ('Ted', 'ted'),
+    ('  Mary   Ann ', 'mary ann'),
+    ('Zo\u00eb', 'zoe'),
+    ('STRASSE', 'strasse'),
+    ('', None),
+    (None, None),
+    ])
+def test_name_key(name, key):
+    """Test name normalization."""
+    assert key == socman._name_key(name)
+
+
+def test_migrate_name_keys(mdb, db_file):
+    """Test migrating to name keys and matching names loosely by them."""
+    mdb.insert_records([socman.MemberRecord(firstName='Zo\u00eb',
+                                            lastName='Smith ')])
+    mdb.commit()
+    assert 2 == mdb.migrate_name_keys(chunk_size=1)
+    assert 0 == mdb.migrate_name_keys()
+
+    assert ('Ted', 'Bobson') == mdb.get_member(
+        socman.Member(None, socman.Name('ted', '  BOBSON')))
+    assert ('Zo\u00eb', 'Smith ') == mdb.get_member(
+        socman.Member(None, socman.Name('zoe', 'smith')))
+
+    # autofix by name finds the row by key, and keys follow renames
+    mdb.update_member(socman.Member('55555555', socman.Name('TED', 'bobson')),
+                      authority='name')
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('55555555'))
+    mdb.update_member(socman.Member('55555555', socman.Name('Ed', 'Bobson')))
+    assert ('Ed', 'Bobson') == mdb.get_member(
+        socman.Member(None, socman.Name('ed', 'bobson')))
+
+    # a new connection sees the keys too
+    with socman.MemberDatabase(db_file) as other:
+        other.add_member(socman.Member('1', socman.Name('Ann', 'Lee')))
+        assert ('Ann', 'Lee') == other.get_member(
+            socman.Member(None, socman.Name('ANN', 'LEE')))
+
+    report = mdb.reconcile([socman.Member('2', socman.Name('ann', 'lee'))],
+                           authority='name')
+    assert (0, 1) == (len(report.new), len(report.changed))
+
+
+def test_name_keys_other_writers(mdb, db_file):
+    """Test that rows written without name keys are still found by name."""
+    mdb.migrate_name_keys()
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("INSERT INTO users (firstName, lastName, barcode) "
+                     "VALUES ('Ann', 'Lee', '43214321')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    # matched by exact name until the keys are filled in
+    assert ('Ann', 'Lee') == mdb.get_member(
+        socman.Member(None, socman.Name('Ann', 'Lee')))
+    mdb.add_member(socman.Member(None, socman.Name('Ann', 'Lee')))
+    assert 2 == mdb.member_count()
+
+    # opening the database fills the keys in
+    with socman.MemberDatabase(db_file) as other:
+        assert ('Ann', 'Lee') == other.get_member(
+            socman.Member(None, socman.Name('ann', 'LEE')))
+
+    conn = sqlite3.connect(db_file)
+    try:
+        assert [] == conn.execute('SELECT id FROM users '
+                                  'WHERE lastName_key IS NULL').fetchall()
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM users WHERE (lastName_key=? '
+            'OR firstName_key IS NULL AND lastName_key IS NULL AND '
+            'lastName=?)', ('lee', 'Lee')))
+    finally:
+        conn.close()
+    assert 'users_name_key' in plan
+
+
+@pytest.fixture
+def history_files(tmpdir):
+    """Return the database files of two past years."""
+    old_file = str(tmpdir.join('2015.db'))
+    conn = sqlite3.connect(old_file)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, '
+                 'firstName VARCHAR(255), lastName VARCHAR(255), '
+                 'barcode INTEGER)')
+    conn.executemany('INSERT INTO users (firstName, lastName, barcode) '
+                     'VALUES (?, ?, ?)', [('Ted', 'Bobson', '12341234'),
+                                          ('Old', 'Timer', '99990000')])
+    conn.commit()
+    conn.close()
+
+    recent_file = str(tmpdir.join('2016.db'))
+    with socman.MemberDatabase(recent_file) as recent:
+        recent.create_schema()
+        recent.add_member(socman.Member('55550000',
+                                        socman.Name('Ann', 'Smith')))
+    return [old_file, recent_file]
+
+
+def test_history(mdb, history_files):
+    """Test lookups and counts across ATTACHed files of past years."""
+    assert ['2015.db', '2016.db'] == mdb.attach_history(history_files)
+
+    # found this year, so past years are not searched
+    (source, record), = mdb.get_history(socman.Member('12341234'))
+    assert ('main', 'Wolfson') == (source, record.college)
+    (source, record), = mdb.get_history(
+        socman.Member(None, socman.Name('Old', 'Timer')))
+    assert ('2015.db', 99990000, None) == (source, record.barcode,
+                                           record.unpaid)
+    assert '2016.db' == mdb.get_history(socman.Member('55550000'))[0][0]
+    assert [] == mdb.get_history(socman.Member('11111111'))
+
+    assert 4 == mdb.history_count()
+    assert 3 == mdb.history_count(distinct=True)
+    assert ['main', '2015.db', '2015.db', '2016.db'] == [
+        source for source, _ in mdb.iter_history(chunk_size=1)]
+
+    mdb.detach_history()
+    assert [] == mdb.get_history(socman.Member('55550000'))
+
+
+def test_memory_profiler(mdb, tmpdir):
+    """Test that bulk operations are measured by a MemoryProfiler."""
+    profiler = socman.MemoryProfiler()
+    mdb.memory_profiler = profiler
+    mdb.insert_records([socman.MemberRecord(firstName='Bill', barcode=i)
+                        for i in range(1000)])
+    assert 1001 == mdb.member_count()
+    records = mdb.iter_records(chunk_size=10)
+    next(records)
+    # still iterating, so not yet reported
+    assert ['insert_records', 'member_count'] == [
+        report.operation for report in profiler.reports]
+    assert 1000 == len(list(records))
+    mdb.write_csv(str(tmpdir.join('members.csv')))
+    # single lookups are not bulk operations
+    mdb.get_member(socman.Member('12341234'))
+
+    assert ['insert_records', 'member_count', 'iter_records',
+            'write_csv'] == [report.operation for report in profiler.reports]
+    for report in profiler.reports:
+        assert report.peak >= max(report.retained, 0)
+        assert report.seconds >= 0
+    # the records were made, so more was allocated than a count needs
+    assert profiler.peak('insert_records') > profiler.peak('member_count')
+
+    mdb.memory_profiler = None
+    mdb.member_count()
+    assert 4 == len(profiler.reports)
+
+
+def test_replica(db_file):
+    """Test that a replica serves reads from memory and writes through."""
+    with socman.MemberDatabase(db_file, replica=True,
+                               commit_every=3) as replica:
+        assert ('Ted', 'Bobson') == replica.get_member(
+            socman.Member('12341234'))
+        replica.add_member(socman.Member('43214321',
+                                         socman.Name('Bill', 'Rogers')))
+        # essential operations reach the file at once
+        with socman.MemberDatabase(db_file) as disk:
+            assert 2 == disk.member_count()
+            assert ('Bill', 'Rogers') == disk.get_member(
+                socman.Member('43214321'), update_timestamp=False)
+
+        replica.update_member(socman.Member('12341234',
+                                            socman.Name('Ted', 'Rogers')))
+        record, = replica.get_records(socman.Member('43214321'))
+        replica.delete_records([record.id])
+        replica.get_member(socman.Member('12341234'))
+        # batched by group commit, so not yet written
+        with socman.MemberDatabase(db_file) as disk:
+            assert 2 == disk.member_count()
+        replica.get_member(socman.Member('12341234'))
+        with socman.MemberDatabase(db_file) as disk:
+            assert 1 == disk.member_count()
+            assert ('Ted', 'Rogers') == disk.get_member(
+                socman.Member('12341234'), update_timestamp=False)
+
+        # schema changes, and rows of new tables, are copied too
+        replica.archive_inactive(datetime.date.today() +
+                                 datetime.timedelta(days=1))
+        assert 0 == replica.member_count()
+    with socman.MemberDatabase(db_file) as disk:
+        assert 0 == disk.member_count()
+        disk.enable_archive()
+        assert ('Ted', 'Rogers') == disk.get_member(
+            socman.Member('12341234'))
+        assert 1 == disk.member_count()
+
+
+def test_replica_rollback(db_file):
+    """Test that rolled back replica changes are not written through."""
+    with socman.MemberDatabase(db_file, replica=True) as replica:
+        with pytest.raises(ValueError):
+            with replica.transaction():
+                replica.add_member(socman.Member(
+                    '43214321', socman.Name('Bill', 'Rogers')))
+                raise ValueError
+        assert 1 == replica.member_count()
+        replica.add_member(socman.Member('55556666',
+                                         socman.Name('Ann', 'Smith')))
+    with socman.MemberDatabase(db_file) as disk:
+        assert ['12341234', '55556666'] == [
+            str(record.barcode) for record in disk.iter_records()]
+
+
+def test_replica_old_sqlite(db_file, monkeypatch):
+    """Test that replica mode is refused on SQLite without upserts."""
+    monkeypatch.setattr(socman.sqlite3, 'sqlite_version_info', (3, 23, 1))
+    with pytest.raises(socman.Error):
+        socman.MemberDatabase(db_file, replica=True)
+
+
+def test_barcode_cache(db_file):
+    """Test that a barcode cache answers lookups and stays consistent."""
+    with socman.MemberDatabase(db_file, commit_every=10) as mdb:
+        assert 1 == mdb.enable_barcode_cache()
+        # found from the cache; attendance waits for the next commit
+        assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('12341234'))
+        record, = mdb.get_records(socman.Member('12341234'))
+        assert record.last_attended != datetime.date.today().isoformat()
+        mdb.commit()
+        record, = mdb.get_records(socman.Member('12341234'))
+        assert record.last_attended == datetime.date.today().isoformat()
+
+        mdb.add_member(socman.Member('43214321',
+                                     socman.Name('Bill', 'Rogers')))
+        mdb.update_member(socman.Member('12341234',
+                                        socman.Name('Ted', 'Rogers')))
+        assert ('Ted', 'Rogers') == mdb.get_member(socman.Member('12341234'))
+        mdb.delete_records([record.id])
+        with pytest.raises(socman.MemberNotFoundError):
+            mdb.get_member(socman.Member('12341234'))
+        assert ('Bill', 'Rogers') == mdb.get_member(
+            socman.Member(' 43214321'))
+
+        # changes rolled back are forgotten by the cache too
+        with pytest.raises(ValueError):
+            with mdb.transaction():
+                mdb.add_member(socman.Member('55556666',
+                                             socman.Name('Ann', 'Smith')))
+                raise ValueError
+        with pytest.raises(socman.MemberNotFoundError):
+            mdb.get_member(socman.Member('55556666'))
+
+
+def test_changelog(mdb):
+    """Test that the changelog records inserts, updates and deletes."""
+    mdb.enable_changelog()
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    mdb.update_member(socman.Member('12341234', socman.Name('Ted', 'Rogers')))
+    # attendance alone is not a change
+    mdb.get_member(socman.Member('12341234'))
+    record, = mdb.get_records(socman.Member('43214321'))
+    mdb.delete_records([record.id])
+
+    entries = list(mdb.changes_since(chunk_size=2))
+    assert [('insert', '43214321'), ('update', '12341234'),
+            ('delete', '43214321')] == [
+                (entry.operation, str(entry.barcode)) for entry in entries]
+    assert entries == sorted(entries)
+    assert entries[1:] == list(mdb.changes_since(entries[0].seq))
+    assert [] == list(mdb.changes_since(entries[-1].seq))
+
+    assert 1 == mdb.compact_changelog()
+    assert ['update', 'delete'] == [
+        entry.operation for entry in mdb.changes_since()]
+
+
+@pytest.mark.parametrize('changelog_first', [False, True])
+def test_changelog_colleges(mdb, changelog_first):
+    """Test that replacing colleges by their ids is not logged as a change."""
+    if changelog_first:
+        mdb.enable_changelog()
+        seq = max([0] + [entry.seq for entry in mdb.changes_since()])
+        mdb.migrate_colleges()
+    else:
+        mdb.migrate_colleges()
+        mdb.enable_changelog()
+        seq = max([0] + [entry.seq for entry in mdb.changes_since()])
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers'),
+                                 'Keble'))
+    mdb.reconcile([socman.Member('12341234', socman.Name('Ted', 'Bobson'),
+                                 'Balliol')])
+    assert [('insert', '43214321'), ('update', '12341234')] == [
+        (entry.operation, str(entry.barcode))
+        for entry in mdb.changes_since(seq)]
+
+
+def test_changelog_retention(mdb):
+    """Test that old changelog entries are removed automatically."""
+    mdb.enable_changelog(retain=10)
+    for i in range(1000):
+        mdb.add_member(socman.Member(str(i)))
+    entries = list(mdb.changes_since())
+    assert 10 == len(entries)
+    assert 1000 == entries[-1].seq
+
+    mdb.disable_changelog()
+    mdb.add_member(socman.Member('43214321'))
+    assert entries == list(mdb.changes_since())
+
+
+def test_backup(mdb, tmpdir, monkeypatch):
+    """Test backing up to a file, pausing between steps, with progress."""
+    mdb.add_member(socman.Member('43214321', socman.Name('Bill', 'Rogers')))
+    steps = []
+    pauses = []
+    monkeypatch.setattr(socman.time, 'sleep', pauses.append)
+    backup_path = str(tmpdir.join('backup.db'))
+    assert backup_path == mdb.backup(
+        backup_path, pages_per_step=1, sleep=0.01,
+        progress=lambda status, remaining, total: steps.append(remaining))
+    assert steps and steps[-1] == 0
+    assert [0.01] * (len(steps) - 1) == pauses
+
+    backup = socman.MemberDatabase(backup_path)
+    assert 2 == backup.member_count()
+    assert ('Bill', 'Rogers') == backup.get_member(socman.Member('43214321'))
+
+
+def test_backup_rotation(mdb, tmpdir):
+    """Test timestamped backups into a directory, keeping the newest."""
+    backup_dir = tmpdir.mkdir('backups')
+    backups = [mdb.backup(str(backup_dir), keep=2) for _ in range(3)]
+    assert len(set(backups)) == 3
+    assert sorted(backups[1:]) == sorted(
+        str(path) for path in backup_dir.listdir())
+
+
+def test_backup_background(mdb, tmpdir):
+    """Test that check-ins continue while a background backup runs."""
+    for i in range(200):
+        mdb.add_member(socman.Member(str(i), socman.Name('Name', str(i))))
+    backup_path = str(tmpdir.join('backup.db'))
+    thread = mdb.backup(backup_path, pages_per_step=1, sleep=0.001,
+                        background=True)
+    for i in range(200):
+        assert ('Name', str(i)) == mdb.get_member(socman.Member(str(i)))
+    thread.join()
+    assert 201 == socman.MemberDatabase(backup_path).member_count()
+
+
+def test_context_manager(db_file):
+    """Test that leaving a with block commits and closes the database."""
+    with socman.MemberDatabase(db_file, safe=False) as mdb:
+        mdb.add_member(socman.Member('43214321'))
+        mdb.get_member(socman.Member('12341234'))
+    with pytest.raises(sqlite3.ProgrammingError):
+        mdb.member_count()
+    mdb.close()  # closing twice is harmless
+
+    with socman.MemberDatabase(db_file) as mdb:
+        assert 2 == mdb.member_count()
+
+
+def test_transaction_commit(mdb, db_file):
+    """Test that a transaction commits its operations together at the end."""
+    other = socman.MemberDatabase(db_file)
+    with mdb.transaction():
+        for i in range(10):
+            mdb.add_member(socman.Member(str(i)))
+        assert 1 == other.member_count()
+    assert 11 == other.member_count()
+    other.close()
+
+
+def test_transaction_rollback(mdb):
+    """Test that an exception in a transaction rolls back its operations."""
+    with pytest.raises(socman.MemberNotFoundError):
+        with mdb.transaction():
+            mdb.add_member(socman.Member('43214321'))
+            mdb.update_member(socman.Member('12341234',
+                                            socman.Name('Bill', 'Rogers')))
+            mdb.get_member(socman.Member('11111111'))
+    assert 1 == mdb.member_count()
+    assert ('Ted', 'Bobson') == mdb.get_member(socman.Member('12341234'))
+
+
+def test_transaction_nested(mdb):
+    """Test that a failed inner transaction only rolls back its own work."""
+    with mdb.transaction():
+        mdb.add_member(socman.Member('1'))
+        with pytest.raises(socman.MemberNotFoundError):
+            with mdb.transaction():
+                mdb.add_member(socman.Member('2'))
+                mdb.get_member(socman.Member('11111111'))
+        with mdb.transaction():
+            mdb.add_member(socman.Member('3'))
+    assert 3 == mdb.member_count()
+    with pytest.raises(socman.MemberNotFoundError):
+        mdb.get_member(socman.Member('2'))
+
+
+def last_attended(db_file, barcode):
+    """Return a member's last_attended date as seen by a new connection."""
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute('SELECT last_attended FROM users WHERE barcode=?',
+                            (barcode, )).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_group_commit_every(db_file):
+    """Test that scans are committed in groups of `commit_every`."""
+    with socman.MemberDatabase(db_file, commit_every=3) as mdb:
+        for _ in range(2):
+            mdb.get_member(socman.Member('12341234'))
+        assert (str(datetime.date.min) ==
+                last_attended(db_file, '12341234'))
+        mdb.get_member(socman.Member('12341234'))
+        assert (str(datetime.date.today()) ==
+                last_attended(db_file, '12341234'))
+
+
+def test_group_commit_interval(db_file):
+    """Test that a timer commits scans `commit_interval` seconds later."""
+    with socman.MemberDatabase(db_file, commit_interval=0.01) as mdb:
+        mdb.get_member(socman.Member('12341234'))
+        for _ in range(500):
+            if last_attended(db_file, '12341234') != str(datetime.date.min):
+                break
+            time.sleep(0.01)
+        assert (str(datetime.date.today()) ==
+                last_attended(db_file, '12341234'))
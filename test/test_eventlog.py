@@ -0,0 +1,100 @@
+"""
+test_eventlog.py contains tests for socman's structured event log.
+
+Tests on socman should be run with `python -m pytest`. To run just these tests,
+run `pytest tests/test_eventlog.py`.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import unittest.mock
+
+import pytest
+
+import socman
+
+
+def test_event_log_round_trip(tmpdir):
+    """Test that recorded events are read back in order with their fields."""
+    log_path = str(tmpdir.join('events.jsonl'))
+    with socman.EventLog(log_path) as log:
+        log.record('scan', barcode='12341234')
+        log.record('member', barcode='12341234', first_name='Ted',
+                   last_name='Bobson')
+        log.record('oneoff')
+
+    events = list(socman.read_event_log(log_path))
+    assert ['scan', 'member', 'oneoff'] == [
+        event['event'] for event in events]
+    assert events[1]['first_name'] == 'Ted'
+    assert all('time' in event for event in events)
+
+
+@pytest.mark.parametrize('sync_every,records,syncs', [
+    (1, 5, 5),
+    (2, 5, 2),
+    (10, 5, 0),
+    (None, 5, 0),
+    ])
+def test_event_log_sync_every(tmpdir, sync_every, records, syncs):
+    """Test that the log fsyncs after every `sync_every` records."""
+    log = socman.EventLog(str(tmpdir.join('events.jsonl')),
+                          sync_every=sync_every, sync_interval=None)
+    with unittest.mock.patch('socman.os.fsync') as fsync:
+        for _ in range(records):
+            log.record('scan')
+        assert syncs == fsync.call_count
+        log.close()
+        assert syncs + 1 == fsync.call_count
+
+
+def test_event_log_sync_interval(tmpdir):
+    """Test that an idle log is fsynced once `sync_interval` has passed."""
+    log = socman.EventLog(str(tmpdir.join('events.jsonl')),
+                          sync_every=None, sync_interval=0.01)
+    synced = threading.Event()
+    with unittest.mock.patch('socman.os.fsync',
+                             side_effect=lambda fd: synced.set()) as fsync:
+        log.record('scan')
+        log.record('scan')
+        assert synced.wait(5)
+        assert 1 == fsync.call_count
+    log.close()
+
+
+def test_read_event_log_skips_torn_line(tmpdir):
+    """Test that a partially written final line is skipped when reading."""
+    log_path = tmpdir.join('events.jsonl')
+    log_path.write('{"event": "scan"}\n{"event": "mem')
+    assert [{'event': 'scan'}] == list(socman.read_event_log(str(log_path)))
+
+
+def test_read_event_log_corrupt_line(tmpdir):
+    """Test that an unparseable line before the final line raises."""
+    log_path = tmpdir.join('events.jsonl')
+    log_path.write('{"event": "scan"}\n{"event": "mem\n{"event": "scan"}\n')
+    with pytest.raises(ValueError):
+        list(socman.read_event_log(str(log_path)))
@@ -0,0 +1,77 @@
+"""
+test_loadtest.py contains tests for the socman_loadtest load generator.
+
+Tests on socman should be run with `python -m pytest`. To run just these tests,
+run `pytest tests/test_loadtest.py`.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# pylint: disable=redefined-outer-name
+import functools
+
+import pytest
+
+import socman
+import socman_cli
+import socman_loadtest
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_run_load_connection_per_worker(db_file, processes):
+    """Test a load test with a MemberDatabase per worker."""
+    report = socman_loadtest.run_load(
+        functools.partial(socman.MemberDatabase, db_file), workers=3,
+        scans=20, known=['12341234'], processes=processes)
+    assert 60 == report.scans + report.busy + report.errors
+    assert 0 == report.errors
+    assert report.p50 <= report.p90 <= report.p99 <= report.max
+    assert report.throughput > 0
+    assert report.scans == sum(report.kinds.values())
+
+
+def test_run_load_shared(db_file):
+    """Test a load test sharing one database, at a fixed arrival rate."""
+    with socman.MemberDatabase(db_file, check_same_thread=False) as mdb:
+        report = socman_loadtest.run_load(
+            lambda: mdb, workers=2, scans=10, rate=1000,
+            mix=socman_loadtest.ScanMix(0, 1, 0), close=False)
+        assert (20, 0) == (report.scans, report.busy)
+        assert {'signup': 20} == report.kinds
+        assert 21 == mdb.member_count()
+    assert 'Throughput:' in socman_loadtest.format_report(report)
+
+
+def test_loadtest_command(db_file, capsys):
+    """Test the loadtest subcommand."""
+    assert 0 == socman_cli.main(['loadtest', db_file, '--workers', '2',
+                                 '--scans', '10', '--populate', '5',
+                                 '--shared'])
+    output = capsys.readouterr().out
+    assert 'one shared database' in output
+    assert 'Scans:          20' in output
+
+    with pytest.raises(SystemExit):
+        socman_cli.main(['loadtest', db_file, '--mix', '1,2'])
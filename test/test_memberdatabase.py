@@ -71,6 +71,7 @@ def mdb(mocks):
     mdb_fixture = socman.MemberDatabase('test.db', safe=True)
     mdb_fixture.mocksql_connect = mocks.sql_connect
     yield mdb_fixture
+    mdb_fixture.close()
 
 
 def test_db_connect(mdb):
@@ -997,3 +998,43 @@ def test_update_member_present(mdb, member, authority, mock_returns):
             """WHERE firstName=? AND lastName=?""",
             (member.barcode, datetime.datetime.min,
              member.name.given(), member.name.last()))
+
+
+def test_transaction_defers_commits(mdb):
+    """Test that commits are deferred to the end of a transaction.
+
+    add_member normally commits at once; inside a transaction, only the
+    end of the outermost block should commit.
+    """
+    mdb.mocksql_connect().cursor().fetchall.side_effect = [[], []] * 3
+    with mdb.transaction():
+        with mdb.transaction():
+            for barcode in ['1', '2', '3']:
+                mdb.add_member(socman.Member(barcode))
+            mdb.commit()
+        assert 0 == mdb.mocksql_connect().commit.call_count
+    assert 1 == mdb.mocksql_connect().commit.call_count
+
+
+def test_transaction_rollback_on_error(mdb):
+    """Test that an exception in a transaction rolls back, not commits."""
+    with pytest.raises(socman.BadMemberError):
+        with mdb.transaction():
+            mdb.add_member(None)
+    assert 1 == mdb.mocksql_connect().rollback.call_count
+    assert 0 == mdb.mocksql_connect().commit.call_count
+
+
+@pytest.mark.parametrize('commit_every,scans,commits', [
+    (1, 5, 5),
+    (2, 5, 2),
+    (5, 5, 1),
+    (10, 5, 0),
+    ])
+def test_group_commit_every(mocks, commit_every, scans, commits):
+    """Test that group commit commits once every `commit_every` scans."""
+    mdb = socman.MemberDatabase('test.db', commit_every=commit_every)
+    mocks.sql_connect().cursor().fetchall.return_value = [('Ted', 'Bobson')]
+    for _ in range(scans):
+        mdb.get_member(socman.Member('00000000'))
+    assert commits == mocks.sql_connect().commit.call_count
@@ -101,6 +101,15 @@ NameTestData = collections.namedtuple('NameTestData',
         last='Rogers',
         given='Ted Bobson Rickerton',
         full='Ted Bobson Rickerton Rogers'
+        )),
+    # surrounding whitespace
+    (socman.Name(' Ted ', ' Rogers'), NameTestData(
+        names=[' Ted ', ' Rogers'],
+        first='Ted',
+        middle='',
+        last='Rogers',
+        given='Ted',
+        full='Ted Rogers'
         ))
 ])
 def test_name_strings(name, expected):
@@ -0,0 +1,192 @@
+"""
+test_server.py contains tests for the check-in server and client.
+
+Tests on socman should be run with `python -m pytest`. To run just these tests,
+run `pytest tests/test_server.py`.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# pylint: disable=redefined-outer-name
+import asyncio
+import json
+import threading
+
+import pytest
+
+import socman
+import socman_server
+
+
+@pytest.fixture(params=['tcp', 'unix'])
+def address(request, db_file, tmpdir):
+    """Run a CheckinServer on a background thread and return its address."""
+    if request.param == 'tcp':
+        listen_address = 'tcp://127.0.0.1:0'
+    else:
+        listen_address = 'unix://' + str(tmpdir.join('socman.sock'))
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        state['server'] = socman_server.CheckinServer(
+            socman.MemberDatabase(db_file, safe=False), commit_interval=0.01)
+        server = loop.run_until_complete(
+            state['server'].start(listen_address))
+        if request.param == 'tcp':
+            host, port = server.sockets[0].getsockname()[:2]
+            state['address'] = 'tcp://{}:{}'.format(host, port)
+        else:
+            state['address'] = listen_address
+        started.set()
+        loop.run_forever()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        checkin_server = state.pop('server')
+        checkin_server.flush()
+        checkin_server.db.close()
+        loop.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    yield state['address']
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+@pytest.mark.parametrize('address_string,expected', [
+    ('tcp://localhost:8642', ('tcp', ('localhost', 8642))),
+    ('unix:///tmp/socman.sock', ('unix', '/tmp/socman.sock')),
+    ])
+def test_parse_address(address_string, expected):
+    """Test parsing of tcp:// and unix:// addresses."""
+    assert socman_server.is_address(address_string)
+    assert expected == socman_server.parse_address(address_string)
+
+
+@pytest.mark.parametrize('address_string', [
+    'members.db', 'tcp://localhost', 'tcp://:80', 'http://localhost:80'])
+def test_parse_address_bad(address_string):
+    """Test that addresses without a scheme, host or port are rejected."""
+    with pytest.raises(ValueError):
+        socman_server.parse_address(address_string)
+
+
+def test_client_get_member(address):
+    """Test looking up members through the server."""
+    with socman_server.CheckinClient(address) as client:
+        assert ('Ted', 'Bobson') == client.get_member(
+            socman.Member('12341234'))
+        assert ('Ted', 'Bobson') == client.get_member(
+            socman.Member(None, socman.Name('Ted', 'Bobson')),
+            update_timestamp=False)
+        with pytest.raises(socman.MemberNotFoundError):
+            client.get_member(socman.Member('11111111'))
+        with pytest.raises(socman.BadMemberError):
+            client.get_member(socman.Member(None))
+
+
+def test_client_add_and_update_member(address):
+    """Test that writes from one client are seen by another."""
+    with socman_server.CheckinClient(address) as client:
+        client.add_member(socman.Member('43214321',
+                                        socman.Name('Bill', 'Rogers')))
+        client.update_member(socman.Member('12341234',
+                                           socman.Name('Ted', 'Rogers')))
+        with pytest.raises(socman.IncompleteMemberError):
+            client.update_member(socman.Member('12341234'))
+
+    with socman_server.CheckinClient(address) as client:
+        assert 2 == client.member_count()
+        assert ('Bill', 'Rogers') == client.get_member(
+            socman.Member('43214321'))
+        assert ('Ted', 'Rogers') == client.get_member(
+            socman.Member('12341234'))
+
+
+def test_server_commits_batched_writes(address, db_file):
+    """Test that the server commits client writes to the database file."""
+    with socman_server.CheckinClient(address) as client:
+        client.update_member(socman.Member('12341234',
+                                           socman.Name('Ted', 'Rogers')))
+        for _ in range(100):
+            client.get_member(socman.Member('12341234'))
+
+    # poll from a separate connection until the server's commit timer fires
+    other = socman.MemberDatabase(db_file)
+    for _ in range(500):
+        if other.get_member(socman.Member('12341234'),
+                            update_timestamp=False) == ('Ted', 'Rogers'):
+            break
+        threading.Event().wait(0.01)
+    assert ('Ted', 'Rogers') == other.get_member(
+        socman.Member('12341234'), update_timestamp=False)
+
+
+def test_client_get_members(address):
+    """Test batched barcode lookups through the server."""
+    with socman_server.CheckinClient(address) as client:
+        assert {'12341234': ('Ted', 'Bobson')} == client.get_members(
+            ['12341234', '11111111'])
+
+
+def test_server_batches_new_members(db_file):
+    """Test that new members are committed in a batch, not one by one."""
+    checkin_server = socman_server.CheckinServer(
+        socman.MemberDatabase(db_file), commit_interval=60)
+    other = socman.MemberDatabase(db_file)
+
+    async def add_members():
+        for i in range(20):
+            response = checkin_server.handle_request(
+                '{{"op": "add", "barcode": "{}"}}'.format(i).encode())
+            assert b'{"ok": true, "result": null}\n' == response
+        # nothing is visible to other connections until the commit
+        assert 1 == other.member_count()
+        checkin_server.flush()
+        assert 21 == other.member_count()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(add_members())
+    loop.close()
+    checkin_server.db.close()
+    other.close()
+
+
+def test_server_ambiguous_barcode(db_file):
+    """Test that an ambiguous truncated barcode reports its matches."""
+    with socman.MemberDatabase(db_file, barcode_prefix_length=4) as mdb:
+        mdb.insert_records([socman.MemberRecord(barcode='12349999')])
+        checkin_server = socman_server.CheckinServer(mdb)
+        response = checkin_server.handle_request(
+            b'{"op": "lookup", "barcode": "1234"}')
+    assert {'ok': False, 'error': 'AmbiguousBarcodeError',
+            'barcodes': ['12341234', '12349999']} == json.loads(
+                response.decode())
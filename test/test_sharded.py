@@ -0,0 +1,147 @@
+"""
+test_sharded.py contains functional tests for ShardedMemberDatabase.
+
+Tests on socman should be run with `python -m pytest`. To run just these tests,
+run `pytest tests/test_sharded.py`.
+
+
+
+The MIT License (MIT)
+
+Copyright (c) 2016 Alexander Thorne
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# pylint: disable=redefined-outer-name
+import csv
+
+import pytest
+
+import socman
+
+
+MEMBERS = [socman.Member(str(10000000 + i),
+                         socman.Name('First{}'.format(i), 'Last{}'.format(i)),
+                         'Wolfson')
+           for i in range(30)]
+
+
+def shard_files(tmpdir, count, prefix='shard'):
+    """Return `count` shard filenames in `tmpdir`."""
+    return [str(tmpdir.join('{}{}.db'.format(prefix, i)))
+            for i in range(count)]
+
+
+@pytest.fixture
+def sdb(tmpdir):
+    """Return a ShardedMemberDatabase with three shards and 30 members."""
+    sdb_fixture = socman.ShardedMemberDatabase(shard_files(tmpdir, 3))
+    for member in MEMBERS:
+        sdb_fixture.add_member(member)
+    yield sdb_fixture
+    sdb_fixture.close()
+
+
+def test_sharded_routing(sdb):
+    """Test that members are spread over shards and found by barcode."""
+    assert 30 == sdb.member_count()
+    assert all(shard.member_count() for shard in sdb.shards)
+    for member in MEMBERS:
+        names = (member.name.first(), member.name.last())
+        assert names == sdb.get_member(socman.Member(member.barcode))
+        assert names == sdb.shard_for(member.barcode).get_member(
+            socman.Member(member.barcode))
+
+
+def test_sharded_get_member_by_name(sdb):
+    """Test that name lookups search every shard."""
+    for member in MEMBERS:
+        assert ((member.name.first(), member.name.last()) ==
+                sdb.get_member(socman.Member(None, member.name)))
+    with pytest.raises(socman.MemberNotFoundError):
+        sdb.get_member(socman.Member('99999999', socman.Name('No', 'One')))
+    with pytest.raises(socman.BadMemberError):
+        sdb.get_member(socman.Member(None))
+
+
+def test_sharded_autofix_moves_member(sdb):
+    """Test that autofixing a barcode moves the member to its new shard."""
+    old = MEMBERS[0]
+    barcode = next(str(20000000 + i) for i in range(100)
+                   if sdb.shard_index(str(20000000 + i)) !=
+                   sdb.shard_index(old.barcode))
+    member = socman.Member(barcode, old.name)
+    assert (('First0', 'Last0') ==
+            sdb.get_member(member, autofix=True))
+    assert 30 == sdb.member_count()
+    assert ('First0', 'Last0') == sdb.shard_for(barcode).get_member(
+        socman.Member(barcode))
+    with pytest.raises(socman.MemberNotFoundError):
+        sdb.get_member(socman.Member(old.barcode))
+
+
+@pytest.mark.parametrize('authority', ['barcode', 'name'])
+def test_sharded_update_member(sdb, authority):
+    """Test update_member with either authority."""
+    if authority == 'barcode':
+        member = socman.Member(MEMBERS[1].barcode, socman.Name('Ann', 'Lee'))
+    else:
+        member = socman.Member('30000000', MEMBERS[1].name)
+    sdb.update_member(member, authority=authority)
+    assert ((member.name.first(), member.name.last()) ==
+            sdb.get_member(socman.Member(member.barcode)))
+    assert 30 == sdb.member_count()
+
+
+def test_sharded_get_members(sdb):
+    """Test batched lookups across shards."""
+    found = sdb.get_members([member.barcode for member in MEMBERS] +
+                            ['99999999'])
+    assert 30 == len(found)
+    assert ('First5', 'Last5') == found[MEMBERS[5].barcode]
+
+
+def test_sharded_write_csv(sdb, tmpdir):
+    """Test that write_csv merges the rows of every shard."""
+    csv_path = str(tmpdir.join('members.csv'))
+    sdb.write_csv(csv_path)
+    with open(csv_path) as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert list(socman.MemberRecord._fields) == rows[0]
+    assert (sorted(member.barcode for member in MEMBERS) ==
+            sorted(row[3] for row in rows[1:]))
+
+
+@pytest.mark.parametrize('count', [1, 2, 5])
+def test_sharded_rebalance(sdb, tmpdir, count):
+    """Test rebalancing into a different number of shards."""
+    with sdb.rebalance(shard_files(tmpdir, count, 'new')) as new_sdb:
+        assert 30 == new_sdb.member_count()
+        for member in MEMBERS:
+            assert (('Wolfson', ) ==
+                    tuple(record.college for record in
+                          new_sdb.shard_for(member.barcode).get_records(
+                              member)))
+
+
+def test_sharded_rebalance_overlap(sdb, tmpdir):
+    """Test that rebalancing into an existing shard is refused."""
+    with pytest.raises(ValueError):
+        sdb.rebalance(shard_files(tmpdir, 2))